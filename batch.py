@@ -0,0 +1,249 @@
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import as_completed
+from contextlib import nullcontext
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime
+
+from proposals import (
+    PROPOSAL_CONFIG,
+    TEAM_ROLES,
+    build_placeholders,
+    format_special_fields,
+    team_placeholders,
+    validate_phone_number
+)
+from fragments import resolve_template
+from metrics import traced_render
+from pdf_export import PdfConverterPool
+from render_core import render_proposal
+from render_pool import RenderPool
+
+CHECKPOINT_NAME = "batch_checkpoint.jsonl"
+
+def read_rows(path):
+    """Load batch rows from a CSV file or a JSONL file (one object per line)"""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+    # Row ids name the output files and key the checkpoint, so they must be unique
+    for number, row in enumerate(rows, start=1):
+        row["id"] = str(row.get("id") or number)
+    ids = [row["id"] for row in rows]
+    if len(set(ids)) != len(ids):
+        raise ValueError("Row ids must be unique")
+    return rows
+
+def _amount(value):
+    if value in (None, ""):
+        return 0
+    return int(float(value))
+
+def _date(value):
+    if value in (None, ""):
+        return datetime.today()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value, "%Y-%m-%d")
+
+def row_to_placeholders(row):
+    """Build the same placeholder dict generate_document() builds for one row.
+
+    Columns are proposal, currency, client_name, client_email, client_number,
+    country, date (YYYY-MM-DD), tool_1, tool_2, plus one column per pricing
+    key, team placeholder and special field of the chosen proposal.
+    """
+    selected_proposal = row.get("proposal", "")
+    if selected_proposal not in PROPOSAL_CONFIG:
+        raise ValueError(f"Unknown proposal type: {selected_proposal!r}")
+    config = PROPOSAL_CONFIG[selected_proposal]
+    currency = row.get("currency") or "USD"
+
+    client_number = row.get("client_number") or ""
+    country = row.get("country") or ""
+    if client_number and country and not validate_phone_number(country, client_number):
+        raise ValueError(f"Invalid phone number format for {country}: {client_number}")
+
+    numerical_values = {key: _amount(row.get(key)) for _, key in config["pricing_fields"]}
+    team_counts = {
+        placeholder: _amount(row.get(placeholder))
+        for placeholder in TEAM_ROLES.get(config["team_type"], {}).values()
+    }
+    special_values = {}
+    for field, _ in config.get("special_fields", []):
+        if field == "VDate" or field == "validity_date":
+            special_values[field] = _date(row.get(field))
+        elif field in ["advnc_pay", "balnc_pay"]:
+            special_values[field] = _amount(row.get(field))
+        else:
+            special_values[field] = row.get(field) or ""
+
+    return build_placeholders(
+        selected_proposal,
+        client_name=row.get("client_name") or "",
+        client_email=row.get("client_email") or "",
+        client_number=client_number,
+        country=country,
+        date=_date(row.get("date")),
+        currency=currency,
+        numerical_values=numerical_values,
+        team_data=team_placeholders(config["team_type"], team_counts),
+        special_data=format_special_fields(selected_proposal, currency, special_values),
+        tools=(row.get("tool_1") or "", row.get("tool_2") or "")
+    )
+
+def output_filename(row):
+    """File name in the form the download button uses, with the row id for uniqueness"""
+    formatted_date = _date(row.get("date")).strftime("%d %b %Y")
+    name = f"{row['proposal']}_{row.get('client_name') or ''}_{formatted_date}_{row['id']}.docx"
+    return name.replace(os.sep, "-")
+
+def render_row(row, templates_dir, out_dir):
+    """Render one batch row to out_dir and return the output path (runs in a worker)"""
+    placeholders = row_to_placeholders(row)
+    template_path = os.path.join(templates_dir, PROPOSAL_CONFIG[row["proposal"]]["template"])
+    template_path = resolve_template(template_path)
+    out_path = os.path.join(out_dir, output_filename(row))
+    partial_path = out_path + ".part"
+    try:
+        with open(partial_path, "wb") as out, traced_render(row["proposal"], template_path):
+            render_proposal(template_path, placeholders, out=out)
+    except BaseException:
+        os.remove(partial_path)
+        raise
+    # Only complete files ever appear under the final name
+    os.replace(partial_path, out_path)
+    return out_path
+
+def load_checkpoint(path):
+    """Return ids of rows a previous run already rendered successfully"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Torn last line from a crash
+            if record.get("status") == "ok":
+                done.add(record["id"])
+            else:
+                done.discard(record["id"])
+    return done
+
+def batch_template_paths(rows, templates_dir):
+    """The templates `rows` render from, assembled where they use fragments"""
+    paths = {os.path.join(templates_dir, PROPOSAL_CONFIG[row["proposal"]]["template"])
+             for row in rows if row.get("proposal") in PROPOSAL_CONFIG}
+    return sorted(resolve_template(path) for path in paths if os.path.exists(path))
+
+def run_batch(rows, templates_dir, out_dir, workers=None, checkpoint_path=None, resume=True,
+              progress=None, pdf_pool=None, render_pool=None):
+    """Render every row across a RenderPool, returning {"ok": n, "failed": n, "skipped": n}.
+
+    Each finished row is appended to the checkpoint file straight away, so an
+    interrupted run picks up where it stopped when started again with resume.
+    With a pdf_pool, every rendered .docx also gets a .pdf next to it and the
+    row only counts as done once both exist. Without a render_pool, one of
+    `workers` processes is started for the batch.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    checkpoint_path = checkpoint_path or os.path.join(out_dir, CHECKPOINT_NAME)
+    done = load_checkpoint(checkpoint_path) if resume else set()
+    pending = [row for row in rows if row["id"] not in done]
+    counts = {"ok": 0, "failed": 0, "skipped": len(rows) - len(pending)}
+
+    with open(checkpoint_path, "a" if resume else "w", encoding="utf-8") as checkpoint:
+        def finish(row, output=None, error=None):
+            if error is None:
+                record = {"id": row["id"], "status": "ok", "output": output}
+                counts["ok"] += 1
+            else:
+                record = {"id": row["id"], "status": "error", "error": error}
+                counts["failed"] += 1
+            checkpoint.write(json.dumps(record) + "\n")
+            checkpoint.flush()
+            if progress:
+                progress(counts["ok"] + counts["failed"], len(pending), record)
+
+        pdf_futures = {}
+        # Workers are forked with the templates this batch needs already assembled and compiled
+        with (nullcontext(render_pool) if render_pool is not None
+              else RenderPool(workers, batch_template_paths(pending, templates_dir))) as pool:
+            futures = {pool.submit(render_row, row, templates_dir, out_dir): row for row in pending}
+            for future in as_completed(futures):
+                row = futures[future]
+                try:
+                    out_path = future.result()
+                except BrokenProcessPool:
+                    finish(row, error="worker process died")
+                    continue
+                except Exception as e:  # Isolate per-row failures
+                    finish(row, error=f"{type(e).__name__}: {e}")
+                    continue
+                if pdf_pool is None:
+                    finish(row, output=out_path)
+                    continue
+                try:
+                    # Blocks while the PDF queue is full, throttling the docx side
+                    with open(out_path, "rb") as f:
+                        pdf_futures[pdf_pool.submit(f.read())] = (row, out_path)
+                except Exception as e:  # A full queue or unreadable .docx fails only this row
+                    finish(row, error=f"{type(e).__name__}: {e}")
+
+        for future in as_completed(pdf_futures):
+            row, out_path = pdf_futures[future]
+            try:
+                pdf_path = os.path.splitext(out_path)[0] + ".pdf"
+                with open(pdf_path, "wb") as f:
+                    f.write(future.result())
+            except Exception as e:
+                finish(row, error=f"{type(e).__name__}: {e}")
+            else:
+                finish(row, output=out_path)
+    return counts
+
+def print_progress(finished, total, record):
+    status = "ok" if record["status"] == "ok" else f"FAILED ({record['error']})"
+    print(f"[{finished}/{total}] row {record['id']}: {status}", file=sys.stderr)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate proposals in bulk from a CSV or JSONL file")
+    parser.add_argument("rows", help="CSV or JSONL file, one row per client")
+    parser.add_argument("--out-dir", default="proposals_out")
+    parser.add_argument("--templates-dir", default=os.getcwd())
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--checkpoint", default=None,
+                        help=f"Checkpoint file (default: <out-dir>/{CHECKPOINT_NAME})")
+    parser.add_argument("--no-resume", action="store_true", help="Ignore and overwrite the checkpoint")
+    parser.add_argument("--pdf", action="store_true", help="Also convert every proposal to PDF")
+    parser.add_argument("--pdf-workers", type=int, default=None,
+                        help="LibreOffice processes for --pdf (default: PDFGEN_PDF_WORKERS or 2)")
+    args = parser.parse_args(argv)
+
+    rows = read_rows(args.rows)
+    # The render workers are forked before the PDF pool starts its threads, as a
+    # process running other threads can't be forked safely
+    with RenderPool(args.workers, batch_template_paths(rows, args.templates_dir)) as render_pool:
+        pdf_pool = None
+        if args.pdf:
+            pdf_pool = PdfConverterPool(**({"size": args.pdf_workers} if args.pdf_workers else {}))
+        try:
+            counts = run_batch(rows, args.templates_dir, args.out_dir,
+                               checkpoint_path=args.checkpoint, resume=not args.no_resume,
+                               progress=print_progress, pdf_pool=pdf_pool, render_pool=render_pool)
+        finally:
+            if pdf_pool is not None:
+                pdf_pool.close()
+    print(f"{counts['ok']} rendered, {counts['failed']} failed, "
+          f"{counts['skipped']} already done", file=sys.stderr)
+    return 1 if counts["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from render_core import render_proposal, render_proposal_bytes  # noqa: E402
+
+def io_counters():
+    """Read/write syscall counts of this process (Linux /proc/self/io)"""
+    counters = {}
+    with open("/proc/self/io") as f:
+        for line in f:
+            name, value = line.split(":")
+            counters[name] = int(value)
+    return counters
+
+def render_via_tempdir(template, placeholders, engine):
+    """The old Generate branch: save into a TemporaryDirectory, then reopen and read"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        doc_path = os.path.join(temp_dir, "proposal.docx")
+        with open(doc_path, "wb") as out:
+            render_proposal(template, placeholders, out=out, engine=engine)
+        with open(doc_path, "rb") as f:
+            return f.read()
+
+def render_in_memory(template, placeholders, engine):
+    return render_proposal_bytes(template, placeholders, engine=engine)
+
+def measure(fn, template, placeholders, engine, runs):
+    fn(template, placeholders, engine)  # Warm the page cache and template cache
+    before = io_counters()
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn(template, placeholders, engine)
+        timings.append(time.perf_counter() - start)
+    after = io_counters()
+    return {
+        "median_ms": statistics.median(timings) * 1000,
+        "syscr": (after["syscr"] - before["syscr"]) / runs,
+        "syscw": (after["syscw"] - before["syscw"]) / runs,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare temp-file and in-memory proposal output")
+    parser.add_argument("template", help="Path to a template .docx")
+    parser.add_argument("--engine", default="zip")
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    placeholders = {"<<client_name>>": "Benchmark Client", "<<date>>": "01-01-2026"}
+    for label, fn in (("tempdir + save + reopen", render_via_tempdir),
+                      ("in-memory buffer", render_in_memory)):
+        result = measure(fn, args.template, placeholders, args.engine, args.runs)
+        print(f"{label:24} {result['median_ms']:8.2f} ms  "
+              f"{result['syscr']:6.1f} read syscalls  {result['syscw']:6.1f} write syscalls")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from docx import Document
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compiled_template import compile_template, render_compiled  # noqa: E402
+from render import remove_empty_rows, replace_and_format  # noqa: E402
+from render_core import render_proposal_bytes  # noqa: E402
+
+# Bump when the generated templates change, so cached ones are rebuilt and
+# results from different generators aren't compared
+GENERATOR_VERSION = 1
+RESULTS_VERSION = 1
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+WORK_DIR = os.path.join(tempfile.gettempdir(), "pdfgen-bench-templates")
+
+SIZES = (100, 1000, 5000, 20000)
+QUICK_SIZES = (100, 1000)
+VARIANTS = ("paragraphs", "tables", "nested", "split")
+
+PLACEHOLDERS = {
+    "<<client_name>>": "Benchmark Client",
+    "<<date>>": "01-01-2026",
+    "<<price>>": "$1,000",
+    "<<optional_price>>": "",
+}
+PRICES = ("<<price>>", "<<optional_price>>", "$0", "$250")
+
+# A stage regresses when its median time or peak memory is this much above the
+# baseline's...
+REGRESSION_RATIO = 1.3
+# ...and above it by at least this much, so noise in small numbers isn't flagged
+REGRESSION_MIN = {"median_ms": 5.0, "peak_kib": 1024.0}
+
+def build_paragraphs(doc, n):
+    for i in range(n):
+        if i % 10 == 0:
+            doc.add_paragraph(f"Prepared for <<client_name>> on <<date>>, line {i}")
+        else:
+            doc.add_paragraph(f"Static proposal text {i} that never holds a placeholder")
+
+def _fill_price_table(table, offset):
+    for cell, text in zip(table.rows[0].cells, ("Description", "Qty", "Price")):
+        cell.text = text
+    for r, row in enumerate(table.rows[1:], start=1):
+        cells = row.cells
+        cells[0].text = f"Item {r} for <<client_name>>"
+        cells[1].text = "1"
+        cells[2].text = PRICES[(offset + r) % len(PRICES)]
+
+def build_tables(doc, n):
+    """About n cell paragraphs, in pricing tables of 20 rows"""
+    for t in range(max(1, n // 60)):
+        doc.add_paragraph(f"Section {t} for <<client_name>>")
+        _fill_price_table(doc.add_table(rows=20, cols=3), t)
+
+def build_nested(doc, n):
+    """About n cell paragraphs, in tables whose cells each hold a small pricing table"""
+    for t in range(max(1, n // 60)):
+        doc.add_paragraph(f"Section {t} for <<client_name>>")
+        outer = doc.add_table(rows=2, cols=3)
+        for i, cell in enumerate(c for row in outer.rows for c in row.cells):
+            cell.paragraphs[0].text = f"Block {i}"
+            _fill_price_table(cell.add_table(rows=3, cols=3), t + i)
+
+def build_split(doc, n):
+    """Paragraphs whose placeholders are split over three differently formatted runs"""
+    for i in range(n):
+        if i % 10 == 0:
+            p = doc.add_paragraph("Prepared for ")
+            p.add_run("<<client").bold = True
+            p.add_run("_na")
+            p.add_run("me>>").italic = True
+            p.add_run(f" on line {i}")
+        else:
+            doc.add_paragraph(f"Static proposal text {i} that never holds a placeholder")
+
+BUILDERS = {
+    "paragraphs": build_paragraphs,
+    "tables": build_tables,
+    "nested": build_nested,
+    "split": build_split,
+}
+
+def template_path(work_dir, variant, size):
+    """Generate the synthetic template once and return its path"""
+    path = os.path.join(work_dir, f"v{GENERATOR_VERSION}-{variant}-{size}.docx")
+    if not os.path.exists(path):
+        os.makedirs(work_dir, exist_ok=True)
+        doc = Document()
+        BUILDERS[variant](doc, size)
+        doc.save(path + ".part")
+        os.replace(path + ".part", path)
+    return path
+
+def docx_stages(path):
+    """The python-docx pipeline, split into (stage name, function of the previous result)"""
+    def prune(doc):
+        for table in doc.tables:
+            remove_empty_rows(table)
+        return doc
+
+    def save(doc):
+        out = io.BytesIO()
+        doc.save(out)
+        return out
+
+    return (
+        ("load", lambda _: Document(path)),
+        ("replace", lambda doc: replace_and_format(doc, PLACEHOLDERS)),
+        ("prune", prune),
+        ("save", save),
+    )
+
+def engine_stages(path):
+    """Whole renders by the faster engines, the compiled one split from its compile step"""
+    return (
+        ("render_xml", lambda _: render_proposal_bytes(path, PLACEHOLDERS, engine="xml")),
+        ("render_zip", lambda _: render_proposal_bytes(path, PLACEHOLDERS, engine="zip")),
+        ("compile", lambda _: compile_template(path)),
+        ("render_compiled",
+         lambda compiled: render_compiled(compiled, path, PLACEHOLDERS, io.BytesIO())),
+    )
+
+def run_stages(stages, runs):
+    """Median/min milliseconds and tracemalloc peak KiB of every stage"""
+    timings = {name: [] for name, _ in stages}
+    for _ in range(runs):
+        value = None
+        for name, fn in stages:
+            gc.collect()
+            start = time.perf_counter()
+            value = fn(value)
+            timings[name].append((time.perf_counter() - start) * 1000)
+
+    # Memory gets its own pass: tracing slows Python code down several times over
+    peaks = {}
+    value = None
+    tracemalloc.start()
+    try:
+        for name, fn in stages:
+            gc.collect()
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            value = fn(value)
+            peaks[name] = (tracemalloc.get_traced_memory()[1] - base) / 1024
+    finally:
+        tracemalloc.stop()
+
+    return {name: {"median_ms": round(statistics.median(times), 3), "min_ms": round(min(times), 3),
+                   "peak_kib": round(peaks[name], 1)}
+            for name, times in timings.items()}
+
+def run(sizes, variants, runs, work_dir, engines=True, progress=None):
+    results = {}
+    for variant in variants:
+        for size in sizes:
+            path = template_path(work_dir, variant, size)
+            stages = run_stages(docx_stages(path), runs)
+            if engines:
+                stages.update(run_stages(engine_stages(path), runs))
+            name = f"{variant}-{size}"
+            results[name] = {"variant": variant, "size": size, "file_bytes": os.path.getsize(path),
+                             "stages": stages}
+            if progress:
+                progress(name, results[name])
+    return {
+        "version": RESULTS_VERSION,
+        "generator": GENERATOR_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs",
+        "runs": runs,
+        "results": results,
+    }
+
+def compare(results, baseline, ratio=REGRESSION_RATIO, minimum=REGRESSION_MIN):
+    """(template, stage, metric, baseline value, value) for every stage over its allowance"""
+    if baseline.get("generator") != results["generator"]:
+        raise ValueError("Baseline was measured on templates from a different generator version")
+    regressions = []
+    for name, result in results["results"].items():
+        base_stages = baseline["results"].get(name, {}).get("stages", {})
+        for stage, timing in result["stages"].items():
+            base = base_stages.get(stage)
+            if base is None:
+                continue
+            for metric, least in minimum.items():
+                before, after = base[metric], timing[metric]
+                if after > before * ratio and after - before >= least:
+                    regressions.append((name, stage, metric, before, after))
+    return regressions
+
+def print_result(name, result):
+    stages = "  ".join(f"{stage} {timing['median_ms']:.1f} ms/{timing['peak_kib'] / 1024:.1f} MiB"
+                       for stage, timing in result["stages"].items())
+    print(f"{name:18} {stages}", file=sys.stderr)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Time each render stage on synthetic templates of growing size")
+    parser.add_argument("--sizes", type=int, nargs="+", default=None,
+                        help=f"Paragraph counts (default: {' '.join(map(str, SIZES))})")
+    parser.add_argument("--quick", action="store_true",
+                        help=f"Only sizes {' and '.join(map(str, QUICK_SIZES))}")
+    parser.add_argument("--variants", nargs="+", choices=VARIANTS, default=list(VARIANTS))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--no-engines", action="store_true",
+                        help="Only time the python-docx stages, not whole renders by each engine")
+    parser.add_argument("--work-dir", default=WORK_DIR, help="Where generated templates are kept")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", default=BASELINE, help="Results to compare against")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Store these results as the new baseline instead of comparing")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_RATIO,
+                        help=f"Flag stages this many times the baseline (default: {REGRESSION_RATIO})")
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else SIZES)
+    results = run(sizes, args.variants, args.runs, args.work_dir, engines=not args.no_engines,
+                  progress=print_result)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}", file=sys.stderr)
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to store one", file=sys.stderr)
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    for name, stage, metric, before, after in regressions:
+        unit = "ms" if metric == "median_ms" else "KiB"
+        print(f"REGRESSION {name} {stage}: {before:.1f} {unit} -> {after:.1f} {unit} "
+              f"({after / before - 1:+.0%})", file=sys.stderr)
+    if not regressions:
+        print(f"No regressions against {args.baseline}", file=sys.stderr)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
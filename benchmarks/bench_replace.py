@@ -0,0 +1,80 @@
+import argparse
+import copy
+import os
+import sys
+import timeit
+
+from docx import Document
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from render import apply_formatting, replace_in_paragraph, placeholder_pattern  # noqa: E402
+
+def legacy_replace_in_paragraph(para, placeholders):
+    """replace_in_paragraph() as it was before the single-pass engine"""
+    original_runs = para.runs.copy()
+    full_text = para.text
+    for ph, value in placeholders.items():
+        full_text = full_text.replace(ph, str(value))
+
+    if full_text != para.text:
+        para.clear()
+        new_run = para.add_run(full_text)
+        if original_runs:
+            original_run = next((r for r in original_runs if r.text), None)
+            if original_run:
+                apply_formatting(new_run, original_run)
+
+def build_placeholders(count):
+    """Placeholder dict shaped like the one generate_document() builds"""
+    return {f"<<field_{i}>>": f"value {i}" for i in range(count)}
+
+def build_document(paragraphs, placeholder_every, placeholders):
+    """Document where one paragraph in `placeholder_every` holds a placeholder"""
+    doc = Document()
+    keys = list(placeholders)
+    for i in range(paragraphs):
+        if i % placeholder_every == 0:
+            doc.add_paragraph(f"Prepared for {keys[i % len(keys)]} on a static line {i}")
+        else:
+            doc.add_paragraph(f"Static proposal text {i} that never contains a placeholder")
+    return doc
+
+def time_engine(doc, placeholders, replace, repeat):
+    """Best-of-`repeat` seconds for one replacement pass over a fresh copy"""
+    def run():
+        copy_doc = copy.deepcopy(doc)
+        for para in copy_doc.paragraphs:
+            replace(para)
+
+    def copy_only():
+        copy.deepcopy(doc).paragraphs
+
+    return min(timeit.repeat(run, number=1, repeat=repeat)) - min(
+        timeit.repeat(copy_only, number=1, repeat=repeat))
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare placeholder replacement engines")
+    parser.add_argument("--paragraphs", type=int, default=2000)
+    parser.add_argument("--placeholders", type=int, default=30)
+    parser.add_argument("--placeholder-every", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    placeholders = build_placeholders(args.placeholders)
+    doc = build_document(args.paragraphs, args.placeholder_every, placeholders)
+    pattern = placeholder_pattern(placeholders)
+
+    legacy = time_engine(doc, placeholders,
+                         lambda para: legacy_replace_in_paragraph(para, placeholders), args.repeat)
+    single_pass = time_engine(doc, placeholders,
+                              lambda para: replace_in_paragraph(para, placeholders, pattern), args.repeat)
+
+    print(f"{args.paragraphs} paragraphs, {args.placeholders} placeholders, "
+          f"1 in {args.placeholder_every} paragraphs templated")
+    print(f"legacy str.replace loop: {legacy * 1000:8.2f} ms")
+    print(f"single-pass regex:       {single_pass * 1000:8.2f} ms")
+    print(f"speed-up:                {legacy / single_pass:8.2f}x")
+
+if __name__ == "__main__":
+    main()
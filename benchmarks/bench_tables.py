@@ -0,0 +1,76 @@
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from docx import Document
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from render import remove_empty_rows, replace_and_format  # noqa: E402
+from render_core import render_proposal_bytes  # noqa: E402
+from template_cache import TemplateCache  # noqa: E402
+
+PLACEHOLDERS = {
+    "<<client_name>>": "Benchmark Client",
+    "<<MC-Price>>": "$1,000",
+    "<<M-Price>>": "$0",
+    "<<C-Price>>": "",
+    "<<T-Price>>": "$1,000",
+}
+
+def build_template(path, tables, rows):
+    """Template with `tables` pricing tables, some of whose rows price out empty"""
+    prices = ["<<MC-Price>>", "<<M-Price>>", "<<C-Price>>", "<<T-Price>>", "0"]
+    doc = Document()
+    doc.add_paragraph("Proposal for <<client_name>>")
+    for t in range(tables):
+        table = doc.add_table(rows=rows, cols=4)
+        for cell, text in zip(table.rows[0].cells, ("Description", "Qty", "Price", "Note")):
+            cell.text = text
+        for r in range(1, rows):
+            cells = table.rows[r].cells
+            cells[0].text = f"Item {r} for <<client_name>>"
+            cells[1].text = "1"
+            cells[2].text = prices[(t + r) % len(prices)]
+            cells[3].text = "static"
+    doc.save(path)
+
+def two_pass(template):
+    """The original flow: replace_and_format(), then remove_empty_rows() per table"""
+    doc = Document(template)
+    replace_and_format(doc, PLACEHOLDERS)
+    for table in doc.tables:
+        remove_empty_rows(table)
+
+def median_ms(fn, runs):
+    fn()
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Time rendering of a table-heavy template")
+    parser.add_argument("--tables", type=int, default=40)
+    parser.add_argument("--rows", type=int, default=25)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        template = os.path.join(temp_dir, "tables.docx")
+        build_template(template, args.tables, args.rows)
+        print(f"{args.tables} tables x {args.rows} rows")
+        print(f"{'two-pass python-docx':24} {median_ms(lambda: two_pass(template), args.runs):8.1f} ms")
+        for engine in ("docx", "xml", "zip", "compiled"):
+            cache = TemplateCache()
+            ms = median_ms(lambda: render_proposal_bytes(template, PLACEHOLDERS, engine=engine,
+                                                         template_cache=cache), args.runs)
+            print(f"{'fused, ' + engine + ' engine':24} {ms:8.1f} ms")
+
+if __name__ == "__main__":
+    main()
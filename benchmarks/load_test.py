@@ -0,0 +1,359 @@
+import argparse
+import glob
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch import row_to_placeholders, run_batch  # noqa: E402
+from output_cache import OutputCache  # noqa: E402
+from pricing import CURRENCY_SYMBOLS  # noqa: E402
+from proposals import PROPOSAL_CONFIG, TEAM_ROLES, template_paths  # noqa: E402
+from render_pool import process_memory  # noqa: E402
+from render_queue import RenderQueue  # noqa: E402
+from render_service import RenderClient, RenderService, make_server  # noqa: E402
+
+TARGETS = ("core", "queue", "http", "batch")
+STAND_IN_DIR = os.path.join(tempfile.gettempdir(), "pdfgen-load-test-templates")
+
+# Bump when stand-in templates change, so cached ones are rebuilt
+STAND_IN_VERSION = 1
+
+# Share of proposals quoted in each currency
+DEFAULT_CURRENCY_MIX = {"USD": 6, "INR": 3, "AUD": 1}
+LINE_ITEM_AMOUNTS = (0, 0, 500, 1200, 2500, 10000)
+
+def random_row(rng, n, proposals, weights, currencies, currency_weights):
+    """A batch.py row like one a rep fills in on the form"""
+    proposal = rng.choices(proposals, weights)[0]
+    config = PROPOSAL_CONFIG[proposal]
+    row = {
+        "id": str(n),
+        "proposal": proposal,
+        "currency": rng.choices(currencies, currency_weights)[0],
+        "client_name": f"Load Test Client {n}",
+        "client_email": f"client{n}@example.com",
+        "date": "2026-01-15",
+        "tool_1": "Make",
+        "tool_2": "HubSpot",
+    }
+    for _, key in config["pricing_fields"]:
+        row[key] = rng.choice(LINE_ITEM_AMOUNTS)
+    for placeholder in TEAM_ROLES.get(config["team_type"], {}).values():
+        row[placeholder] = rng.randint(0, 3)
+    for field, _ in config.get("special_fields", []):
+        if field in ("VDate", "validity_date"):
+            row[field] = "2026-02-15"
+        elif field in ("advnc_pay", "balnc_pay"):
+            row[field] = 1000
+        else:
+            row[field] = "Remote"
+    return row
+
+def build_stand_in_templates(directory=STAND_IN_DIR):
+    """Write a synthetic template for every PROPOSAL_CONFIG template, once; returns the directory.
+
+    Each holds every placeholder its proposal fills in, a pricing table whose
+    rows get pruned like the real ones, and a few pages of static text, so
+    runs need none of the real templates.
+    """
+    from docx import Document
+
+    directory = os.path.join(directory, f"v{STAND_IN_VERSION}")
+    os.makedirs(directory, exist_ok=True)
+    for proposal, config in PROPOSAL_CONFIG.items():
+        path = os.path.join(directory, config["template"])
+        if os.path.exists(path):
+            continue
+        placeholders = row_to_placeholders({"proposal": proposal})
+        doc = Document()
+        doc.add_heading(f"{proposal} proposal for <<Client Name>>", level=1)
+        for key in placeholders:
+            doc.add_paragraph(f"{key.strip('<>')}: {key}")
+        table = doc.add_table(rows=1, cols=3)
+        for cell, text in zip(table.rows[0].cells, ("Description", "Qty", "Price")):
+            cell.text = text
+        for label, key in config["pricing_fields"]:
+            cells = table.add_row().cells
+            cells[0].text, cells[1].text, cells[2].text = label, "1", f"<<{key}>>"
+        for i in range(300):
+            doc.add_paragraph(f"Static proposal text {i} describing scope, timeline and terms.")
+        doc.save(path + ".part")
+        os.replace(path + ".part", path)
+    return directory
+
+class CoreTarget:
+    """Renders in this process through RenderService, the way the app does without a service"""
+
+    def __init__(self, templates_dir, output_cache=None):
+        self.service = RenderService(templates_dir, output_cache=output_cache)
+        self.service.warm_up()
+
+    def render(self, user, row):
+        return self.service.render(row["proposal"], row_to_placeholders(row))
+
+    def close(self):
+        self.service.close()
+
+class QueueTarget(CoreTarget):
+    """Renders through a RenderQueue, as the app's Generate button does"""
+
+    def __init__(self, templates_dir, output_cache=None, workers=None):
+        super().__init__(templates_dir, output_cache)
+        self.queue = RenderQueue(**({"workers": workers} if workers else {}))
+
+    def render(self, user, row):
+        job = self.queue.submit(user, lambda job: CoreTarget.render(self, user, row))
+        return job.result()
+
+    def close(self):
+        self.queue.close()
+        super().close()
+
+class HttpTarget:
+    """Renders through a render service; without a URL, through one started here"""
+
+    def __init__(self, templates_dir, url=None, workers=0, output_cache=None):
+        self.service = self.server = None
+        if url is None:
+            self.service = RenderService(templates_dir, workers=workers, output_cache=output_cache)
+            self.service.warm_up()
+            self.server = make_server(self.service, port=0)
+            self.server.RequestHandlerClass.log_message = lambda *args: None
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            url = f"http://127.0.0.1:{self.server.server_port}"
+        self.client = RenderClient(url)
+
+    def render(self, user, row):
+        return self.client.render(row["proposal"], row_to_placeholders(row))
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.service.close()
+
+def child_pids(pid="self"):
+    """Every descendant process of `pid` (render pool workers, LibreOffice)"""
+    pids = []
+    for path in glob.glob(f"/proc/{pid}/task/*/children"):
+        try:
+            with open(path, encoding="ascii") as f:
+                children = [int(child) for child in f.read().split()]
+        except OSError:
+            continue
+        for child in children:
+            pids.append(child)
+            pids.extend(child_pids(child))
+    return pids
+
+def rss_sample():
+    """(RSS of this process, total RSS of its descendants) in bytes"""
+    children = sum(process_memory(pid).get("Rss", 0) for pid in child_pids())
+    return process_memory().get("Rss", 0), children
+
+class RssSampler(threading.Thread):
+    def __init__(self, interval, completed):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.completed = completed
+        self.samples = []
+        self._stopped = threading.Event()
+        self._start = time.perf_counter()
+
+    def run(self):
+        while True:
+            own, children = rss_sample()
+            self.samples.append({"t": round(time.perf_counter() - self._start, 2), "rss": own,
+                                 "children_rss": children, "completed": self.completed()})
+            if self._stopped.wait(self.interval):
+                break
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+def drive(target, users, duration, max_requests, think, seed, mix, currency_mix, latencies, errors):
+    """Run `users` simulated reps against `target`, appending seconds per render to latencies
+    and counting failures by exception type in errors"""
+    proposals, weights = list(mix), list(mix.values())
+    currencies, currency_weights = list(currency_mix), list(currency_mix.values())
+    lock = threading.Lock()
+    issued = [0]
+    deadline = time.perf_counter() + duration if duration else None
+
+    def user(i):
+        rng = random.Random(seed + i)
+        name = f"user-{i}"
+        while deadline is None or time.perf_counter() < deadline:
+            with lock:
+                if max_requests and issued[0] >= max_requests:
+                    return
+                issued[0] += 1
+                n = issued[0]
+            row = random_row(rng, n, proposals, weights, currencies, currency_weights)
+            start = time.perf_counter()
+            try:
+                target.render(name, row)
+            except Exception as e:
+                with lock:
+                    errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            else:
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+            if think:
+                time.sleep(rng.expovariate(1 / think))
+
+    threads = [threading.Thread(target=user, args=(i,), daemon=True) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+def drive_batch(templates_dir, rows, workers, latencies, errors):
+    """Run the rows through batch.run_batch(); latencies are each row's time to completion,
+    pool start-up included"""
+    started = time.perf_counter()
+
+    def progress(finished, total, record):
+        if record["status"] == "ok":
+            latencies.append(time.perf_counter() - started)
+        else:
+            kind = record["error"].split(":")[0]
+            errors[kind] = errors.get(kind, 0) + 1
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        run_batch(rows, templates_dir, out_dir, workers=workers, resume=False, progress=progress)
+
+def percentiles(latencies):
+    if len(latencies) < 2:
+        return {}
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {"p50": cuts[49] * 1000, "p95": cuts[94] * 1000, "p99": cuts[98] * 1000,
+            "max": max(latencies) * 1000}
+
+def parse_weights(pairs, known, what):
+    weights = {}
+    for pair in pairs:
+        name, _, weight = pair.rpartition("=")
+        if name not in known:
+            raise SystemExit(f"Unknown {what}: {name!r}")
+        weights[name] = float(weight)
+    return weights
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Load-test proposal rendering with many simulated reps at once")
+    parser.add_argument("--target", choices=TARGETS, default="core",
+                        help="core: RenderService in this process; queue: through a RenderQueue "
+                             "like the app; http: a render service; batch: batch.run_batch()")
+    parser.add_argument("--users", type=int, default=8, help="Concurrent simulated reps")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run (0: no limit)")
+    parser.add_argument("--requests", type=int, default=0,
+                        help="Stop after this many renders (required for --target batch)")
+    parser.add_argument("--think", type=float, default=0,
+                        help="Mean seconds a rep waits between proposals (default: none)")
+    parser.add_argument("--templates-dir", default=None,
+                        help="Real templates (default: synthetic stand-ins for every proposal type)")
+    parser.add_argument("--url", default=None,
+                        help="Render service for --target http (default: start one here)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Render processes for the local render service or batch pool, "
+                             "worker threads for --target queue")
+    parser.add_argument("--cache", action="store_true",
+                        help="Use an output cache (in a temporary directory)")
+    parser.add_argument("--mix", nargs="+", default=[], metavar="PROPOSAL=WEIGHT",
+                        help="Relative frequency of proposal types (default: all equally often)")
+    parser.add_argument("--currencies", nargs="+", default=[], metavar="CODE=WEIGHT",
+                        help="Relative frequency of currencies (default: USD=6 INR=3 AUD=1)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="Seconds between RSS samples")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args(argv)
+    if args.target == "batch" and not args.requests:
+        parser.error("--target batch needs --requests")
+    if not args.duration and not args.requests:
+        parser.error("give --duration or --requests")
+
+    templates_dir = args.templates_dir
+    if templates_dir is None:
+        templates_dir = build_stand_in_templates()
+    elif not any(os.path.exists(path) for path in template_paths(templates_dir)):
+        parser.error(f"No templates in {templates_dir}")
+    mix = parse_weights(args.mix, PROPOSAL_CONFIG, "proposal type") or dict.fromkeys(PROPOSAL_CONFIG, 1)
+    # Only proposal types whose template is there can be rendered
+    mix = {proposal: weight for proposal, weight in mix.items()
+           if os.path.exists(os.path.join(templates_dir, PROPOSAL_CONFIG[proposal]["template"]))}
+    currency_mix = parse_weights(args.currencies, CURRENCY_SYMBOLS, "currency") or DEFAULT_CURRENCY_MIX
+
+    cache_dir = tempfile.TemporaryDirectory() if args.cache else None
+    output_cache = OutputCache(cache_dir.name) if cache_dir else None
+    print(f"Starting {args.target} target with templates from {templates_dir}", file=sys.stderr)
+    start_rss = rss_sample()
+    setup = time.perf_counter()
+    target = None
+    if args.target == "core":
+        target = CoreTarget(templates_dir, output_cache)
+    elif args.target == "queue":
+        target = QueueTarget(templates_dir, output_cache, workers=args.workers or None)
+    elif args.target == "http":
+        target = HttpTarget(templates_dir, args.url, workers=args.workers, output_cache=output_cache)
+    setup = time.perf_counter() - setup
+
+    latencies = []
+    errors = {}
+    sampler = RssSampler(args.sample_interval, lambda: len(latencies))
+    sampler.start()
+    started = time.perf_counter()
+    try:
+        if target is None:
+            rng = random.Random(args.seed)
+            rows = [random_row(rng, n, list(mix), list(mix.values()), list(currency_mix),
+                               list(currency_mix.values())) for n in range(1, args.requests + 1)]
+            drive_batch(templates_dir, rows, args.workers or None, latencies, errors)
+        else:
+            drive(target, args.users, args.duration, args.requests, args.think, args.seed, mix,
+                  currency_mix, latencies, errors)
+    finally:
+        elapsed = time.perf_counter() - started
+        sampler.stop()
+        if target is not None:
+            target.close()
+        if cache_dir is not None:
+            cache_dir.cleanup()
+
+    summary = {
+        "target": args.target,
+        "users": args.users,
+        "seconds": round(elapsed, 2),
+        "setup_seconds": round(setup, 2),
+        "ok": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_ms": percentiles(latencies),
+        "rss_start": start_rss[0] + start_rss[1],
+        "rss_peak": max(s["rss"] + s["children_rss"] for s in sampler.samples),
+        "rss_samples": sampler.samples,
+    }
+    who = "one batch" if args.target == "batch" else f"{args.users} users"
+    print(f"{summary['ok']} proposals in {elapsed:.1f} s by {who} "
+          f"({summary['throughput']:.1f}/s), {sum(errors.values())} failed"
+          + (f" {errors}" if errors else ""))
+    if summary["latency_ms"]:
+        print("latency " + "  ".join(f"{name} {ms:.0f} ms" for name, ms in summary["latency_ms"].items()))
+    print(f"RSS {summary['rss_start'] / 2**20:.0f} MiB at start, {summary['rss_peak'] / 2**20:.0f} MiB "
+          f"at peak (this process and its children, sampled every {args.sample_interval:g} s)")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,579 @@
+import argparse
+import io
+import multiprocessing
+import os
+import re
+import struct
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsmap
+from lxml import etree
+
+import metrics
+from render import (
+    PLACEHOLDER_MARK,
+    is_empty_price_row,
+    placeholder_pattern,
+    rendered_cell_text,
+    substitute_placeholders_counted
+)
+from template_cache import StampedCache, file_sha256, file_stamp
+from xml_render import (
+    cell_texts_xml,
+    center_cell_xml,
+    paragraph_text_xml,
+    placeholders_in_text_nodes_xml,
+    rebuild_paragraph_xml,
+    row_cells_xml,
+    story_paragraphs_xml,
+    text_nodes_xml
+)
+from zip_render import (
+    ESCAPED_MARK,
+    copy_raw_entry,
+    find_parts,
+    is_normalized_package,
+    render_main_part,
+    render_story_part,
+    serialize_part,
+    write_part,
+    write_part_chunks
+)
+
+ARTIFACT_SUFFIX = ".pdfgen"
+ARTIFACT_MAGIC = b"PDFGEN-SEGMENTS\n"
+
+# Bump whenever the op layout, the artifact encoding or the rendering it encodes changes
+FORMAT_VERSION = 3
+
+# Magic, format version, template sha256, normalized; then the encoded parts
+_ARTIFACT_HEADER = struct.Struct(f">{len(ARTIFACT_MAGIC)}sH32s?")
+_LENGTH = struct.Struct(">I")
+_INT = struct.Struct(">q")
+_CONSTANTS = {"N": None, "T": True, "F": False}
+
+# Op kinds of a compiled part
+STATIC = 0  # (STATIC, bytes)
+PARAGRAPH = 1  # (PARAGRAPH, text, original bytes, prefix, suffix, empty-run bytes)
+PRICE_ROW = 2  # (PRICE_ROW, first cell texts, price cell texts, index of the op after the row)
+TEXT_NODE = 3  # (TEXT_NODE, text, original bytes), one w:t of a normalized template
+
+_MARKER_TARGET = "pdfgen"
+_MARKER = re.compile(rb"<\?pdfgen (\w+)(?: (\d+))?\?>")
+_XML_INCOMPATIBLE = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+_RUN_CONTENT_SPLIT = re.compile("([\t\r\n])")
+
+class CompiledTemplate:
+    """A template reduced to byte segments, ready to render without XML parsing.
+
+    `parts` maps zip member names to (is main part, op list); an op list of
+    None means the part holds placeholders the segment format can't express
+    and is rendered through the parsing path instead. Members not listed are
+    copied from the template untouched. `normalized` records whether the
+    template went through normalize_template.py.
+    """
+
+    def __init__(self, template_sha256, parts, normalized=False):
+        self.template_sha256 = template_sha256
+        self.parts = parts
+        self.normalized = normalized
+
+def artifact_path(template_path):
+    """Where the compiled form of a template is stored: right next to it"""
+    return template_path + ARTIFACT_SUFFIX
+
+def compile_template(template_path):
+    """Compile a template .docx into a CompiledTemplate"""
+    parts = {}
+    with zipfile.ZipFile(template_path) as zin:
+        main_parts, story_parts, settings_parts = find_parts(zin)
+        normalized = is_normalized_package(zin, settings_parts)
+        for name in sorted(main_parts | story_parts):
+            xml = zin.read(name)
+            if name in main_parts:
+                parts[name] = (True, compile_part(xml, main=True, normalized=normalized))
+            elif ESCAPED_MARK in xml:
+                parts[name] = (False, compile_part(xml, main=False, normalized=normalized))
+    return CompiledTemplate(file_sha256(template_path), parts, normalized)
+
+def compile_part(xml, main, normalized=False):
+    """Op list rendering one part the way render_main_part()/render_story_part() do.
+
+    The part is serialized twice with processing-instruction markers around
+    every placeholder paragraph and pruneable row: once as the template has
+    it and once with each paragraph already rebuilt around an empty run. The
+    bytes between markers become the static segments and slot pieces. In a
+    normalized template the slots are the w:t elements holding placeholders.
+    Returns None when the part can't be expressed as segments.
+    """
+    root = parse_xml(xml)
+    # Run content is emitted as literal w:t/w:tab/w:br markup
+    if root.nsmap.get("w") != nsmap["w"]:
+        return None
+
+    if main:
+        rows = _mark_price_rows(root.body, center=not normalized)
+        story = root.body
+    else:
+        rows = []
+        story = root
+    paragraphs = []
+    text_nodes = []
+    for p in story_paragraphs_xml(story):
+        if PLACEHOLDER_MARK not in paragraph_text_xml(p):
+            continue
+        if normalized and placeholders_in_text_nodes_xml(p):
+            text_nodes.extend(t for t in text_nodes_xml(p) if PLACEHOLDER_MARK in (t.text or ""))
+        else:
+            paragraphs.append(p)
+    slots = set(paragraphs)
+    # A slot is rendered as a whole, so it can't contain another one (a text
+    # box anchored in a paragraph that also holds placeholders)
+    if any(ancestor in slots for e in paragraphs + text_nodes for ancestor in e.iterancestors()):
+        return None
+
+    texts = []
+    for n, p in enumerate(paragraphs):
+        texts.append(paragraph_text_xml(p))
+        p.addprevious(_marker("slot", n))
+        p.addnext(_marker("end", n))
+    node_texts = []
+    for n, t in enumerate(text_nodes):
+        node_texts.append(t.text)
+        t.addprevious(_marker("node", n))
+        t.addnext(_marker("nodeend", n))
+    original = serialize_part(root)
+
+    for p in paragraphs:
+        rebuild_paragraph_xml(p, "").append(_marker("text"))
+    rebuilt = dict(_slot_pieces(serialize_part(root)))
+
+    ops = []
+    static = []
+    pending_rows = {}
+
+    def flush_static():
+        if static:
+            ops.append((STATIC, b"".join(static)))
+            static.clear()
+
+    tokens = _MARKER.split(original)
+    # split() yields: bytes, kind, number, bytes, kind, number, ...
+    static.append(tokens[0])
+    i = 1
+    while i < len(tokens):
+        kind, number, following = tokens[i].decode(), tokens[i + 1], tokens[i + 2]
+        n = int(number) if number is not None else None
+        if kind == "row":
+            flush_static()
+            pending_rows[n] = len(ops)
+            ops.append(None)
+            static.append(following)
+        elif kind == "rowend":
+            flush_static()
+            first, price = rows[n]
+            ops[pending_rows.pop(n)] = (PRICE_ROW, first, price, len(ops))
+            static.append(following)
+        elif kind == "slot":
+            flush_static()
+            # The slot's original bytes run up to its end marker
+            end_kind, end_number, after = tokens[i + 3], tokens[i + 4], tokens[i + 5]
+            assert end_kind == b"end" and int(end_number) == n
+            prefix, suffix = rebuilt[n]
+            ops.append((PARAGRAPH, texts[n], following, prefix, suffix, _empty_run(prefix, suffix)))
+            static.append(after)
+            i += 3
+        elif kind == "node":
+            flush_static()
+            end_kind, end_number, after = tokens[i + 3], tokens[i + 4], tokens[i + 5]
+            assert end_kind == b"nodeend" and int(end_number) == n
+            ops.append((TEXT_NODE, node_texts[n], following))
+            static.append(after)
+            i += 3
+        i += 3
+    flush_static()
+    return ops
+
+def _marker(kind, n=None):
+    return etree.ProcessingInstruction(_MARKER_TARGET, kind if n is None else f"{kind} {n}")
+
+def _mark_price_rows(body, center=True):
+    """Centre top-level table cells and mark the rows remove_empty_rows() checks.
+
+    Cell alignment doesn't depend on the values, so it is baked into the
+    static bytes; returns (first cell texts, price cell texts) per marked row.
+    """
+    rows = []
+    for tbl in body.iterchildren(f"{{{nsmap['w']}}}tbl"):
+        for tr in tbl.tr_lst:
+            cells = row_cells_xml(tr)
+            if center:
+                for tc in cells:
+                    center_cell_xml(tc)
+            if len(cells) > 2:
+                tr.addprevious(_marker("row", len(rows)))
+                tr.addnext(_marker("rowend", len(rows)))
+                rows.append((cell_texts_xml(cells[0]), cell_texts_xml(cells[2])))
+    return rows
+
+def _slot_pieces(rebuilt):
+    tokens = _MARKER.split(rebuilt)
+    for i in range(1, len(tokens), 3):
+        if tokens[i] == b"slot":
+            # slot, text marker, end: the bytes before and after the text marker
+            assert tokens[i + 3] == b"text" and tokens[i + 6] == b"end"
+            yield int(tokens[i + 1]), (tokens[i + 2], tokens[i + 5])
+
+def _empty_run(prefix, suffix):
+    # lxml writes a run left with no children as a self-closing tag
+    if prefix.endswith(b"<w:r>") and suffix.startswith(b"</w:r>"):
+        return prefix[:-len(b"<w:r>")] + b"<w:r/>" + suffix[len(b"</w:r>"):]
+    return prefix + suffix
+
+def run_content_xml(text):
+    """Run content markup for `text`, as the r.text setter and lxml write it"""
+    if _XML_INCOMPATIBLE.search(text):
+        raise ValueError("All strings must be XML compatible: Unicode or ASCII, "
+                         "no NULL bytes or control characters")
+    chunks = []
+    for piece in _RUN_CONTENT_SPLIT.split(text):
+        if piece == "\t":
+            chunks.append("<w:tab/>")
+        elif piece in ("\r", "\n"):
+            chunks.append("<w:br/>")
+        elif piece:
+            escaped = piece.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+            if len(piece.strip()) < len(piece):
+                chunks.append(f'<w:t xml:space="preserve">{escaped}</w:t>')
+            else:
+                chunks.append(f"<w:t>{escaped}</w:t>")
+    return "".join(chunks).encode("utf-8")
+
+def render_ops(ops, placeholders, pattern):
+    """Join a compiled part's segments with the placeholder values filled in"""
+    return b"".join(iter_render_ops(ops, placeholders, pattern))
+
+def iter_render_ops(ops, placeholders, pattern):
+    """The byte chunks render_ops() joins, one at a time"""
+    visited = replaced = removed = 0
+    i = 0
+    while i < len(ops):
+        op = ops[i]
+        kind = op[0]
+        if kind == STATIC:
+            yield op[1]
+        elif kind == PARAGRAPH:
+            _, text, original, prefix, suffix, empty = op
+            full_text, n = substitute_placeholders_counted(text, placeholders, pattern)
+            visited += 1
+            replaced += n
+            if full_text == text:
+                yield original
+            elif full_text:
+                yield prefix
+                yield run_content_xml(full_text)
+                yield suffix
+            else:
+                yield empty
+        elif kind == TEXT_NODE:
+            _, text, original = op
+            full_text, n = substitute_placeholders_counted(text, placeholders, pattern)
+            visited += 1
+            replaced += n
+            if full_text == text:
+                yield original
+            elif full_text:
+                yield run_content_xml(full_text)
+            else:
+                yield b"<w:t/>"
+        elif is_empty_price_row(rendered_cell_text(op[1], placeholders, pattern),
+                                rendered_cell_text(op[2], placeholders, pattern)):
+            i = op[3]
+            removed += 1
+            continue
+        i += 1
+    metrics.count("paragraphs_visited", visited)
+    metrics.count("placeholders_replaced", replaced)
+    metrics.count("rows_removed", removed)
+
+def render_compiled(compiled, template, placeholders, out):
+    """Render a proposal from its compiled form; same bytes as render_docx().
+
+    Parts with segments are streamed into the output as they are joined, and
+    media is copied in chunks, so a render holds about STREAM_CHUNK_SIZE of
+    its output at a time besides whatever `out` keeps in memory.
+    """
+    pattern = placeholder_pattern(placeholders)
+    with zipfile.ZipFile(template) as zin, zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zout:
+        replace_seconds = save_seconds = 0.0
+        for info in zin.infolist():
+            start = time.perf_counter()
+            ops = compiled.parts.get(info.filename, (False, None))[1]
+            if ops is not None:
+                # Joining the segments is interleaved with compressing them
+                written = write_part_chunks(zout, info, iter_render_ops(ops, placeholders, pattern))
+                replace_seconds += time.perf_counter() - start - written
+                save_seconds += written
+                continue
+            xml = render_compiled_part(compiled, zin, info, placeholders, pattern)
+            rendered = time.perf_counter()
+            if xml is None:
+                copy_raw_entry(zin, info, zout)
+            else:
+                write_part(zout, info, xml)
+            replace_seconds += rendered - start
+            save_seconds += time.perf_counter() - rendered
+    metrics.add_stage("replace", replace_seconds)
+    metrics.add_stage("save", save_seconds)
+    return out
+
+def render_compiled_part(compiled, zin, info, placeholders, pattern):
+    """Rendered bytes of one template member, or None when it is copied unchanged"""
+    main, ops = compiled.parts.get(info.filename, (False, None))
+    if ops is not None:
+        return render_ops(ops, placeholders, pattern)
+    if info.filename not in compiled.parts:
+        return None
+    if main:
+        return render_main_part(zin.read(info), placeholders, pattern, compiled.normalized)
+    return render_story_part(zin.read(info), placeholders, pattern, compiled.normalized)
+
+def render_compiled_variants(compiled, template, variants):
+    """Render one template with several placeholder dicts; returns a BytesIO per variant.
+
+    A part is rendered once per distinct set of values it actually shows;
+    when a later variant shows the same values, the member is copied in its
+    compressed form from the output that already has it. The work therefore
+    grows with the differences between variants, not their number, and
+    every output has the bytes render_compiled() gives it alone.
+    """
+    part_texts = {name: _part_text(ops) for name, (_, ops) in compiled.parts.items()}
+    outputs = []
+    readers = {}
+    rendered = {}  # (member, values it shows) -> index of the output holding it
+    try:
+        with zipfile.ZipFile(template) as zin:
+            infos = zin.infolist()
+            for placeholders in variants:
+                pattern = placeholder_pattern(placeholders)
+                out = io.BytesIO()
+                with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zout:
+                    for info in infos:
+                        if info.filename not in compiled.parts:
+                            copy_raw_entry(zin, info, zout)
+                            continue
+                        key = (info.filename, _values_shown(placeholders, part_texts[info.filename]))
+                        earlier = rendered.get(key)
+                        if earlier is not None:
+                            if earlier not in readers:
+                                readers[earlier] = zipfile.ZipFile(outputs[earlier])
+                            reader = readers[earlier]
+                            copy_raw_entry(reader, reader.getinfo(info.filename), zout)
+                            continue
+                        xml = render_compiled_part(compiled, zin, info, placeholders, pattern)
+                        if xml is None:
+                            copy_raw_entry(zin, info, zout)
+                        else:
+                            write_part(zout, info, xml)
+                            rendered[key] = len(outputs)
+                outputs.append(out)
+    finally:
+        for reader in readers.values():
+            reader.close()
+    for out in outputs:
+        out.seek(0)
+    return outputs
+
+def _part_text(ops):
+    """All template text a compiled part substitutes into, or None when it wasn't compiled"""
+    if ops is None:
+        return None
+    texts = []
+    for op in ops:
+        if op[0] in (PARAGRAPH, TEXT_NODE):
+            texts.append(op[1])
+        elif op[0] == PRICE_ROW:
+            texts.extend(op[1])
+            texts.extend(op[2])
+    return "\0".join(texts)
+
+def _values_shown(placeholders, text):
+    # Only keys occurring in the part's text can match, so the others can't change
+    # its bytes; a part parsed at render time depends on every value
+    return tuple(sorted(
+        (key, str(value)) for key, value in placeholders.items() if text is None or key in text))
+
+def write_artifact(compiled, path):
+    """Store a CompiledTemplate at `path`, atomically"""
+    out = [_ARTIFACT_HEADER.pack(ARTIFACT_MAGIC, FORMAT_VERSION, bytes.fromhex(compiled.template_sha256),
+                                 compiled.normalized)]
+    _encode(compiled.parts, out)
+    partial_path = path + ".part"
+    with open(partial_path, "wb") as f:
+        f.writelines(out)
+    os.replace(partial_path, path)
+
+def read_artifact(path, template_sha256):
+    """Load the CompiledTemplate at `path`, or None when missing, out of date or malformed.
+
+    Artifacts sit next to templates, some in the shared temp directory, so
+    they only ever decode to plain data (see _encode()): a planted file can
+    at worst fail to load. The header is checked before anything else is.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, sha256, normalized = _ARTIFACT_HEADER.unpack_from(data)
+        if (magic != ARTIFACT_MAGIC or version != FORMAT_VERSION
+                or sha256 != bytes.fromhex(template_sha256)):
+            return None
+        parts, end = _decode(memoryview(data), _ARTIFACT_HEADER.size)
+        if end != len(data) or not isinstance(parts, dict):
+            return None
+    except (OSError, ValueError, TypeError, IndexError, struct.error, RecursionError):
+        return None
+    return CompiledTemplate(template_sha256, parts, normalized)
+
+def _encode(value, out):
+    """Append the artifact encoding of `value` to the list `out`.
+
+    Only None, bools, ints, str, bytes, tuples, lists and dicts are written:
+    a tag byte, then a length or the value itself, then any items.
+    """
+    if value is None:
+        out.append(b"N")
+    elif value is True or value is False:
+        out.append(b"T" if value else b"F")
+    elif isinstance(value, int):
+        out.append(b"i" + _INT.pack(value))
+    elif isinstance(value, (str, bytes)):
+        data = value.encode("utf-8") if isinstance(value, str) else value
+        out.append((b"s" if isinstance(value, str) else b"b") + _LENGTH.pack(len(data)))
+        out.append(data)
+    elif isinstance(value, (tuple, list)):
+        out.append((b"t" if isinstance(value, tuple) else b"l") + _LENGTH.pack(len(value)))
+        for item in value:
+            _encode(item, out)
+    elif isinstance(value, dict):
+        out.append(b"d" + _LENGTH.pack(len(value)))
+        for key, item in value.items():
+            _encode(key, out)
+            _encode(item, out)
+    else:
+        raise TypeError(f"Can't store {type(value).__name__} in an artifact")
+
+def _decode(data, pos):
+    """(value, position after it) of the value _encode() wrote at `pos`"""
+    tag = chr(data[pos])
+    pos += 1
+    if tag in _CONSTANTS:
+        return _CONSTANTS[tag], pos
+    if tag == "i":
+        return _INT.unpack_from(data, pos)[0], pos + _INT.size
+    (n,) = _LENGTH.unpack_from(data, pos)
+    pos += _LENGTH.size
+    if tag in "sb":
+        if pos + n > len(data):
+            raise ValueError("Truncated artifact")
+        chunk = data[pos:pos + n]
+        return (str(chunk, "utf-8") if tag == "s" else bytes(chunk)), pos + n
+    if tag in "tl":
+        items = []
+        for _ in range(n):
+            item, pos = _decode(data, pos)
+            items.append(item)
+        return (tuple(items) if tag == "t" else items), pos
+    if tag == "d":
+        items = {}
+        for _ in range(n):
+            key, pos = _decode(data, pos)
+            items[key], pos = _decode(data, pos)
+        return items, pos
+    raise ValueError(f"Unknown artifact tag {tag!r}")
+
+class CompiledTemplates:
+    """Process-wide compiled templates, loaded from their artifacts once.
+
+    A template whose artifact is missing or was compiled from different
+    bytes is compiled in memory instead, so a stale artifact can never be
+    served; run this module to refresh the files on disk.
+    """
+
+    def __init__(self):
+        self._entries = StampedCache(load_compiled)
+
+    def get(self, template_path):
+        return self._entries.get(template_path)
+
+    def preload(self, template_paths, workers=1):
+        """Load every template that exists; returns {template path: seconds it took}.
+
+        With workers > 1, templates without an up-to-date artifact are compiled
+        that many at a time in separate processes, as compiling holds the GIL.
+        """
+        seconds = {}
+        stale = {}
+        for path in template_paths:
+            if not os.path.exists(path):
+                continue
+            start = time.perf_counter()
+            stamp = file_stamp(path)
+            compiled = read_artifact(artifact_path(path), file_sha256(path))
+            if compiled is None and workers > 1:
+                stale[path] = stamp
+            else:
+                self._entries.put(path, stamp, compiled or compile_template(path))
+            seconds[path] = time.perf_counter() - start
+        if stale:
+            # Spawned rather than forked: the caller may have threads running
+            with ProcessPoolExecutor(min(workers, len(stale)),
+                                     mp_context=multiprocessing.get_context("spawn")) as pool:
+                for path, (compiled, compile_seconds) in zip(stale, pool.map(_timed_compile, stale)):
+                    self._entries.put(path, stale[path], compiled)
+                    seconds[path] += compile_seconds
+        return seconds
+
+def load_compiled(template_path):
+    """The template's compiled form from its artifact, or compiled now if that is stale"""
+    compiled = read_artifact(artifact_path(template_path), file_sha256(template_path))
+    return compiled or compile_template(template_path)
+
+def _timed_compile(template_path):
+    start = time.perf_counter()
+    compiled = compile_template(template_path)
+    return compiled, time.perf_counter() - start
+
+def main(argv=None):
+    from fragments import resolve_template
+    from proposals import template_paths
+
+    parser = argparse.ArgumentParser(description="Compile proposal templates into segment artifacts")
+    parser.add_argument("templates", nargs="*",
+                        help="Template .docx files (default: every template in PROPOSAL_CONFIG)")
+    parser.add_argument("--templates-dir", default=os.getcwd())
+    args = parser.parse_args(argv)
+
+    failed = 0
+    for path in args.templates or template_paths(args.templates_dir):
+        start = time.perf_counter()
+        try:
+            # Skeletons are compiled in their assembled form, which is what gets rendered
+            path = resolve_template(path)
+            compiled = compile_template(path)
+        except (OSError, zipfile.BadZipFile) as e:
+            print(f"{path}: {e}", file=sys.stderr)
+            failed += 1
+            continue
+        write_artifact(compiled, artifact_path(path))
+        fallback = [name for name, (_, ops) in compiled.parts.items() if ops is None]
+        note = f", parsed at render time: {', '.join(fallback)}" if fallback else ""
+        print(f"{path}: {os.path.getsize(artifact_path(path)) / 1024:.0f} KiB in "
+              f"{(time.perf_counter() - start) * 1000:.0f} ms{note}", file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,327 @@
+import argparse
+import copy
+import hashlib
+import io
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+
+from template_cache import StampedCache, file_sha256, file_stamp
+
+# Where a skeleton's fragments live; by default a "fragments" directory next to it
+FRAGMENTS_DIR = os.environ.get("PDFGEN_FRAGMENTS_DIR", "")
+ASSEMBLED_DIR = os.environ.get(
+    "PDFGEN_ASSEMBLED_DIR", os.path.join(tempfile.gettempdir(), "pdfgen-assembled"))
+ASSEMBLED_CACHE_BYTES = int(os.environ.get("PDFGEN_ASSEMBLED_CACHE_BYTES", 256 * 1024 * 1024))
+# Assemblies used more recently than this are never evicted: resolve() hands out the
+# path and the render opens it later, possibly in another process sharing the directory
+ASSEMBLED_GRACE_SECONDS = 10 * 60
+
+# Bump whenever assembly starts producing different packages from the same inputs
+ASSEMBLY_VERSION = 2
+
+# A body paragraph holding only this is replaced by the fragment's body
+FRAGMENT_MARKER = re.compile(r"^\s*\[\[fragment:([\w .-]+)\]\]\s*$")
+
+_STYLE_REFERENCES = ".//w:pStyle | .//w:rStyle | .//w:tblStyle"
+# Notes and comments live in parts of their own that assembly doesn't merge
+_NOTE_REFERENCES = (".//w:footnoteReference | .//w:endnoteReference | .//w:commentReference"
+                    " | .//w:commentRangeStart")
+
+class FragmentAssembler:
+    """Splices shared fragments into proposal skeletons and caches the results.
+
+    A skeleton is an ordinary template whose body has paragraphs reading
+    [[fragment:name]]; each is replaced by the body of name.docx from the
+    fragments directory, with the images and hyperlinks it uses carried
+    over. The assembled package is written once to a content-addressed path
+    under cache_dir, keyed by the skeleton and fragment bytes, so it is
+    reused by every process and later start, and every downstream cache
+    (compiled templates, output cache) sees a new file when a fragment is
+    edited. A template without markers resolves to itself. Least recently
+    used assemblies are deleted once cache_dir grows past max_bytes.
+    """
+
+    def __init__(self, fragments_dir=FRAGMENTS_DIR, cache_dir=ASSEMBLED_DIR,
+                 max_bytes=ASSEMBLED_CACHE_BYTES):
+        self.fragments_dir = fragments_dir
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._resolved = {}  # skeleton path -> (fragment paths, their and its stamps, path to render)
+        self._fragments = StampedCache(_parse)
+
+    def fragment_path(self, template_path, name):
+        fragments_dir = self.fragments_dir or os.path.join(os.path.dirname(template_path), "fragments")
+        return os.path.join(fragments_dir, name + ".docx")
+
+    def resolve(self, template_path):
+        """Path of the template to render for `template_path`, assembling it if needed"""
+        entry = self._resolved.get(template_path)
+        if entry is not None:
+            fragment_paths, stamps, resolved = entry
+            try:
+                if (self._stamps(template_path, fragment_paths) == stamps
+                        and (resolved == template_path or self._touch(resolved))):
+                    return resolved
+            except FileNotFoundError:
+                pass  # A fragment went away; the skeleton may no longer use it
+        with self._lock:
+            names = fragment_names(template_path)
+            fragment_paths = [self.fragment_path(template_path, name) for name in names]
+            stamps = self._stamps(template_path, fragment_paths)
+            resolved = template_path
+            if names:
+                resolved = os.path.join(self.cache_dir, self._key(template_path, fragment_paths),
+                                        os.path.basename(template_path))
+                if not self._touch(resolved):
+                    self.assemble(template_path, resolved)
+                    self._evict(keep=os.path.dirname(resolved))
+            self._resolved[template_path] = (fragment_paths, stamps, resolved)
+            return resolved
+
+    def assemble(self, template_path, out_path):
+        """Write the skeleton with its fragments spliced in to out_path, atomically"""
+        from docx import Document
+        from docx.oxml.ns import qn
+        from xml_render import paragraph_text_xml
+
+        doc = Document(template_path)
+        body = doc.element.body
+        next_id = max([int(i) for i in body.xpath(".//wp:docPr/@id")] + [0]) + 1
+        for p in list(body.iterchildren(qn("w:p"))):
+            match = FRAGMENT_MARKER.match(paragraph_text_xml(p))
+            if match is None:
+                continue
+            for e in self._fragment_body(self.fragment_path(template_path, match.group(1)), doc.part):
+                # Drawing ids must stay unique within the document
+                for doc_pr in e.xpath(".//wp:docPr"):
+                    doc_pr.set("id", str(next_id))
+                    next_id += 1
+                p.addprevious(e)
+            body.remove(p)
+
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        fd, partial_path = tempfile.mkstemp(dir=os.path.dirname(out_path), suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                doc.save(f)
+            os.replace(partial_path, out_path)
+        except BaseException:
+            os.remove(partial_path)
+            raise
+
+    def _fragment_body(self, fragment_path, part):
+        """Copies of a fragment's body elements, with the relationships, styles and list
+        numbering they use carried over into `part`"""
+        from docx.opc.constants import RELATIONSHIP_TYPE as RT
+        from docx.oxml.ns import nsmap, qn
+
+        document = self._fragments.get(fragment_path)
+        rels = document.part.rels
+        r_prefix = f"{{{nsmap['r']}}}"
+        rids = {}
+        elements = []
+        for child in document.element.body.iterchildren():
+            if child.tag == qn("w:sectPr"):
+                continue
+            e = copy.deepcopy(child)
+            if e.xpath(_NOTE_REFERENCES):
+                raise ValueError(f"{fragment_path} has footnotes, endnotes or comments, which can't "
+                                 f"be carried over")
+            for node in e.iter():
+                for attr, rid in node.attrib.items():
+                    if not attr.startswith(r_prefix) or rid not in rels:
+                        continue
+                    if rid not in rids:
+                        rel = rels[rid]
+                        if rel.is_external:
+                            rids[rid] = part.relate_to(rel.target_ref, rel.reltype, is_external=True)
+                        elif rel.reltype == RT.IMAGE:
+                            rids[rid], _ = part.get_or_add_image(io.BytesIO(rel.target_part.blob))
+                        else:
+                            raise ValueError(f"{fragment_path} relates to a part that can't be carried "
+                                             f"over ({rel.reltype}); only images and links can")
+                    node.set(attr, rids[rid])
+            elements.append(e)
+        styles = _import_styles(document.part, part, elements)
+        _import_numbering(document.part, part, elements + styles, fragment_path)
+        return elements
+
+    def _stamps(self, template_path, fragment_paths):
+        # Raises FileNotFoundError for a missing skeleton or fragment
+        return file_stamp(template_path), tuple(file_stamp(path) for path in fragment_paths)
+
+    def _key(self, template_path, fragment_paths):
+        h = hashlib.sha256(f"{ASSEMBLY_VERSION}\0{file_sha256(template_path)}".encode("ascii"))
+        for path in fragment_paths:
+            h.update(f"\0{os.path.basename(path)}\0{file_sha256(path)}".encode("utf-8"))
+        return h.hexdigest()[:32]
+
+    def _touch(self, resolved):
+        """Whether an assembled template is still cached, marking it used if so"""
+        try:
+            os.utime(os.path.dirname(resolved))  # The directory's mtime doubles as the LRU clock
+        except FileNotFoundError:
+            return False
+        return os.path.exists(resolved)
+
+    def _evict(self, keep):
+        """Delete the least recently used assemblies until cache_dir is under max_bytes,
+        sparing those used within the last ASSEMBLED_GRACE_SECONDS"""
+        # Rescan so assemblies written by other processes sharing the directory count too
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            try:
+                if entry.is_dir():
+                    size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+                    entries.append((entry.stat().st_mtime_ns, size, entry.path))
+            except FileNotFoundError:
+                pass  # Another process evicted it first
+        total = sum(size for _, size, _ in entries)
+        cutoff = time.time_ns() - ASSEMBLED_GRACE_SECONDS * 10**9
+        for mtime_ns, size, path in sorted(entries):
+            if total <= self.max_bytes or mtime_ns >= cutoff:
+                break
+            if path != keep:
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+
+def fragment_names(template_path):
+    """Names of the fragments a skeleton's body asks for, in document order"""
+    from docx.oxml import parse_xml
+    from docx.oxml.ns import qn
+    from xml_render import paragraph_text_xml
+    from zip_render import find_parts
+
+    names = []
+    with zipfile.ZipFile(template_path) as zin:
+        main_parts, _, _ = find_parts(zin)
+        for name in sorted(main_parts):
+            for p in parse_xml(zin.read(name)).body.iterchildren(qn("w:p")):
+                match = FRAGMENT_MARKER.match(paragraph_text_xml(p))
+                if match is not None:
+                    names.append(match.group(1))
+    return names
+
+def _import_styles(fragment_part, part, elements):
+    """Add the styles `elements` use that `part` lacks, with the styles they build on.
+
+    A style the skeleton already has keeps the skeleton's definition, as when
+    pasting into Word. Returns the added copies.
+    """
+    from docx.oxml.ns import qn
+
+    styles = part.styles.element
+    fragment_styles = fragment_part.styles.element
+    wanted = [node.get(qn("w:val")) for e in elements for node in e.xpath(_STYLE_REFERENCES)]
+    seen = set()
+    added = []
+    while wanted:
+        style_id = wanted.pop()
+        if style_id in seen:
+            continue
+        seen.add(style_id)
+        style = fragment_styles.get_by_id(style_id)
+        if style is None or styles.get_by_id(style_id) is not None:
+            continue  # An undefined style falls back to the default in both documents
+        style = copy.deepcopy(style)
+        styles.append(style)
+        added.append(style)
+        wanted.extend(node.get(qn("w:val")) for node in style.xpath("./w:basedOn | ./w:next | ./w:link"))
+    return added
+
+def _import_numbering(fragment_part, part, elements, fragment_path):
+    """Copy the list definitions `elements` use into `part` under new ids, and renumber them.
+
+    Ids are never shared with the skeleton's lists, so a fragment's list
+    keeps its own format and counting.
+    """
+    from docx.oxml.ns import qn
+
+    references = [node for e in elements for node in e.xpath(".//w:numPr/w:numId")
+                  if node.get(qn("w:val")) != "0"]
+    if not references:
+        return
+    try:
+        numbering = part.numbering_part.element
+        fragment_numbering = fragment_part.numbering_part.element
+    except NotImplementedError:
+        # python-docx can't create a numbering part; Word documents have one anyway
+        raise ValueError(f"{fragment_path} has lists, but it or the template has no numbering part")
+
+    abstracts = {a.get(qn("w:abstractNumId")): a for a in fragment_numbering.iterchildren(qn("w:abstractNum"))}
+    next_num_id = max([num.numId for num in numbering.num_lst] + [0]) + 1
+    next_abstract_id = max([int(a.get(qn("w:abstractNumId")))
+                            for a in numbering.iterchildren(qn("w:abstractNum"))] + [-1]) + 1
+    num_ids = {}
+    abstract_ids = {}
+    for node in references:
+        num_id = node.get(qn("w:val"))
+        if num_id not in num_ids:
+            try:
+                num = copy.deepcopy(fragment_numbering.num_having_numId(int(num_id)))
+            except (KeyError, ValueError):
+                raise ValueError(f"{fragment_path} uses list {num_id}, which it doesn't define")
+            abstract_id = num.abstractNumId.val
+            if abstract_id not in abstract_ids:
+                abstract = abstracts.get(str(abstract_id))
+                if abstract is None or abstract.find(qn("w:numStyleLink")) is not None:
+                    raise ValueError(f"{fragment_path} uses list {num_id}, whose definition can't be "
+                                     f"carried over")
+                abstract = copy.deepcopy(abstract)
+                abstract.set(qn("w:abstractNumId"), str(next_abstract_id))
+                # Every w:abstractNum comes before the first w:num
+                numbering.insert_element_before(abstract, "w:num", "w:numIdMacAtCleanup")
+                abstract_ids[abstract_id] = next_abstract_id
+                next_abstract_id += 1
+            num.numId = next_num_id
+            num.abstractNumId.val = abstract_ids[abstract_id]
+            numbering.insert_element_before(num, "w:numIdMacAtCleanup")
+            num_ids[num_id] = str(next_num_id)
+            next_num_id += 1
+        node.set(qn("w:val"), num_ids[num_id])
+
+def _parse(path):
+    from docx import Document
+    return Document(path)
+
+default_assembler = FragmentAssembler()
+
+def resolve_template(template_path):
+    """The template to render for `template_path`: itself, or its assembled form"""
+    return default_assembler.resolve(template_path)
+
+def main(argv=None):
+    from proposals import template_paths
+
+    parser = argparse.ArgumentParser(description="Assemble proposal skeletons with their fragments")
+    parser.add_argument("templates", nargs="*",
+                        help="Skeleton .docx files (default: every template in PROPOSAL_CONFIG)")
+    parser.add_argument("--templates-dir", default=os.getcwd())
+    args = parser.parse_args(argv)
+
+    failed = 0
+    for path in args.templates or template_paths(args.templates_dir):
+        start = time.perf_counter()
+        try:
+            names = fragment_names(path)
+            resolved = resolve_template(path)
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            print(f"{path}: {e}", file=sys.stderr)
+            failed += 1
+            continue
+        if names:
+            print(f"{path}: {', '.join(names)} -> {resolved} "
+                  f"in {(time.perf_counter() - start) * 1000:.0f} ms", file=sys.stderr)
+        else:
+            print(f"{path}: no fragments", file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Serve /metrics on this port from processes without a render service of their own (0 = don't)
+METRICS_PORT = int(os.environ.get("PDFGEN_METRICS_PORT", 0))
+
+# Where the JSON line per render goes: a file path, "-" for stderr, or "" for nowhere
+RENDER_LOG = os.environ.get("PDFGEN_RENDER_LOG", "")
+
+# Which stages a render goes through depends on the engine. Every engine has "replace"
+# and "save" (writing the output package); "load" (getting the compiled or parsed
+# template from its cache) is for all but the zip engine, which parses as it goes;
+# "prune" is only separate for the docx and xml engines, the others decide rows in
+# the same pass as replacing. "convert" is the PDF conversion.
+STAGES = ("load", "replace", "prune", "save", "convert")
+COUNTERS = ("paragraphs_visited", "placeholders_replaced", "rows_removed")
+
+# Upper bounds in seconds of the stage and render duration histograms
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PROMETHEUS_MIME = "text/plain; version=0.0.4; charset=utf-8"
+
+class RenderTrace:
+    """Seconds spent in each stage and work done by one render"""
+
+    def __init__(self):
+        self.stages = {}
+        self.counts = dict.fromkeys(COUNTERS, 0)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def merge(self, stages, counts):
+        """Add the stages and counts of a render done elsewhere, e.g. in a worker process"""
+        for name, seconds in stages.items():
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+        for name, n in counts.items():
+            self.counts[name] += n
+
+_local = threading.local()
+
+def current_trace():
+    """The trace of the render running in this thread, or None"""
+    return getattr(_local, "trace", None)
+
+@contextmanager
+def tracing(trace=None):
+    """Collect the stages and counts of renders in this thread into `trace` (a new one by default)"""
+    trace = trace or RenderTrace()
+    previous = current_trace()
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+
+def stage(name):
+    """Time a block as stage `name` of the current render; does nothing outside of one"""
+    trace = current_trace()
+    return nullcontext() if trace is None else trace.stage(name)
+
+def add_stage(name, seconds):
+    """Add seconds timed by the caller to stage `name` of the current render.
+
+    For loops over many small steps, where a stage() block per step would cost
+    more than the timing is worth.
+    """
+    trace = current_trace()
+    if trace is not None:
+        trace.stages[name] = trace.stages.get(name, 0.0) + seconds
+
+def count(name, n):
+    trace = current_trace()
+    if trace is not None:
+        trace.counts[name] += n
+
+class Histogram:
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        """(name, labels, value) of every Prometheus sample, buckets cumulative"""
+        cumulative = 0
+        for bound, n in zip(self.buckets, self.counts):
+            cumulative += n
+            yield f"{name}_bucket", labels + (("le", f"{bound:g}"),), cumulative
+        yield f"{name}_bucket", labels + (("le", "+Inf"),), self.count
+        yield f"{name}_sum", labels, self.sum
+        yield f"{name}_count", labels, self.count
+
+class RenderMetrics:
+    """Render counts, durations and work totals of this process, in Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.renders = {}  # (proposal, format, outcome) -> renders
+        self.render_seconds = {}  # format -> Histogram of whole renders, cache hits excluded
+        self.stage_seconds = {}  # stage -> Histogram
+        self.totals = dict.fromkeys(COUNTERS, 0)
+
+    def observe(self, proposal, output_format, trace, seconds, outcome):
+        with self._lock:
+            key = (proposal, output_format, outcome)
+            self.renders[key] = self.renders.get(key, 0) + 1
+            if outcome != "cached":
+                self.render_seconds.setdefault(output_format, Histogram()).observe(seconds)
+            for name, stage_seconds in trace.stages.items():
+                self.stage_seconds.setdefault(name, Histogram()).observe(stage_seconds)
+            for name, n in trace.counts.items():
+                self.totals[name] += n
+
+    def exposition(self):
+        with self._lock:
+            families = [
+                ("pdfgen_renders_total", "counter", "Proposals rendered, by outcome (ok, cached, error)",
+                 [("pdfgen_renders_total", (("proposal", p), ("format", f), ("outcome", o)), n)
+                  for (p, f, o), n in sorted(self.renders.items())]),
+                ("pdfgen_render_seconds", "histogram", "Time to render one proposal, cache hits excluded",
+                 [sample for f, h in sorted(self.render_seconds.items())
+                  for sample in h.samples("pdfgen_render_seconds", (("format", f),))]),
+                ("pdfgen_render_stage_seconds", "histogram", "Time spent in each stage of a render",
+                 [sample for s, h in sorted(self.stage_seconds.items())
+                  for sample in h.samples("pdfgen_render_stage_seconds", (("stage", s),))]),
+            ]
+            for name in COUNTERS:
+                families.append((f"pdfgen_{name}_total", "counter", f"Total {name.replace('_', ' ')}",
+                                 [(f"pdfgen_{name}_total", (), self.totals[name])]))
+        lines = []
+        for family, kind, help_text, samples in families:
+            lines.append(f"# HELP {family} {help_text}")
+            lines.append(f"# TYPE {family} {kind}")
+            for name, labels, value in samples:
+                if labels:
+                    name += "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in labels) + "}"
+                lines.append(f"{name} {value:g}" if isinstance(value, float) else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+default_metrics = RenderMetrics()
+
+_log_lock = threading.Lock()
+
+def log_render(record, path=RENDER_LOG):
+    """Append one render's record to the render log as a JSON line"""
+    if not path:
+        return
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    with _log_lock:
+        if path == "-":
+            sys.stderr.write(line)
+        else:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+@contextmanager
+def traced_render(proposal, template_path, output_format="docx", metrics=None):
+    """Trace the render in the block, then record it in `metrics` and the render log.
+
+    A render whose block ran no stage is counted as served from the output cache.
+    """
+    start = time.perf_counter()
+    outcome = "ok"
+    error = None
+    with tracing() as trace:
+        try:
+            yield trace
+        except Exception as e:
+            outcome = "error"
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            if outcome == "ok" and not trace.stages:
+                outcome = "cached"
+            (metrics or default_metrics).observe(proposal, output_format, trace, seconds, outcome)
+            if RENDER_LOG:
+                log_render(render_record(proposal, template_path, output_format, trace, seconds,
+                                         outcome, error))
+
+def render_record(proposal, template_path, output_format, trace, seconds, outcome, error=None):
+    """The render log's record of one render"""
+    try:
+        template_bytes = os.path.getsize(template_path)
+    except OSError:
+        template_bytes = None
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "proposal": proposal,
+        "template": os.path.basename(template_path),
+        "template_bytes": template_bytes,
+        "format": output_format,
+        "outcome": outcome,
+        "ms": round(seconds * 1000, 2),
+        "stages_ms": {name: round(s * 1000, 2) for name, s in trace.stages.items()},
+        **trace.counts,
+        **({"error": error} if error else {}),
+    }
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        data = self.server.metrics.exposition().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", PROMETHEUS_MIME)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # Scraped every few seconds; not worth a line each time
+
+def start_metrics_server(port=METRICS_PORT, host="127.0.0.1", metrics=None):
+    """Serve GET /metrics from a daemon thread; returns the server, or None when port is 0"""
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    server.metrics = metrics or default_metrics
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,241 @@
+import argparse
+import os
+import sys
+import zipfile
+
+from docx.oxml import OxmlElement, parse_xml
+from docx.oxml.ns import qn
+
+from render import PLACEHOLDER_SYNTAX
+from xml_render import (
+    NORMALIZED_DOC_VAR,
+    center_cell_xml,
+    paragraph_text_elements_xml,
+    row_cells_xml,
+    story_paragraphs_xml
+)
+from zip_render import ESCAPED_MARK, copy_raw_entry, find_parts, serialize_part, write_part
+
+# Written as the marker's value; bump when normalization starts doing more
+NORMALIZE_VERSION = 1
+
+_R = qn("w:r")
+_R_PR = qn("w:rPr")
+_T = qn("w:t")
+_XML_SPACE = qn("xml:space")
+# Word scatters these between the runs of a single word; a merge can step over them
+_RUN_SEPARATORS = tuple(qn(tag) for tag in ("w:proofErr", "w:bookmarkStart", "w:bookmarkEnd"))
+# w:settings children that come after w:docVars in the schema's sequence
+_DOC_VARS_SUCCESSORS = tuple(qn(tag) for tag in (
+    "w:rsids", "m:mathPr", "w:attachedSchema", "w:themeFontLang", "w:clrSchemeMapping",
+    "w:doNotIncludeSubdocsInStats", "w:doNotAutoCompressPictures", "w:forceUpgrade", "w:captions",
+    "w:readModeInkLockDown", "w:smartTagType", "sl:schemaLibrary", "w:shapeDefaults",
+    "w:doNotEmbedSmartTags", "w:decimalSymbol", "w:listSeparator"))
+
+def normalize_template(template_path, out_path=None):
+    """Rewrite a template so it renders without rebuilding paragraphs.
+
+    Every placeholder Word split over several runs is merged into the run it
+    starts in, top-level table cells get the vertical alignment rendering
+    would give them, and settings.xml is marked so the render engines fill
+    placeholders in place. Writes to out_path (default: the template itself)
+    atomically and returns (placeholders merged, placeholders left split).
+    """
+    out_path = out_path or template_path
+    partial_path = out_path + ".part"
+    merged = left = 0
+    try:
+        with zipfile.ZipFile(template_path) as zin, \
+                zipfile.ZipFile(partial_path, "w", zipfile.ZIP_DEFLATED) as zout:
+            main_parts, story_parts, settings_parts = find_parts(zin)
+            if not settings_parts:
+                raise ValueError(f"{template_path} has no settings part to mark as normalized")
+            for info in zin.infolist():
+                name = info.filename
+                xml = zin.read(info) if name in main_parts | story_parts | settings_parts else None
+                if name in main_parts or (name in story_parts and ESCAPED_MARK in xml):
+                    root = parse_xml(xml)
+                    part_merged, part_left = normalize_part(root, main=name in main_parts)
+                    merged += part_merged
+                    left += part_left
+                elif name in settings_parts:
+                    root = parse_xml(xml)
+                    mark_normalized(root)
+                else:
+                    copy_raw_entry(zin, info, zout)
+                    continue
+                write_part(zout, info, serialize_part(root))
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    os.replace(partial_path, out_path)
+    return merged, left
+
+def normalize_part(root, main):
+    """Normalize one parsed story part in place; returns (merged, left split)"""
+    merged = left = 0
+    for p in story_paragraphs_xml(root.body if main else root):
+        p_merged, p_left = merge_placeholder_runs(p)
+        merged += p_merged
+        left += p_left
+    if main:
+        center_table_cells(root.body)
+    return merged, left
+
+def center_table_cells(body):
+    """Give top-level table cells the alignment replace_in_body_xml() would set"""
+    for tbl in body.iterchildren(qn("w:tbl")):
+        for tr in tbl.tr_lst:
+            for tc in row_cells_xml(tr):
+                center_cell_xml(tc)
+
+def merge_placeholder_runs(p):
+    """Move each placeholder split over several runs into the w:t it starts in.
+
+    The placeholder takes on the formatting of its first run. One that spans
+    more than plain text runs (a tab, a field, a hyperlink's edge) is left
+    split and gets its paragraph rebuilt at render time as before. Returns
+    (placeholders merged, placeholders left split).
+    """
+    merged = left = 0
+    while True:
+        spans = _split_placeholders(p)
+        if len(spans) <= left:
+            return merged, left
+        # Placeholders before this one stay split on every pass, so skip them
+        if _merge(*spans[left]):
+            merged += 1
+        else:
+            left += 1
+
+def _split_placeholders(p):
+    """(placeholder, start, covering (element, offset) pairs) per placeholder over several elements"""
+    pieces = []
+    offset = 0
+    for e in paragraph_text_elements_xml(p):
+        text = str(e)
+        pieces.append((e, offset, offset + len(text)))
+        offset += len(text)
+    text = "".join(str(e) for e, _, _ in pieces)
+
+    spans = []
+    for match in PLACEHOLDER_SYNTAX.finditer(text):
+        covering = [(e, start) for e, start, end in pieces
+                    if start < match.end() and end > match.start()]
+        if len(covering) > 1:
+            spans.append((match.group(), match.start(), covering))
+    return spans
+
+def _merge(placeholder, start, covering):
+    elements = [e for e, _ in covering]
+    first, first_offset = covering[0]
+    last, last_offset = covering[-1]
+    if any(e.tag != _T for e in elements) or first.getparent().getparent() is not \
+            last.getparent().getparent():
+        return False
+    if not all(_is_plain_text(e) for e in _elements_between(first, last)):
+        return False
+
+    tail = last.text[start + len(placeholder) - last_offset:]
+    first.text = first.text[:start - first_offset] + placeholder
+    _preserve_space(first)
+    for t in elements[1:-1]:
+        _remove_text(t)
+    if tail:
+        last.text = tail
+        _preserve_space(last)
+    else:
+        _remove_text(last)
+    return True
+
+def _elements_between(first, last):
+    """Everything between two w:t of sibling runs, in document order"""
+    first_r, last_r = first.getparent(), last.getparent()
+    for e in first.itersiblings():
+        if e is last:
+            return
+        yield e
+    for r in first_r.itersiblings():
+        if r is last_r:
+            break
+        yield r
+    for e in last_r:
+        if e is last:
+            return
+        if e.tag != _R_PR:
+            yield e
+
+def _is_plain_text(e):
+    if e.tag == _R:
+        return all(child.tag in (_R_PR, _T) for child in e)
+    return e.tag == _T or e.tag in _RUN_SEPARATORS
+
+def _preserve_space(t):
+    if len(t.text.strip()) < len(t.text):
+        t.set(_XML_SPACE, "preserve")
+
+def _remove_text(t):
+    r = t.getparent()
+    r.remove(t)
+    # Drop runs the merge emptied, so they don't linger as formatting-only runs
+    if all(child.tag == _R_PR for child in r):
+        r.getparent().remove(r)
+
+def mark_normalized(settings):
+    """Add (or refresh) the docVar the render engines look for to a w:settings element"""
+    doc_vars = settings.find(qn("w:docVars"))
+    if doc_vars is None:
+        doc_vars = OxmlElement("w:docVars")
+        successor = next((child for child in settings if child.tag in _DOC_VARS_SUCCESSORS), None)
+        if successor is None:
+            settings.append(doc_vars)
+        else:
+            successor.addprevious(doc_vars)
+    doc_var = next((var for var in doc_vars.iterchildren(qn("w:docVar"))
+                    if var.get(qn("w:name")) == NORMALIZED_DOC_VAR), None)
+    if doc_var is None:
+        doc_var = OxmlElement("w:docVar")
+        doc_var.set(qn("w:name"), NORMALIZED_DOC_VAR)
+        doc_vars.append(doc_var)
+    doc_var.set(qn("w:val"), str(NORMALIZE_VERSION))
+
+def main(argv=None):
+    from fragments import default_assembler
+    from proposals import template_paths
+
+    parser = argparse.ArgumentParser(
+        description="Merge split placeholders and bake static formatting into proposal templates")
+    parser.add_argument("templates", nargs="*",
+                        help="Template .docx files (default: every template in PROPOSAL_CONFIG "
+                             "and every fragment)")
+    parser.add_argument("--templates-dir", default=os.getcwd())
+    parser.add_argument("--output-dir", default=None,
+                        help="Write normalized copies here (default: rewrite the templates in place)")
+    args = parser.parse_args(argv)
+
+    paths = args.templates
+    if not paths:
+        paths = template_paths(args.templates_dir)
+        fragments_dir = os.path.dirname(default_assembler.fragment_path(paths[0], ""))
+        if os.path.isdir(fragments_dir):
+            paths += sorted(os.path.join(fragments_dir, name) for name in os.listdir(fragments_dir)
+                            if name.endswith(".docx"))
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    failed = 0
+    for path in paths:
+        out_path = os.path.join(args.output_dir, os.path.basename(path)) if args.output_dir else path
+        try:
+            merged, left = normalize_template(path, out_path)
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            print(f"{path}: {e}", file=sys.stderr)
+            failed += 1
+            continue
+        note = f", {left} still split (their paragraphs are rebuilt when rendering)" if left else ""
+        print(f"{out_path}: {merged} placeholders merged{note}", file=sys.stderr)
+    print("Run compiled_template.py again to refresh the compiled artifacts", file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from template_cache import StampedCache, file_sha256
+
+# Bump whenever a rendering change alters output bytes, so stale entries stop matching
+RENDER_VERSION = 2
+
+OUTPUT_CACHE_DIR = os.environ.get(
+    "PDFGEN_OUTPUT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "pdfgen-output-cache"))
+OUTPUT_CACHE_BYTES = int(os.environ.get("PDFGEN_OUTPUT_CACHE_BYTES", 512 * 1024 * 1024))
+# Partial writes older than this were left by a crashed process and get removed on eviction
+STALE_TMP_SECONDS = 60 * 60
+
+class OutputCache:
+    """Content-addressed disk cache of rendered proposals.
+
+    Entries are keyed by a hash of the template's bytes, the placeholder dict
+    (normalized to sorted key/string-value pairs) and the output format, so
+    regenerating an identical proposal is a file read. Least recently used
+    entries are evicted once the directory grows past max_bytes.
+    """
+
+    def __init__(self, directory=OUTPUT_CACHE_DIR, max_bytes=OUTPUT_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._digests = StampedCache(file_sha256)
+        os.makedirs(directory, exist_ok=True)
+        self._total_bytes = sum(size for _, size, _ in self._entries())
+
+    def key(self, template_path, placeholders, output_format, variant=""):
+        """Cache key of one rendered output; `variant` separates render engines"""
+        normalized = json.dumps({k: str(v) for k, v in placeholders.items()},
+                                sort_keys=True, ensure_ascii=False)
+        h = hashlib.sha256()
+        for part in (str(RENDER_VERSION), self.template_digest(template_path), output_format,
+                     variant, normalized):
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def template_digest(self, template_path):
+        """sha256 of the template file, recomputed only when its mtime or size changes"""
+        return self._digests.get(os.path.abspath(template_path))
+
+    def get(self, key):
+        """Cached bytes for `key`, or None"""
+        path = self._path(key)
+        try:
+            # mtime doubles as the LRU clock. Touching first means an entry another
+            # process evicts between the two calls is a miss, never an error
+            os.utime(path)
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def open(self, key):
+        """Cached output for `key` as a binary file open for reading, or None"""
+        path = self._path(key)
+        try:
+            os.utime(path)  # As in get(); once open, eviction can't take the file away
+            f = open(path, "rb")
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return f
+
+    def put(self, key, data):
+        """Store bytes under `key`, evicting old entries to stay under max_bytes"""
+        if len(data) <= self.max_bytes:
+            self._store(key, len(data), lambda f: f.write(data))
+
+    def put_file(self, key, src):
+        """put() for output in a seekable binary file, copied across in chunks"""
+        size = src.seek(0, os.SEEK_END)
+        src.seek(0)
+        if size <= self.max_bytes:
+            self._store(key, size, lambda f: shutil.copyfileobj(src, f))
+        src.seek(0)
+
+    def get_or_render(self, template_path, placeholders, output_format, render, variant=""):
+        """Return cached output, calling render() and caching its bytes on a miss"""
+        key = self.key(template_path, placeholders, output_format, variant)
+        data = self.get(key)
+        if data is None:
+            data = render()
+            self.put(key, data)
+        return data
+
+    def get_or_render_file(self, template_path, placeholders, output_format, render, variant=""):
+        """get_or_render() for output in files: render() returns a seekable binary file,
+        and so does this, rewound, without reading it into memory"""
+        key = self.key(template_path, placeholders, output_format, variant)
+        f = self.open(key)
+        if f is None:
+            f = render()
+            self.put_file(key, f)
+        return f
+
+    def _store(self, key, size, write):
+        path = self._path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            with self._lock:
+                replaced = os.path.getsize(path) if os.path.exists(path) else 0
+                os.replace(tmp_path, path)
+                self._total_bytes += size - replaced
+                if self._total_bytes > self.max_bytes:
+                    self._evict()
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _entries(self):
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                st = entry.stat()
+                yield entry.path, st.st_size, st.st_mtime_ns
+
+    def _remove_stale_tmp(self):
+        cutoff = time.time_ns() - STALE_TMP_SECONDS * 10**9
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".tmp"):
+                try:
+                    if entry.stat().st_mtime_ns < cutoff:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    def _evict(self):
+        self._remove_stale_tmp()
+        # Rescan so entries written by other processes sharing the directory count too
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        self._total_bytes = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self._total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._total_bytes -= size
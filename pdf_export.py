@@ -0,0 +1,249 @@
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+
+PDF_MIME = "application/pdf"
+
+SOFFICE = os.environ.get("PDFGEN_SOFFICE", "soffice")
+PDF_WORKERS = int(os.environ.get("PDFGEN_PDF_WORKERS", 2))
+
+class PdfConversionError(RuntimeError):
+    """A document could not be converted to PDF"""
+
+class PdfQueueFull(PdfConversionError):
+    """Every worker is busy and the job queue stayed full for the whole wait"""
+
+class PdfTimeout(PdfConversionError):
+    """A conversion ran past its time limit and its worker was killed"""
+
+def _property(name, value):
+    from com.sun.star.beans import PropertyValue
+    prop = PropertyValue()
+    prop.Name = name
+    prop.Value = value
+    return prop
+
+class _OfficeProcess:
+    """One headless LibreOffice process reached over a private UNO pipe"""
+
+    def __init__(self, soffice, startup_timeout):
+        self.soffice = soffice
+        self.startup_timeout = startup_timeout
+        self.profile_dir = tempfile.mkdtemp(prefix="pdfgen-lo-")
+        self.pipe_name = os.path.basename(self.profile_dir)
+        self.process = None
+        self.desktop = None
+        self.jobs_done = 0
+        # start() and stop() run on the worker thread and on the watchdog timer
+        self._lock = threading.RLock()
+
+    def start(self):
+        try:
+            import uno  # LibreOffice's Python bridge (python3-uno), only needed for PDF export
+        except ImportError:
+            raise PdfConversionError("PDF export needs LibreOffice's Python bridge (uno)") from None
+        with self._lock:
+            try:
+                self.process = subprocess.Popen(
+                    [self.soffice, "--headless", "--invisible", "--nologo", "--norestore",
+                     "--nodefault", "--nolockcheck",
+                     f"-env:UserInstallation=file://{self.profile_dir}",
+                     f"--accept=pipe,name={self.pipe_name};urp;StarOffice.ComponentContext"],
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            except FileNotFoundError:
+                raise PdfConversionError(f"LibreOffice not found: {self.soffice}") from None
+
+            local_ctx = uno.getComponentContext()
+            resolver = local_ctx.ServiceManager.createInstanceWithContext(
+                "com.sun.star.bridge.UnoUrlResolver", local_ctx)
+            deadline = time.monotonic() + self.startup_timeout
+            while True:
+                try:
+                    ctx = resolver.resolve(
+                        f"uno:pipe,name={self.pipe_name};urp;StarOffice.ComponentContext")
+                    break
+                except Exception:
+                    if self.process.poll() is not None or time.monotonic() > deadline:
+                        self.stop()
+                        raise PdfConversionError("LibreOffice did not start")
+                    time.sleep(0.1)
+            self.desktop = ctx.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", ctx)
+            self.jobs_done = 0
+
+    @property
+    def running(self):
+        process = self.process
+        return process is not None and process.poll() is None
+
+    def rss_bytes(self):
+        """Resident memory of the office process, from /proc (0 when unknown)"""
+        try:
+            with open(f"/proc/{self.process.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except (OSError, AttributeError):
+            pass
+        return 0
+
+    def convert(self, docx_path, pdf_path):
+        import uno
+        doc = self.desktop.loadComponentFromURL(
+            uno.systemPathToFileUrl(docx_path), "_blank", 0, (_property("Hidden", True),))
+        try:
+            doc.storeToURL(uno.systemPathToFileUrl(pdf_path),
+                           (_property("FilterName", "writer_pdf_Export"),))
+        finally:
+            doc.close(True)
+        self.jobs_done += 1
+
+    def stop(self):
+        with self._lock:
+            self.desktop = None
+            if self.process is not None and self.process.poll() is None:
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+
+    def remove(self):
+        self.stop()
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+class _Job:
+    def __init__(self, docx_bytes, timeout):
+        self.docx_bytes = docx_bytes
+        self.timeout = timeout
+        self.future = Future()
+
+class PdfConverterPool:
+    """Pool of long-lived headless LibreOffice processes converting .docx to PDF.
+
+    Jobs wait in a bounded queue; submit() blocks while it is full, which
+    pushes back on callers instead of piling work up in memory. Each worker
+    owns one office process and reuses it across jobs, killing it when a job
+    runs past its timeout and recycling it after max_jobs_per_worker jobs or
+    once it grows past max_worker_rss bytes.
+    """
+
+    def __init__(self, size=PDF_WORKERS, queue_size=16, job_timeout=60, max_jobs_per_worker=200,
+                 max_worker_rss=1024 * 1024 * 1024, soffice=SOFFICE, startup_timeout=30):
+        self.job_timeout = job_timeout
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.max_worker_rss = max_worker_rss
+        self._jobs = queue.Queue(maxsize=queue_size)
+        self._closed = False
+        self._offices = [_OfficeProcess(soffice, startup_timeout) for _ in range(size)]
+        self._threads = [
+            threading.Thread(target=self._work, args=(office,), name=f"pdf-worker-{i}", daemon=True)
+            for i, office in enumerate(self._offices)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, docx_bytes, timeout=None, job_timeout=None):
+        """Queue a conversion and return a Future resolving to the PDF bytes.
+
+        Blocks while the queue is full, for at most `timeout` seconds (None
+        waits indefinitely), then raises PdfQueueFull.
+        """
+        if self._closed:
+            raise PdfConversionError("PDF converter pool is closed")
+        job = _Job(docx_bytes, job_timeout or self.job_timeout)
+        try:
+            self._jobs.put(job, timeout=timeout)
+        except queue.Full:
+            raise PdfQueueFull("PDF conversion queue is full") from None
+        return job.future
+
+    def convert(self, docx_bytes, timeout=None):
+        """Convert and wait for the PDF bytes"""
+        return self.submit(docx_bytes, timeout=timeout).result()
+
+    def close(self):
+        """Stop accepting jobs, let queued ones finish and shut the office processes down"""
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _work(self, office):
+        work_dir = tempfile.mkdtemp(prefix="pdfgen-jobs-")
+        try:
+            while True:
+                job = self._jobs.get()
+                if job is None:
+                    break
+                if not job.future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    job.future.set_result(self._run(office, job, work_dir))
+                except BaseException as e:
+                    job.future.set_exception(e)
+                self._maybe_recycle(office)
+        finally:
+            office.remove()
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _run(self, office, job, work_dir):
+        if not office.running:
+            office.start()
+
+        docx_path = os.path.join(work_dir, "in.docx")
+        pdf_path = os.path.join(work_dir, "in.pdf")
+        with open(docx_path, "wb") as f:
+            f.write(job.docx_bytes)
+
+        # A hung conversion can't be interrupted over UNO, so kill the office
+        # process; the blocked call then fails and the worker restarts it
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            office.stop()
+
+        watchdog = threading.Timer(job.timeout, kill)
+        watchdog.start()
+        error = None
+        try:
+            office.convert(docx_path, pdf_path)
+        except Exception as e:
+            error = e
+        finally:
+            # cancel() doesn't stop a kill that already fired; wait for it so it
+            # can't land on the office process the next job starts
+            watchdog.cancel()
+            watchdog.join()
+            if os.path.exists(docx_path):
+                os.remove(docx_path)
+
+        try:
+            if timed_out.is_set():
+                raise PdfTimeout(f"PDF conversion took longer than {job.timeout}s") from None
+            if error is not None:
+                office.stop()
+                raise PdfConversionError(f"PDF conversion failed: {error}") from error
+            with open(pdf_path, "rb") as f:
+                return f.read()
+        finally:
+            if os.path.exists(pdf_path):
+                os.remove(pdf_path)
+
+    def _maybe_recycle(self, office):
+        if not office.running:
+            return
+        if office.jobs_done >= self.max_jobs_per_worker or office.rss_bytes() > self.max_worker_rss:
+            office.stop()
@@ -0,0 +1,144 @@
+from docx.oxml.ns import qn
+from docx.text.paragraph import Paragraph
+
+import metrics
+from render import (
+    PLACEHOLDER_MARK,
+    is_empty_price_row,
+    placeholder_pattern,
+    rendered_cell_text,
+    replace_in_paragraph
+)
+from xml_render import (
+    cell_texts_xml,
+    center_cell_xml,
+    is_normalized_xml,
+    paragraph_text_xml,
+    placeholders_in_text_nodes_xml,
+    replace_in_paragraph_xml,
+    replace_in_text_nodes_xml,
+    row_cells_xml,
+    story_paragraphs_xml
+)
+
+RENDER_ENGINES = ("docx", "xml")
+
+class PlaceholderIndex:
+    """Where in a template the body render has work to do.
+
+    Locations are stored as child-index paths from the document body rather than
+    element references, so one index built on the cached template resolves
+    against every deep copy handed out by the template cache.
+    """
+
+    def __init__(self, paragraphs, cells, price_rows=(), in_place=frozenset()):
+        self.paragraphs = paragraphs  # Paths of paragraphs containing "<<", innermost first
+        self.cells = cells  # Paths of top-level table cells that get centred vertically
+        # (row path, first cell texts, price cell texts) for rows remove_empty_rows() checks
+        self.price_rows = price_rows
+        # Paragraphs of a normalized template that are filled in their text nodes
+        self.in_place = in_place
+
+    def __len__(self):
+        return len(self.paragraphs)
+
+def element_path(element, root):
+    """Return the child-index path leading from `root` down to `element`"""
+    path = []
+    while element is not root:
+        parent = element.getparent()
+        path.append(parent.index(element))
+        element = parent
+    return tuple(reversed(path))
+
+def resolve_path(root, path):
+    """Return the element found by following `path` down from `root`"""
+    element = root
+    for i in path:
+        element = element[i]
+    return element
+
+def build_index(doc):
+    """Scan a template body once with the same walk replace_in_body_xml() does"""
+    body = doc.element.body
+    normalized = is_normalized_xml(doc.settings.element)
+    paragraphs = []
+    in_place = set()
+    for p in story_paragraphs_xml(body):
+        if PLACEHOLDER_MARK in paragraph_text_xml(p):
+            path = element_path(p, body)
+            paragraphs.append(path)
+            if normalized and placeholders_in_text_nodes_xml(p):
+                in_place.add(path)
+    cells = []
+    price_rows = []
+    seen_cells = set()
+    for tbl in body.iterchildren(qn("w:tbl")):
+        for tr in tbl.tr_lst:
+            row_cells = row_cells_xml(tr)
+            # A normalized template has its cells centred already
+            if not normalized:
+                for tc in row_cells:
+                    # Merged cells show up once per grid column; align them only once
+                    path = element_path(tc, body)
+                    if path not in seen_cells:
+                        seen_cells.add(path)
+                        cells.append(path)
+            if len(row_cells) > 2:
+                price_rows.append((element_path(tr, body),
+                                   cell_texts_xml(row_cells[0]), cell_texts_xml(row_cells[2])))
+    return PlaceholderIndex(paragraphs, cells, price_rows, frozenset(in_place))
+
+def render_indexed(doc, index, placeholders, engine="docx", prune_rows=False):
+    """Render the body of a copy of the indexed template, visiting only indexed locations.
+
+    engine="docx" edits through python-docx Paragraph proxies, engine="xml"
+    edits the raw w:p elements; both produce the same XML. With prune_rows it
+    also does remove_empty_rows() on every table, deciding each row from the
+    placeholder values rather than reading the rendered cells back.
+    """
+    if engine not in RENDER_ENGINES:
+        raise ValueError(f"Unknown render engine: {engine}")
+    body = doc.element.body
+    pattern = placeholder_pattern(placeholders)
+
+    empty_rows = []
+    if prune_rows:
+        with metrics.stage("prune"):
+            empty_rows = [
+                path for path, first, price in index.price_rows
+                if is_empty_price_row(rendered_cell_text(first, placeholders, pattern),
+                                      rendered_cell_text(price, placeholders, pattern))
+            ]
+    # Top-level rows sit at body/tbl/tr, so a path's first two steps name its row
+    dropped = set(empty_rows)
+
+    counting = metrics.current_trace() is not None
+    visited = replaced = 0
+    with metrics.stage("replace"):
+        for path in index.paragraphs:
+            if path[:2] in dropped:
+                continue
+            p = resolve_path(body, path)
+            visited += 1
+            if counting:
+                replaced += len(pattern.findall(paragraph_text_xml(p)))
+            if path in index.in_place:
+                replace_in_text_nodes_xml(p, placeholders, pattern)
+            elif engine == "xml":
+                replace_in_paragraph_xml(p, placeholders, pattern)
+            else:
+                replace_in_paragraph(Paragraph(p, doc._body), placeholders, pattern)
+        for path in index.cells:
+            if path[:2] not in dropped:
+                center_cell_xml(resolve_path(body, path))
+
+    # Last first, so removing a row never shifts the path of one still to go
+    with metrics.stage("prune"):
+        for path in reversed(empty_rows):
+            tr = resolve_path(body, path)
+            tr.getparent().remove(tr)
+    metrics.count("paragraphs_visited", visited)
+    metrics.count("placeholders_replaced", replaced)
+    metrics.count("rows_removed", len(empty_rows))
+    return doc
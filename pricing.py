@@ -0,0 +1,160 @@
+CURRENCY_SYMBOLS = {
+    "USD": "$",
+    "INR": "₹",
+    "AUD": "A$"
+}
+DEFAULT_CURRENCY_SYMBOL = "$"
+
+# Fixed "Additional Features & Enhancements" price per currency
+ADDITIONAL_FEATURES_PRICE = {
+    "USD": 250,
+    "INR": 25000,
+    "AUD": 375
+}
+DEFAULT_ADDITIONAL_FEATURES_PRICE = 250
+
+# Annual maintenance, as a share of the base total
+MAINTENANCE_RATE = 0.10
+
+# Appended to the displayed total, per currency
+TAX_SUFFIX = {
+    "INR": " + 18% GST"
+}
+
+# Amounts a pricing rule can put into placeholders and the summary
+AMOUNTS = ("base", "maintenance", "total", "additional_features")
+SUMMARY_SEPARATOR = "---"
+
+SUMMARY_LABELS = {
+    "base": "Base Services Cost",
+    "maintenance": "Annual Maintenance ({rate:.0%})",
+    "total": "Total Amount",
+    "additional_features": "Additional Features & Enhancements"
+}
+
+def format_number_with_commas(number):
+    """Format number with commas (e.g., 10000 -> 10,000)"""
+    return f"{number:,}"
+
+def format_price(currency_symbol, value):
+    """Format an amount for a proposal (e.g., "$", 10000 -> $10,000)"""
+    return f"{currency_symbol}{format_number_with_commas(value)}"
+
+def validate_rule(config):
+    """Raise ValueError if a proposal's "pricing" rule refers to unknown keys or amounts"""
+    rule = config["pricing"]
+    keys = {key for _, key in config["pricing_fields"]}
+    unknown_keys = set(rule.get("base_excludes", ())) - keys
+    if unknown_keys:
+        raise ValueError(f"Pricing rule excludes unknown fields: {sorted(unknown_keys)}")
+    used = list(rule.get("placeholders", {}).values()) + [
+        item for item in rule.get("summary", ()) if item != SUMMARY_SEPARATOR]
+    unknown_amounts = set(used) - set(AMOUNTS)
+    if unknown_amounts:
+        raise ValueError(f"Pricing rule uses unknown amounts: {sorted(unknown_amounts)}")
+
+def base_fields(config):
+    """Pricing keys that count towards the base total, in pricing_fields order"""
+    excluded = config["pricing"].get("base_excludes", ())
+    return [key for _, key in config["pricing_fields"] if key not in excluded]
+
+def quote_amounts(config, currency, numerical_values):
+    """The amounts of one quote: base total, maintenance, total and additional features"""
+    base = sum(numerical_values.get(key, 0) for key in base_fields(config))
+    maintenance = int(base * config["pricing"].get("maintenance_rate", MAINTENANCE_RATE))
+    return {
+        "base": base,
+        "maintenance": maintenance,
+        "total": base + maintenance,
+        "additional_features": ADDITIONAL_FEATURES_PRICE.get(currency, DEFAULT_ADDITIONAL_FEATURES_PRICE)
+    }
+
+def price_proposal(config, currency, numerical_values):
+    """Work out the pricing placeholders for a proposal from its config's rule.
+
+    Returns (pricing_data, summary): the <<...>> pricing placeholders, and the
+    markdown lines the form shows under the price inputs.
+    """
+    rule = config["pricing"]
+    currency_symbol = CURRENCY_SYMBOLS.get(currency, DEFAULT_CURRENCY_SYMBOL)
+    shown = {
+        name: format_price(currency_symbol, amount)
+        for name, amount in quote_amounts(config, currency, numerical_values).items()
+    }
+    shown["total"] += TAX_SUFFIX.get(currency, "")
+
+    # Line items are blank when zero unless the rule shows every base item
+    always_shown = set(base_fields(config)) if rule.get("show_zero_line_items") else set()
+    pricing_data = {}
+    for _, key in config["pricing_fields"]:
+        value = numerical_values.get(key, 0)
+        pricing_data[f"<<{key}>>"] = (
+            format_price(currency_symbol, value) if value > 0 or key in always_shown else "")
+    for placeholder, name in rule.get("placeholders", {}).items():
+        pricing_data[placeholder] = shown[name]
+
+    rate = rule.get("maintenance_rate", MAINTENANCE_RATE)
+    summary = [
+        item if item == SUMMARY_SEPARATOR
+        else f"**{SUMMARY_LABELS[item].format(rate=rate)}:** {shown[item]}"
+        for item in rule.get("summary", ())
+    ]
+    return pricing_data, summary
+
+def _numpy():
+    try:
+        import numpy  # Only the batch API needs it, so the app doesn't pay for the import
+    except ImportError:
+        raise ImportError("Batch pricing needs NumPy (pip install numpy)") from None
+    return numpy
+
+def price_batch(config, currencies, values):
+    """quote_amounts() for many scenarios at once, vectorized with NumPy.
+
+    `values` is an (n, len(pricing_fields)) array of line-item amounts in
+    pricing_fields order and `currencies` a currency code per scenario, or
+    one code for all of them. Returns int64 arrays keyed like quote_amounts(),
+    equal element for element to pricing each scenario on its own.
+    """
+    np = _numpy()
+    values = np.asarray(values, dtype=np.int64)
+    keys = [key for _, key in config["pricing_fields"]]
+    if values.ndim != 2 or values.shape[1] != len(keys):
+        raise ValueError(f"Expected an (n, {len(keys)}) array of {', '.join(keys)} amounts")
+
+    base = values[:, np.isin(keys, base_fields(config))].sum(axis=1)
+    # Float multiply then truncation toward zero, exactly like int(base * rate)
+    rate = config["pricing"].get("maintenance_rate", MAINTENANCE_RATE)
+    maintenance = (base * rate).astype(np.int64)
+
+    currencies = np.broadcast_to(np.asarray(currencies), (len(values),))
+    codes, inverse = np.unique(currencies, return_inverse=True)
+    prices = np.array([ADDITIONAL_FEATURES_PRICE.get(code, DEFAULT_ADDITIONAL_FEATURES_PRICE)
+                       for code in codes.tolist()], dtype=np.int64)
+    return {
+        "base": base,
+        "maintenance": maintenance,
+        "total": base + maintenance,
+        "additional_features": prices[inverse.reshape(-1)]
+    }
+
+def price_grid(config, currencies, field_values):
+    """Price every combination of currencies and candidate line-item amounts.
+
+    `field_values` maps pricing keys to the amounts to try; keys left out
+    stay at 0. Returns (currency per scenario, (n, fields) values array,
+    price_batch() amounts), scenarios ordered like itertools.product().
+    """
+    np = _numpy()
+    keys = [key for _, key in config["pricing_fields"]]
+    unknown = set(field_values) - set(keys)
+    if unknown:
+        raise ValueError(f"Not pricing fields of this proposal: {sorted(unknown)}")
+
+    axes = [np.asarray(currencies)] + [
+        np.asarray(field_values.get(key, (0,)), dtype=np.int64) for key in keys]
+    picks = [grid.reshape(-1) for grid in
+             np.meshgrid(*(np.arange(len(axis)) for axis in axes), indexing="ij")]
+    scenario_currencies = axes[0][picks[0]]
+    values = np.column_stack([axis[pick] for axis, pick in zip(axes[1:], picks[1:])])
+    return scenario_currencies, values, price_batch(config, scenario_currencies, values)
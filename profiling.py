@@ -0,0 +1,143 @@
+import argparse
+import cProfile
+import glob
+import io
+import json
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Profile every render of this process, not only those asked for with ?profile=1
+PROFILE = os.environ.get("PDFGEN_PROFILE", "") not in ("", "0")
+PROFILE_DIR = os.environ.get(
+    "PDFGEN_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "pdfgen-profiles"))
+# Captures kept in PROFILE_DIR; the oldest go first
+PROFILE_KEEP = int(os.environ.get("PDFGEN_PROFILE_KEEP", 50))
+
+# Functions and allocation sites listed in a capture's summary
+TOP_N = 25
+
+# tracemalloc is process-wide, so only one render at a time is profiled; others
+# that ask while it runs go ahead unprofiled rather than wait
+_capture_lock = threading.Lock()
+
+@contextmanager
+def profiled(template_path, placeholders, proposal=None, directory=PROFILE_DIR, keep=PROFILE_KEEP):
+    """Run the block under cProfile and tracemalloc and save the capture to `directory`.
+
+    A capture is a .prof file (pstats / snakeviz format) and a .json summary
+    with the template, the placeholder dict's size, the time taken, the
+    allocation peak and the top functions and allocation sites. Yields the
+    summary's path, or None when another render is being profiled.
+    """
+    if not _capture_lock.acquire(blocking=False):
+        yield None
+        return
+    try:
+        profiler = cProfile.Profile()
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        stem = _capture_stem(template_path)
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            yield os.path.join(directory, stem + ".json")
+        finally:
+            profiler.disable()
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] - base
+            snapshot = tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+            save_capture(directory, stem, profiler, snapshot, {
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "proposal": proposal,
+                "template": os.path.basename(template_path),
+                "template_path": template_path,
+                "placeholders": len(placeholders),
+                "placeholder_bytes": sum(len(str(k)) + len(str(v)) for k, v in placeholders.items()),
+                "ms": round(seconds * 1000, 2),
+                "peak_bytes": peak,
+            }, keep)
+    finally:
+        _capture_lock.release()
+
+def _capture_stem(template_path):
+    # Sorts by time, and stays unique across the workers of a pool
+    name = os.path.splitext(os.path.basename(template_path))[0].replace(" ", "_")
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 10**9:09d}-{os.getpid()}-{name}"
+
+def save_capture(directory, stem, profiler, snapshot, summary, keep=PROFILE_KEEP):
+    os.makedirs(directory, exist_ok=True)
+    profiler.dump_stats(os.path.join(directory, stem + ".prof"))
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(TOP_N)
+    summary["top_functions"] = out.getvalue().strip().splitlines()
+    # Allocations made in the render that were still alive at its end, by line
+    summary["top_allocations"] = [
+        {"where": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+         "bytes": stat.size, "count": stat.count}
+        for stat in snapshot.statistics("lineno")[:TOP_N]
+    ]
+    path = os.path.join(directory, stem + ".json")
+    with open(path + ".part", "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    os.replace(path + ".part", path)
+    rotate(directory, keep)
+
+def captures(directory=PROFILE_DIR):
+    """Summary paths of the captures in `directory`, oldest first"""
+    return sorted(glob.glob(os.path.join(directory, "*.json")), key=os.path.basename)
+
+def rotate(directory=PROFILE_DIR, keep=PROFILE_KEEP):
+    """Delete all but the newest `keep` captures"""
+    for path in captures(directory)[:-keep or None]:
+        for member in (path, os.path.splitext(path)[0] + ".prof"):
+            try:
+                os.remove(member)
+            except FileNotFoundError:
+                pass  # Another worker rotated it away first
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="List profiles captured from renders, or show one")
+    parser.add_argument("capture", nargs="?",
+                        help="A capture's .json or .prof file to show (default: list them all)")
+    parser.add_argument("--dir", default=PROFILE_DIR)
+    parser.add_argument("--sort", default="cumulative", help="pstats sort key for the function table")
+    parser.add_argument("--limit", type=int, default=40)
+    args = parser.parse_args(argv)
+
+    if args.capture is None:
+        paths = captures(args.dir)
+        if not paths:
+            print(f"No captures in {args.dir}", file=sys.stderr)
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                summary = json.load(f)
+            print(f"{os.path.basename(os.path.splitext(path)[0])}  {summary['ms']:8.1f} ms  "
+                  f"peak {summary['peak_bytes'] / 2**20:6.1f} MiB  "
+                  f"{summary['placeholders']} placeholders  {summary['template']}")
+        return 0
+
+    stem = os.path.splitext(args.capture)[0]
+    with open(stem + ".json", encoding="utf-8") as f:
+        summary = json.load(f)
+    print(f"{summary['template']} ({summary['proposal']}): {summary['ms']:.1f} ms, "
+          f"allocation peak {summary['peak_bytes'] / 2**20:.1f} MiB, "
+          f"{summary['placeholders']} placeholders")
+    pstats.Stats(stem + ".prof").sort_stats(args.sort).print_stats(args.limit)
+    print("Top allocations still alive at the end of the render:")
+    for allocation in summary["top_allocations"]:
+        print(f"  {allocation['bytes'] / 1024:9.1f} KiB  {allocation['count']:6}  {allocation['where']}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
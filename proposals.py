@@ -0,0 +1,494 @@
+import os
+from datetime import datetime
+
+from pricing import (
+    CURRENCY_SYMBOLS,
+    DEFAULT_CURRENCY_SYMBOL,
+    format_price,
+    price_proposal,
+    validate_rule
+)
+
+# Pricing rules, evaluated by pricing.py. Every line item counts towards the
+# base total unless listed in "base_excludes"; "placeholders" fills placeholders
+# with derived amounts (base, maintenance, total incl. tax suffix,
+# additional_features) and "summary" lists what the form shows below the prices
+STANDARD_PRICING = {
+    "placeholders": {
+        "<<AM-Price>>": "maintenance",
+        "<<AF-Price>>": "additional_features",
+        "<<T-Price>>": "total"
+    }
+}
+PROJECT_SUMMARY = ["base", "maintenance", "---", "total", "---", "additional_features"]
+
+# Proposal configurations
+PROPOSAL_CONFIG = {
+    "Make, Manychat & CRM Automation": {
+        "template": "Make, Manychat & CRM Automation.docx",
+        "pricing_fields": [
+            ("ManyChat Automation", "MC-Price"),
+            ("Make Automation", "M-Price"),
+            ("CRM Automations", "C-Price")
+        ],
+        "pricing": STANDARD_PRICING,
+        "team_type": "general",
+        "special_fields": [("VDate", "<<")]
+    },
+    "Make & Manychat Automation": {
+        "template": "Make & Manychat Automation.docx",
+        "pricing_fields": [
+            ("ManyChat Automation", "MC-Price"),
+            ("Make Automation", "M-Price")
+        ],
+        "pricing": STANDARD_PRICING,
+        "team_type": "general",
+        "special_fields": [("VDate", "<<")]
+    },
+    "Ai Calling, Make, Manychat and CRM Automation": {
+        "template": "Ai Calling, Make, Manychat and CRM Automation.docx",
+        "pricing_fields": [
+            ("AI Calling + CRM Integration", "AI-Price"),
+            ("ManyChat & Make Automation", "MM-Price")
+        ],
+        "pricing": STANDARD_PRICING,
+        "team_type": "general",
+        "special_fields": [("VDate", "<<")]
+    },
+    "AI Calling, Make & CRM Automation": {
+        "template": "AI Calling, Make & CRM Automation.docx",
+        "pricing_fields": [
+            ("AI Calling", "AI-Price"),
+            ("Make Automation", "M-Price"),
+            ("CRM Automations", "C-Price")
+        ],
+        "pricing": STANDARD_PRICING,
+        "team_type": "general",
+        "special_fields": [("VDate", "<<")]
+    },
+    "AI Calling(Basic) & CRM Automation": {
+        "template": "AI Calling(Basic) & CRM Automation.docx",
+        "pricing_fields": [
+            ("AI Calling(Basic)", "AI-Price"),
+            ("CRM Automation", "CC-Price")
+        ],
+        "pricing": STANDARD_PRICING,
+        "team_type": "general",
+        "special_fields": [("VDate", "<<")]
+    },
+    "AI Calling, Make & Manychat Automation": {
+        "template": "Ai Calling, Make & Manychat Automation.docx",
+        "pricing_fields": [
+            ("AI Calling(Basic)", "AI-Price"),
+            ("ManyChat Automation", "MC-Price"),
+            ("Make Automation", "M-Price")
+        ],
+        "pricing": STANDARD_PRICING,
+        "team_type": "general",
+        "special_fields": [("VDate", "<<")]
+    },
+    "Ai Calling + CRM Intergration, Make & Manychat Automation, CRM Automation": {
+        "template": "Ai Calling + CRM Intergration, Make & Manychat Automation, CRM Automation.docx",
+        "pricing_fields": [
+            ("AI Calling + CRM Integration", "AI-Price"),
+            ("ManyChat & Make Automation", "MM-Price"),
+            ("CRM Automation", "CC-Price")
+        ],
+        "pricing": STANDARD_PRICING,
+        "team_type": "general",
+        "special_fields": [("VDate", "<<")]
+    },
+    "AI Calling(Basic) & CRM Automation & Email Automation": {
+        "template": "AI Calling(Basic) & CRM Automation & Email Automation.docx",
+        "pricing_fields": [
+            ("AI Calling(Basic)", "AI-Price"),
+            ("CRM Automation", "CC-Price"),
+            ("Email Automation", "E-Price")
+        ],
+        "pricing": STANDARD_PRICING,
+        "team_type": "general",
+        "special_fields": [("VDate", "<<")]
+    },
+    "Manychat & CRM Automation": {
+        "template": "Manychat & CRM Automation.docx",
+        "pricing_fields": [
+            ("ManyChat Automation", "MC-Price"),
+            ("CRM Automations", "C-Price")
+        ],
+        "pricing": STANDARD_PRICING,
+        "team_type": "general",
+        "special_fields": [("VDate", "<<")]
+    },
+    "Make & CRM Automation": {
+        "template": "Make & CRM Automation.docx",
+        "pricing_fields": [
+            ("Make Automation", "M-Price"),
+            ("CRM Automations", "C-Price")
+        ],
+        "pricing": STANDARD_PRICING,
+        "team_type": "general",
+        "special_fields": [("VDate", "<<")]
+    },
+    "Make, CRM Automation & AI Content Creation": {
+        "template": "Make, CRM Automation & AI Content Creation.docx",
+        "pricing_fields": [
+            ("Make Automation", "M-Price"),
+            ("CRM Automations", "C-Price"),
+            ("AI Content Creation", "ACC-Price")
+        ],
+        "pricing": STANDARD_PRICING,
+        "team_type": "general",
+        "special_fields": [("VDate", "<<")]
+    },
+    "Digital Marketing": {
+        "template": "DM Proposal.docx",
+        "pricing_fields": [
+            ("Marketing Strategy", "ms_price"),
+            ("Social Media Handles Setup", "smh_price"),
+            ("Meta & Google Ads Manager Setup", "sgam_price"),
+            ("Creative Posts (10 per month)", "cp_price"),
+            ("Meta Paid Ads", "ma_price"),
+            ("Google Paid Ads", "gpa_price"),
+            ("SEO", "seo_price"),
+            ("Email Marketing", "em_price"),
+            ("Monthly Maintenance & Reporting", "mmr_price")
+        ],
+        "pricing": STANDARD_PRICING,
+        "team_fields": [
+            ("Digital Marketing Executive", "dm_ex_no"),
+            ("Digital Marketing Associate", "dm_asso_no"),
+            ("Business Analyst", "ba_no"),
+            ("Graphics Designer", "gd_no")
+        ],
+        "special_fields": [
+            ("validity_date", "<<"),
+            ("advnc_pay", "<<"),
+            ("balnc_pay", "<<")
+        ],
+        "team_type": "digital_marketing"
+    },
+    "Shopify Website": {
+        "template": "Shopify website.docx",
+        "pricing_fields": [
+            ("Development", "development"),
+            ("Design", "design"),
+            ("Testing & Live", "testing"),
+            ("Annual Maintenance", "annual_mai"),
+            ("Additional Features & Enhancements", "add_feature")
+        ],
+        "pricing": STANDARD_PRICING,
+        "team_fields": [
+            ("Project Manager", "pm_no"),
+            ("Business Analyst", "ba_no"),
+            ("UI/UX Members", "uix_no"),
+            ("Backend Developers", "bd_no"),
+            ("Frontend Developers", "fd_no"),
+            ("AI/ML Developers", "aiml_no"),
+            ("System Architect", "sa_no"),
+            ("Shopify Developers", "sd_no")
+        ],
+        "special_fields": [
+            ("validity_date", "<<"),
+            ("location", "<<")  # Added for country/location field
+        ],
+        "team_type": "shopify"  # New team type for Shopify projects
+    },
+    "Web Based AI Fintech": {
+        "template": "Web based AI Fintech proposal.docx",
+        "pricing_fields": [
+            ("Design", "design"),
+            ("Development", "development"),
+            ("AI/ML Models", "ai_ml_model"),
+            ("Additional Features & Enhancements", "additional_feat")
+        ],
+        "pricing": {
+            "base_excludes": ["additional_feat"],
+            "placeholders": {"<<annual_main>>": "maintenance"},
+            "summary": ["base", "maintenance", "---"]
+        },
+        "team_fields": [
+            ("Project Manager", "pm_no"),
+            ("Business Analyst", "ba_no"),
+            ("UI/UX Members", "uix_no"),
+            ("Backend Developers", "bd_no"),
+            ("Frontend Developers", "fd_no"),
+            ("AI/ML Developers", "aiml_no"),
+            ("System Architect", "sa_no"),
+            ("AWS Developer", "aws_no")
+        ],
+        "special_fields": [
+            ("validity_date", "<<"),
+            ("client_location", "<<")  # Added for location field
+        ],
+        "team_type": "fintech"  # New team type for Fintech projects
+    },
+    "AI Based Search Engine": {
+        "template": "AI Based Search Engine Website Technical Consultation proposal.docx",
+        "pricing_fields": [
+            ("Designs", "design"),
+            ("Development", "development"),
+            ("Testing & Deployment", "test_deploy"),
+            ("Additional Features & Enhancements", "ad_f")
+        ],
+        "pricing": {
+            "base_excludes": ["ad_f"],
+            "placeholders": {"<<annual_mainte>>": "maintenance"},
+            "summary": ["base", "maintenance", "---"]
+        },
+        "team_fields": [
+            ("Project Manager", "pm_no"),
+            ("Business Analyst", "ba_no"),
+            ("UI/UX Members", "uix_no"),
+            ("Backend Developers", "bd_no"),
+            ("Frontend Developers", "fd_no"),
+            ("AI/ML Developers", "aiml_no"),
+            ("System Architect", "sa_no"),
+            ("AWS Developer", "aws_no")
+        ],
+        "special_fields": [
+            ("validity_date", "<<"),
+            ("client_location", "<<")
+        ],
+        "team_type": "search_engine"
+    },
+    "Single Vendor Ecommerce": {
+        "template": "Single Vendor Ecommerce website.docx",
+        "pricing_fields": [
+            ("Design", "design"),
+            ("Development", "dev"),
+            ("Website Chatbot", "wb_cb"),
+            ("Testing & Deployment", "testing"),
+            ("Additional Features & Enhancements", "ad_fs")
+        ],
+        "pricing": {
+            "base_excludes": ["ad_fs"],
+            "placeholders": {
+                "<<an_ma>>": "maintenance",
+                "<<total>>": "total",
+                "<<ad_fs>>": "additional_features"
+            },
+            "summary": PROJECT_SUMMARY
+        },
+        "team_fields": [
+            ("Project Manager", "pm_no"),
+            ("Business Analyst", "ba_no"),
+            ("UI/UX Members", "uix_no"),
+            ("Backend Developers", "bd_no"),
+            ("Frontend Developers", "fd_no"),
+            ("AI/ML Developers", "aiml_no"),
+            ("System Architect", "sa_no"),
+            ("AWS Developer", "aws_no")
+        ],
+        "special_fields": [
+            ("validity_date", "<<"),
+            ("location", "<<")
+        ],
+        "team_type": "ecommerce"
+    },
+    "Community App": {
+        "template": "Community App Tech Proposal.docx",
+        "pricing_fields": [
+            ("Design", "design"),
+            ("AI/ML & Development", "develop"),
+            ("QA & Project Management", "qa_manag"),
+            ("Additional Features & Enhancements", "add_fea")
+        ],
+        "pricing": {
+            "base_excludes": ["add_fea"],
+            "show_zero_line_items": True,
+            "placeholders": {
+                "<<ann_main>>": "maintenance",
+                "<<total_price>>": "total",
+                "<<add_fea>>": "additional_features",
+                "<<AF-Price>>": "additional_features"
+            },
+            "summary": PROJECT_SUMMARY
+        },
+        "team_fields": [
+            ("Project Manager", "pm_no"),
+            ("Business Analyst", "ba_no"),
+            ("UI/UX Members", "uix_no"),
+            ("Backend Developers", "bd_no"),
+            ("Frontend Developers", "fd_no"),
+            ("AI/ML Developers", "aiml_no"),
+            ("System Architect", "sa_no"),
+            ("AWS Developer", "aws_no")
+        ],
+        "special_fields": [
+            ("validity_date", "<<"),
+            ("location", "<<")
+        ],
+        "team_type": "community_app"
+    },
+    "Job Portal Website": {
+        "template": "Job portal website Tech Proposal.docx",
+        "pricing_fields": [
+            ("Design", "design"),
+            ("Development", "develop"),
+            ("Automations", "autom"),
+            ("Testing & Deployment", "deplo"),
+            ("Additional Features & Enhancements", "ad_fs")
+        ],
+        "pricing": {
+            "base_excludes": ["ad_fs"],
+            "show_zero_line_items": True,
+            "placeholders": {
+                "<<an_m>>": "maintenance",
+                "<<total_price>>": "total",
+                "<<ad_fs>>": "additional_features"
+            },
+            "summary": PROJECT_SUMMARY
+        },
+        "team_fields": [
+            ("Project Manager", "pm_no"),
+            ("Business Analyst", "ba_no"),
+            ("UI/UX Members", "uix_no"),
+            ("Backend Developers", "bd_no"),
+            ("Frontend Developers", "fd_no"),
+            ("AI/ML Developers", "aiml_no"),
+            ("System Architect", "sa_no"),
+            ("AWS Developer", "aws_no")
+        ],
+        "special_fields": [
+            ("validity_date", "<<"),
+            ("location", "<<")
+        ],
+        "team_type": "job_portal"
+    }
+}
+for _config in PROPOSAL_CONFIG.values():
+    validate_rule(_config)
+
+def template_paths(templates_dir):
+    """Paths of every template PROPOSAL_CONFIG uses, each listed once"""
+    return sorted({os.path.join(templates_dir, config["template"]) for config in PROPOSAL_CONFIG.values()})
+
+def validate_phone_number(country, phone_number):
+    """Validate phone number based on country"""
+    if country.lower() == "india":
+        if not phone_number.startswith("+91"):
+            return False
+    elif country.lower() == "australia":
+        if not phone_number.startswith("+61"):
+            return False
+    else:  # USA and others
+        if not phone_number.startswith("+1"):
+            return False
+    return True
+
+# Team composition roles and their placeholder names, per team_type
+TEAM_ROLES = {
+    "marketing": {
+        "Project Manager": "PM",
+        "Content Writers": "CW",
+        "Graphic Designer": "GD",
+        "SEO Specialists": "SE",
+        "Social Media Manager": "SM",
+        "Ad Campaign Manager": "AC"
+    },
+    "general": {
+        "Project Manager": "P1",
+        "Frontend Developers": "F1",
+        "Business Analyst": "B1",
+        "AI/ML Developers": "A1",
+        "UI/UX Members": "U1",
+        "System Architect": "S1",
+        "Backend Developers": "BD1",
+        "AWS Developer": "AD1"
+    },
+    "digital_marketing": {
+        "Digital Marketing Executive": "dm_ex_no",
+        "Digital Marketing Associate": "dm_asso_no",
+        "Business Analyst": "ba_no",
+        "Graphics Designer": "gd_no"
+    },
+    "shopify": {
+        "Project Manager": "pm_no",
+        "Business Analyst": "ba_no",
+        "UI/UX Members": "uix_no",
+        "Backend Developers": "bd_no",
+        "Frontend Developers": "fd_no",
+        "AI/ML Developers": "aiml_no",
+        "System Architect": "sa_no",
+        "Shopify Developers": "sd_no"
+    }
+}
+# Every other project type staffs the same eight roles
+for _team_type in ("fintech", "search_engine", "ecommerce", "community_app", "job_portal"):
+    TEAM_ROLES[_team_type] = {
+        "Project Manager": "pm_no",
+        "Business Analyst": "ba_no",
+        "UI/UX Members": "uix_no",
+        "Backend Developers": "bd_no",
+        "Frontend Developers": "fd_no",
+        "AI/ML Developers": "aiml_no",
+        "System Architect": "sa_no",
+        "AWS Developer": "aws_no"
+    }
+
+def calculate_pricing(selected_proposal, currency, numerical_values):
+    """Work out the pricing placeholders for a proposal.
+
+    Returns (pricing_data, summary): the <<...>> pricing placeholders, and the
+    markdown lines the form shows under the price inputs.
+    """
+    return price_proposal(PROPOSAL_CONFIG[selected_proposal], currency, numerical_values)
+
+def format_special_fields(selected_proposal, currency, special_values):
+    """Placeholders for a proposal's special fields from their raw values.
+
+    Validity dates are date objects, payment fields are amounts and every
+    other field is free text.
+    """
+    currency_symbol = CURRENCY_SYMBOLS.get(currency, DEFAULT_CURRENCY_SYMBOL)
+    special_data = {}
+    for field, wrapper in PROPOSAL_CONFIG[selected_proposal].get("special_fields", []):
+        if wrapper != "<<":
+            continue
+        placeholder = f"<<{field}>>"
+        value = special_values.get(field)
+        if field == "VDate" or field == "validity_date":  # Handle both VDate and validity_date
+            special_data[placeholder] = value.strftime("%d-%m-%Y")
+        elif field in ["advnc_pay", "balnc_pay"]:  # Handle payment fields
+            value = value or 0
+            special_data[placeholder] = format_price(currency_symbol, value) if value > 0 else ""
+        else:
+            special_data[placeholder] = value or ""
+    return special_data
+
+def team_placeholders(team_type, team_counts):
+    """Team composition placeholders from counts keyed by placeholder name"""
+    return {
+        f"<<{placeholder}>>": str(team_counts.get(placeholder, 0))
+        for placeholder in TEAM_ROLES.get(team_type, {}).values()
+    }
+
+def build_placeholders(selected_proposal, client_name="", client_email="", client_number="",
+                       country="", date=None, currency="USD", numerical_values=None,
+                       team_data=None, special_data=None, tools=("", "")):
+    """Assemble the full placeholder dict for one proposal, as the form does"""
+    date = date or datetime.today()
+    placeholders = {
+        "<<client_name>>": client_name,
+        "<<client_phone>>": client_number,
+        "<<client_phoneno>>": client_number,
+        "<<client_email>>": client_email,
+        "<<date>>": date.strftime("%d-%m-%Y"),
+        "<<Country>>": country,
+        "<<Client Name>>": client_name,
+        "<<Client Email>>": client_email,
+        "<<Client Number>>": client_number,
+        "<<Date>>": date.strftime("%d-%m-%Y")
+    }
+
+    pricing_data, _ = calculate_pricing(selected_proposal, currency, numerical_values or {})
+    additional_tools_data = {
+        "<<T1>>": tools[0] or "",
+        "<<T2>>": tools[1] or ""
+    }
+
+    placeholders.update(pricing_data)
+    placeholders.update(team_data or {})
+    placeholders.update(special_data or {})
+    placeholders.update(additional_tools_data)
+    return placeholders
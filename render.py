@@ -0,0 +1,114 @@
+import re
+from functools import lru_cache
+
+from docx.oxml.ns import qn
+from docx.enum.table import WD_CELL_VERTICAL_ALIGNMENT
+
+# Every placeholder key is wrapped as <<name>>, so text without this can be skipped
+PLACEHOLDER_MARK = "<<"
+
+# What any placeholder looks like, whichever keys a proposal defines
+PLACEHOLDER_SYNTAX = re.compile(r"<<[^<>]*>>")
+
+# Price cell contents that mean a pricing row should be dropped
+EMPTY_PRICES = ("", "$0", "₹0", "0")
+
+def apply_formatting(new_run, original_run):
+    """Copy formatting from original run to new run"""
+    if original_run.font.name:
+        new_run.font.name = original_run.font.name
+        new_run._element.rPr.rFonts.set(qn('w:eastAsia'), original_run.font.name)
+    if original_run.font.size:
+        new_run.font.size = original_run.font.size
+    if original_run.font.color.rgb:
+        new_run.font.color.rgb = original_run.font.color.rgb
+    new_run.bold = original_run.bold
+    new_run.italic = original_run.italic
+
+@lru_cache(maxsize=64)
+def _compile_placeholder_pattern(keys):
+    if not keys:
+        return re.compile(r"(?!)")  # Matches nothing
+    # Longest first so a key that prefixes another can't shadow it
+    return re.compile("|".join(re.escape(k) for k in sorted(keys, key=len, reverse=True)))
+
+def placeholder_pattern(placeholders):
+    """Return one compiled alternation matching every key of `placeholders`"""
+    return _compile_placeholder_pattern(frozenset(placeholders))
+
+def substitute_placeholders(text, placeholders, pattern):
+    """Replace every placeholder in `text` in a single scan"""
+    return pattern.sub(lambda m: str(placeholders[m.group(0)]), text)
+
+def substitute_placeholders_counted(text, placeholders, pattern):
+    """substitute_placeholders(), also returning how many placeholders were replaced"""
+    return pattern.subn(lambda m: str(placeholders[m.group(0)]), text)
+
+def replace_in_paragraph(para, placeholders, pattern=None):
+    """Handle paragraph replacements preserving formatting"""
+    original_text = para.text
+    if PLACEHOLDER_MARK not in original_text:
+        return
+    if pattern is None:
+        pattern = placeholder_pattern(placeholders)
+    full_text = substitute_placeholders(original_text, placeholders, pattern)
+
+    if full_text != original_text:
+        original_runs = para.runs
+        para.clear()
+        new_run = para.add_run(full_text)
+        if original_runs:
+            original_run = next((r for r in original_runs if r.text), None)
+            if original_run:
+                apply_formatting(new_run, original_run)
+
+def replace_and_format(doc, placeholders):
+    """Enhanced replacement with table cell handling"""
+    pattern = placeholder_pattern(placeholders)
+
+    # Process paragraphs
+    for para in doc.paragraphs:
+        replace_in_paragraph(para, placeholders, pattern)
+
+    # Process tables
+    for table in doc.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                if cell.tables:
+                    for nested_table in cell.tables:
+                        for nested_row in nested_table.rows:
+                            for nested_cell in nested_row.cells:
+                                for para in nested_cell.paragraphs:
+                                    replace_in_paragraph(para, placeholders, pattern)
+                else:
+                    for para in cell.paragraphs:
+                        replace_in_paragraph(para, placeholders, pattern)
+                cell.vertical_alignment = WD_CELL_VERTICAL_ALIGNMENT.CENTER
+    return doc
+
+def is_empty_price_row(first_text, price_text):
+    """Whether remove_empty_rows() drops a row, given its first and price cell text"""
+    # Skip header row if it exists
+    if first_text.strip().lower() == 'description':
+        return False
+    # Check if price cell is empty or contains only currency symbol or zero
+    return price_text.strip() in EMPTY_PRICES
+
+def rendered_cell_text(paragraph_texts, placeholders, pattern):
+    """cell.text after replace_in_paragraph() has run over paragraphs with these texts"""
+    return "\n".join(
+        substitute_placeholders(text, placeholders, pattern) if PLACEHOLDER_MARK in text else text
+        for text in paragraph_texts
+    )
+
+def remove_empty_rows(table):
+    """Remove rows from the table where the pricing cell is empty or zero"""
+    rows_to_remove = []
+    for row in table.rows:
+        cells = row.cells
+        if len(cells) > 2 and is_empty_price_row(cells[0].text, cells[2].text):
+            rows_to_remove.append(row)
+    
+    # Remove rows in reverse order to avoid index issues
+    for row in reversed(rows_to_remove):
+        table._tbl.remove(row._element)
@@ -0,0 +1,227 @@
+import importlib
+import io
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import metrics
+from template_cache import file_stamp
+
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+# "compiled" joins the precompiled byte segments of a template; "zip" rewrites only
+# the changed parts of the template .docx and gives the same bytes; "docx" (python-docx
+# proxies) and "xml" (raw lxml elements) load the whole package, for A/B comparison
+RENDER_ENGINE = os.environ.get("PDFGEN_RENDER_ENGINE", "compiled")
+
+# Outputs bigger than this many bytes move from memory to a temporary file (0 = never)
+SPILL_THRESHOLD = int(os.environ.get("PDFGEN_SPILL_THRESHOLD", 64 * 1024 * 1024))
+
+# The most memory one render may hold at once, in bytes, besides the template caches
+# every render shares (0 = no limit). Renders estimated to need more are refused,
+# and output past what is left of it goes to a temporary file.
+RENDER_MEMORY_BUDGET = int(os.environ.get("PDFGEN_RENDER_MEMORY_BUDGET", 0))
+
+# An lxml tree takes 6-13 times the size of the XML it was parsed from (measured on
+# the benchmark templates); estimates use the top of that range
+PARSED_XML_FACTOR = 13
+
+# The render engines import python-docx and lxml, which takes longer than the rest of
+# the app's imports together, so they are only imported on first use or by warm_up().
+# These are the modules each engine renders with; "docx" and "xml" use the rest
+ENGINE_MODULES = {
+    "compiled": ("compiled_template",),
+    "zip": ("zip_render",)
+}
+PARSING_ENGINE_MODULES = ("template_cache", "placeholder_index", "zip_render")
+
+# Used when the caller doesn't bring its own caches (the Streamlit app shares them
+# through st.cache_resource)
+@lru_cache(maxsize=None)
+def default_template_cache():
+    from template_cache import TemplateCache
+    return TemplateCache()
+
+def _template_cache(template_cache):
+    # Not `template_cache or ...`: an empty TemplateCache is falsy, having a length
+    return template_cache if template_cache is not None else default_template_cache()
+
+@lru_cache(maxsize=None)
+def default_compiled_templates():
+    from compiled_template import CompiledTemplates
+    return CompiledTemplates()
+
+class RenderBudgetExceeded(MemoryError):
+    """A render would need more memory than the render memory budget allows"""
+
+_estimates = {}  # (path, engine) -> (stamp, bytes); an edited template replaces its entry
+_estimates_lock = threading.Lock()
+
+def memory_estimate(template_path, engine=None, compiled=None):
+    """Bytes a render of the template holds at once with `engine`, its output aside.
+
+    The compiled engine streams every part it has segments for, so it only
+    holds a part it has to parse (`compiled` tells which); the zip engine
+    parses one part at a time; the docx and xml engines hold the whole
+    package parsed, plus the package python-docx saves.
+    """
+    from zip_render import STREAM_CHUNK_SIZE, find_parts
+
+    engine = engine or RENDER_ENGINE
+    stamp = file_stamp(template_path)
+    key = (template_path, engine)
+    cached = _estimates.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    with zipfile.ZipFile(template_path) as zin:
+        main_parts, story_parts, _ = find_parts(zin)
+        sizes = {info.filename: info.file_size for info in zin.infolist()}
+    if engine == "compiled":
+        parsed = [sizes[name] for name, (_, ops) in compiled.parts.items() if ops is None]
+        # A parsed part is also held serialized until it is written
+        estimate = STREAM_CHUNK_SIZE + max(parsed, default=0) * (PARSED_XML_FACTOR + 1)
+    elif engine == "zip":
+        parsed = [sizes[name] for name in main_parts | story_parts]
+        estimate = max(parsed, default=0) * (PARSED_XML_FACTOR + 1)
+    else:
+        xml = sum(size for name, size in sizes.items() if name.endswith((".xml", ".rels")))
+        estimate = xml * PARSED_XML_FACTOR + (sum(sizes.values()) - xml) + stamp[1]
+    with _estimates_lock:
+        _estimates[key] = (stamp, estimate)
+    return estimate
+
+def check_budget(template_path, engine, budget, compiled=None):
+    """Bytes of `budget` left for output held in memory; raises RenderBudgetExceeded
+    when the render alone would need more than the budget"""
+    estimate = memory_estimate(template_path, engine, compiled)
+    if estimate >= budget:
+        raise RenderBudgetExceeded(
+            f"Rendering {os.path.basename(template_path)} with the {engine} engine needs about "
+            f"{estimate / 2**20:.1f} MiB, over the {budget / 2**20:.1f} MiB render memory budget")
+    return budget - estimate
+
+def import_engine(engine=None):
+    """Import the modules `engine` renders with, if that hasn't happened yet"""
+    for name in ENGINE_MODULES.get(engine or RENDER_ENGINE, PARSING_ENGINE_MODULES):
+        importlib.import_module(name)
+
+def new_output_buffer(spill_threshold=SPILL_THRESHOLD):
+    """In-memory output that only touches disk once it grows past spill_threshold"""
+    return tempfile.SpooledTemporaryFile(max_size=spill_threshold)
+
+def render_proposal(template_path, placeholders, out=None, engine=None, template_cache=None,
+                    compiled_templates=None, budget=None):
+    """Render a proposal .docx into `out` and return it rewound to the start.
+
+    `out` is any seekable binary file object; by default a spooled in-memory
+    buffer is used, so nothing is written to or read back from disk. Output is
+    deterministic: the same template and placeholders give the same bytes.
+
+    With a memory budget (RENDER_MEMORY_BUDGET by default) a render that
+    would need more is refused with RenderBudgetExceeded before it starts,
+    and the default buffer spills to disk once the output outgrows what the
+    render leaves of the budget.
+    """
+    engine = engine or RENDER_ENGINE
+    budget = RENDER_MEMORY_BUDGET if budget is None else budget
+    compiled = None
+    if engine == "compiled":
+        from compiled_template import render_compiled
+        with metrics.stage("load"):
+            compiled = (compiled_templates or default_compiled_templates()).get(template_path)
+    spill_threshold = SPILL_THRESHOLD
+    if budget:
+        left = check_budget(template_path, engine, budget, compiled)
+        spill_threshold = min(spill_threshold or left, left)
+    if out is None:
+        out = new_output_buffer(spill_threshold)
+
+    if engine == "compiled":
+        render_compiled(compiled, template_path, placeholders, out)
+    elif engine == "zip":
+        from zip_render import render_docx
+        render_docx(template_path, placeholders, out)
+    else:
+        from placeholder_index import render_indexed
+        from zip_render import FIXED_DATE_TIME, render_docx
+        with metrics.stage("load"):
+            doc, index = _template_cache(template_cache).get_indexed(template_path)
+        doc = render_indexed(doc, index, placeholders, engine=engine, prune_rows=True)
+        saved = io.BytesIO()
+        with metrics.stage("save"):
+            doc.save(saved)
+        # Headers, footers and notes go through the zip engine's part rewriter;
+        # python-docx stamps members with the save time, so fix that too
+        render_docx(saved, placeholders, out, include_main=False, date_time=FIXED_DATE_TIME)
+
+    out.seek(0)
+    return out
+
+def render_proposal_bytes(template_path, placeholders, engine=None, template_cache=None,
+                          compiled_templates=None, budget=None):
+    """Render a proposal .docx and return its bytes.
+
+    The result has to be fully in memory anyway, so this renders into a plain
+    BytesIO and hands its buffer over without the extra copy a read() makes.
+    The memory budget is still checked, but the output isn't held to it; use
+    render_proposal() to keep big outputs out of memory.
+    """
+    out = io.BytesIO()
+    render_proposal(template_path, placeholders, out=out, engine=engine, template_cache=template_cache,
+                    compiled_templates=compiled_templates, budget=budget)
+    return out.getvalue()
+
+def render_proposal_variants(template_path, variants, compiled_templates=None):
+    """Render one template with several placeholder dicts and return each output's bytes.
+
+    Meant for sending the same proposal in several currencies or with and
+    without optional items: the template is loaded once and parts that come
+    out the same in several variants are rendered and compressed only once.
+    Every output is byte-for-byte what render_proposal() gives for its dict.
+    """
+    from compiled_template import render_compiled_variants
+    compiled = (compiled_templates or default_compiled_templates()).get(template_path)
+    return [out.getvalue() for out in render_compiled_variants(compiled, template_path, variants)]
+
+def warm_up(template_paths, engine=None, template_cache=None, compiled_templates=None, workers=None):
+    """Load every template for `engine`, `workers` at a time, then render each once.
+
+    Afterwards the engine's modules are imported, the templates are parsed or
+    compiled and their files are in the page cache, so the first real render
+    costs what every later one does. Templates the compiled engine has no
+    up-to-date artifact for are compiled in worker processes. Templates that
+    don't exist are skipped. Returns {template path: seconds}, slowest first.
+    """
+    paths = [path for path in template_paths if os.path.exists(path)]
+    if not paths:
+        return {}
+    engine = engine or RENDER_ENGINE
+    workers = workers or min(len(paths), os.cpu_count() or 1, 32)
+
+    # Import first, so the import isn't counted against whichever template came first
+    import_engine(engine)
+    if engine == "compiled":
+        seconds = (compiled_templates or default_compiled_templates()).preload(paths, workers)
+    else:
+        cache = _template_cache(template_cache)
+
+        def load(path):
+            start = time.perf_counter()
+            cache.get_indexed(path)
+            return time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            seconds = dict(zip(paths, pool.map(load, paths)))
+
+    # Rendering is cheap once loaded, so do it here: the first render in a
+    # thread also pays for growing that thread's heap
+    for path in paths:
+        start = time.perf_counter()
+        render_proposal(path, {}, out=io.BytesIO(), engine=engine, template_cache=template_cache,
+                        compiled_templates=compiled_templates, budget=0)
+        seconds[path] += time.perf_counter() - start
+    return dict(sorted(seconds.items(), key=lambda item: item[1], reverse=True))
@@ -0,0 +1,198 @@
+import argparse
+import gc
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+
+from metrics import tracing
+from profiling import profiled
+from proposals import template_paths
+from render_core import render_proposal, render_proposal_bytes, warm_up
+
+# smaps_rollup fields reported per process, in bytes
+MEMORY_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+def can_fork():
+    return "fork" in multiprocessing.get_all_start_methods()
+
+def _clean_context():
+    # A start method that doesn't copy the parent's threads' state into workers
+    return multiprocessing.get_context(
+        "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+# Seconds a new worker waits for the rest to start before it gives up on them
+START_TIMEOUT = 120
+
+_all_started = None
+
+def _preload(paths, all_started=None):
+    global _all_started
+    _all_started = all_started
+    warm_up(paths, workers=1)  # One worker per core already
+
+def _wait_for_workers():
+    try:
+        _all_started.wait()
+    except threading.BrokenBarrierError:
+        pass  # Some worker is slow to start; the tasks that need it will wait for it
+
+def _noop():
+    return None
+
+def _pid():
+    return os.getpid()
+
+def render_in_worker(template_path, placeholders, profile=False, proposal=None, to_file=False):
+    """Render with the templates the worker inherited; only the placeholders cross the pipe.
+
+    Returns the bytes with the render's stage seconds and counts, for the
+    parent to add to its trace. With profile the worker saves a capture of
+    the render itself, as profiling the parent would only show it waiting.
+    With to_file the output is streamed to a temporary file and its path
+    returned instead of the bytes; the caller removes it.
+    """
+    with tracing() as trace, profiled(template_path, placeholders, proposal) if profile else nullcontext():
+        if not to_file:
+            return render_proposal_bytes(template_path, placeholders), trace.stages, trace.counts
+        fd, path = tempfile.mkstemp(prefix="pdfgen-render-", suffix=".docx")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                render_proposal(template_path, placeholders, out=out)
+        except BaseException:
+            os.remove(path)
+            raise
+    return path, trace.stages, trace.counts
+
+class RenderPool(ProcessPoolExecutor):
+    """Process pool whose workers share the parent's compiled templates copy-on-write.
+
+    The parent loads every template up front with render_core.warm_up(),
+    moves everything it has allocated so far out of the garbage collector's
+    reach (gc.freeze(), so a collection in a worker doesn't write to, and so
+    copy, those pages) and only then forks the workers, so each template is
+    parsed once per pool rather than once per worker. Functions submitted to
+    it render through render_core's default caches and find them already
+    loaded. Where fork isn't available, or the parent already runs other
+    threads (forking then copies locks they hold into workers that will never
+    see them released), each worker loads the templates itself instead.
+    """
+
+    def __init__(self, workers=None, paths=()):
+        self.paths = list(paths)
+        workers = workers or os.cpu_count() or 1
+        start = time.perf_counter()
+        self.warm_up_times = {}
+        self.forked = can_fork() and threading.active_count() == 1
+        if self.forked:
+            self.warm_up_times = warm_up(self.paths)
+            self.preload_seconds = time.perf_counter() - start
+            gc.collect()
+            gc.freeze()
+            super().__init__(max_workers=workers, mp_context=multiprocessing.get_context("fork"))
+            # Under fork the first task starts every worker at once, so none pays for
+            # process start-up later
+            self.submit(_noop).result()
+        else:
+            self.preload_seconds = 0.0
+            context = _clean_context()
+            all_started = context.Barrier(workers, timeout=START_TIMEOUT)
+            super().__init__(max_workers=workers, mp_context=context, initializer=_preload,
+                             initargs=(self.paths, all_started))
+            # Other start methods start a worker per task only while none is idle, so
+            # hold every worker in a task until all of them are up and preloaded
+            for future in [self.submit(_wait_for_workers) for _ in range(workers)]:
+                future.result()
+        self.start_seconds = time.perf_counter() - start
+
+    def pids(self):
+        return sorted(self._processes)
+
+    def memory(self):
+        """Per-worker memory from /proc, {pid: {field: bytes}}; empty where /proc has no smaps_rollup"""
+        usage = {}
+        for pid in self.pids():
+            fields = process_memory(pid)
+            if fields:
+                usage[pid] = fields
+        return usage
+
+    def dispatch_overhead(self, samples=200):
+        """Median seconds for a no-op task to go to a worker and its result to come back"""
+        timings = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            self.submit(_noop).result()
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings)
+
+def process_memory(pid="self"):
+    """The MEMORY_FIELDS of a process in bytes, or {} when they can't be read"""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", encoding="ascii") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return {}
+    fields = {}
+    for line in lines:
+        name, _, value = line.partition(":")
+        if name in MEMORY_FIELDS:
+            fields[name] = int(value.split()[0]) * 1024
+    return fields
+
+def _mib(n):
+    return f"{n / (1024 * 1024):7.1f}"
+
+def print_report(pool, dispatch, tasks=0, seconds=0.0, out=sys.stdout):
+    parent = process_memory()
+    print(f"{len(pool.pids())} workers started in {pool.start_seconds * 1000:.0f} ms "
+          f"(templates preloaded in {pool.preload_seconds * 1000:.0f} ms)", file=out)
+    if parent:
+        print(f"parent   RSS {_mib(parent['Rss'])} MiB  PSS {_mib(parent['Pss'])} MiB", file=out)
+    usage = pool.memory()
+    for pid, fields in usage.items():
+        private = fields["Private_Clean"] + fields["Private_Dirty"]
+        shared = fields["Shared_Clean"] + fields["Shared_Dirty"]
+        print(f"{pid:<8} RSS {_mib(fields['Rss'])} MiB  PSS {_mib(fields['Pss'])} MiB  "
+              f"private {_mib(private)} MiB  shared {_mib(shared)} MiB", file=out)
+    if usage:
+        # PSS charges shared pages pro rata, so it's what another worker really costs
+        total_pss = sum(fields["Pss"] for fields in usage.values()) + parent.get("Pss", 0)
+        print(f"total PSS {_mib(total_pss).strip()} MiB, "
+              f"{_mib(total_pss / (len(usage) + 1)).strip()} MiB per process", file=out)
+    print(f"dispatch overhead {dispatch * 1e6:.0f} us per task (no-op round trip)", file=out)
+    if tasks:
+        print(f"{tasks} renders in {seconds:.2f} s, {tasks / seconds:.0f}/s", file=out)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Start a render pool, render with it and report per-worker memory")
+    parser.add_argument("--templates-dir", default=os.getcwd())
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--renders", type=int, default=0,
+                        help="Renders to run, spread over the templates, before reporting")
+    args = parser.parse_args(argv)
+
+    paths = [path for path in template_paths(args.templates_dir) if os.path.exists(path)]
+    if not paths:
+        print(f"No templates found in {args.templates_dir}", file=sys.stderr)
+        return 1
+    with RenderPool(args.workers, paths) as pool:
+        seconds = 0.0
+        if args.renders:
+            start = time.perf_counter()
+            futures = [pool.submit(render_in_worker, paths[i % len(paths)], {"<<Client Name>>": f"Client {i}"})
+                       for i in range(args.renders)]
+            for future in futures:
+                future.result()
+            seconds = time.perf_counter() - start
+        print_report(pool, pool.dispatch_overhead(), args.renders, seconds)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+import itertools
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+RENDER_WORKERS = int(os.environ.get("PDFGEN_RENDER_WORKERS", 4))
+RENDER_QUEUE_SIZE = int(os.environ.get("PDFGEN_RENDER_QUEUE_SIZE", 64))
+RENDER_JOBS_PER_USER = int(os.environ.get("PDFGEN_RENDER_JOBS_PER_USER", 2))
+
+# Job statuses
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+class RenderQueueError(RuntimeError):
+    """A job could not be queued"""
+
+class RenderQueueFull(RenderQueueError):
+    """Every worker is busy and the job queue is full"""
+
+class TooManyJobs(RenderQueueError):
+    """The user already has as many jobs in flight as allowed"""
+
+class JobCancelled(Exception):
+    """Raised inside a running job once it has been cancelled"""
+
+class RenderJob:
+    """Handle on one queued render.
+
+    Poll `status`, `stage` and `progress`, block on result(), or have the
+    job pushed to a callback with add_done_callback(). The job's function
+    reports progress through update(), which is also where a cancelled job
+    stops.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, owner, fn, args, kwargs):
+        self.id = next(self._ids)
+        self.owner = owner
+        self.stage = "Waiting for a worker"
+        self.progress = 0.0
+        self.future = Future()
+        self._fn = fn
+        self._args = args
+        self._kwargs = kwargs
+        self._cancelled = threading.Event()
+
+    @property
+    def status(self):
+        future = self.future
+        if future.cancelled():
+            return CANCELLED
+        if future.done():
+            error = future.exception()
+            if error is None:
+                return DONE
+            return CANCELLED if isinstance(error, JobCancelled) else FAILED
+        return RUNNING if future.running() else QUEUED
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def update(self, stage, progress=None):
+        """Report what the job is doing; raises JobCancelled once it has been cancelled"""
+        if self._cancelled.is_set():
+            raise JobCancelled(f"Render job {self.id} was cancelled")
+        self.stage = stage
+        if progress is not None:
+            self.progress = progress
+
+    def cancel(self):
+        """Cancel the job: at once if still queued, at its next update() if running"""
+        self._cancelled.set()
+        self.future.cancel()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+    def add_done_callback(self, fn):
+        """Call fn(job) from the worker once the job finishes, fails or is cancelled"""
+        self.future.add_done_callback(lambda _: fn(self))
+
+    def run(self):
+        if not self.future.set_running_or_notify_cancel():
+            return
+        self.stage = "Starting"
+        try:
+            result = self._fn(self, *self._args, **self._kwargs)
+        except BaseException as e:
+            self.future.set_exception(e)
+        else:
+            self.future.set_result(result)
+
+class RenderQueue:
+    """Bounded pool of worker threads rendering proposals off the Streamlit script thread.
+
+    Every job belongs to an owner (a browser session) that may have at most
+    jobs_per_user jobs queued or running at once. With an is_owner_alive
+    callback, a reaper thread checks owners every reap_interval seconds and
+    cancels the jobs of those that have gone away.
+    """
+
+    def __init__(self, workers=RENDER_WORKERS, queue_size=RENDER_QUEUE_SIZE,
+                 jobs_per_user=RENDER_JOBS_PER_USER, is_owner_alive=None, reap_interval=5):
+        self.jobs_per_user = jobs_per_user
+        self._jobs = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._active = {}  # owner -> jobs queued or running
+        self._closed = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"render-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        self._reaper = None
+        if is_owner_alive is not None:
+            self._reaper = threading.Thread(target=self._reap, args=(is_owner_alive, reap_interval),
+                                            name="render-reaper", daemon=True)
+            self._reaper.start()
+
+    def submit(self, owner, fn, *args, timeout=0, **kwargs):
+        """Queue fn(job, *args, **kwargs) for `owner` and return its RenderJob.
+
+        Raises TooManyJobs when the owner is at its limit, and RenderQueueFull
+        when the queue stays full for `timeout` seconds (default: don't wait).
+        """
+        if self._closed.is_set():
+            raise RenderQueueError("Render queue is closed")
+        job = RenderJob(owner, fn, args, kwargs)
+        with self._lock:
+            active = self._active.setdefault(owner, set())
+            if len(active) >= self.jobs_per_user:
+                raise TooManyJobs(f"At most {self.jobs_per_user} proposals can be generated at once")
+            active.add(job)
+        job.future.add_done_callback(lambda _: self._finished(job))
+        try:
+            self._jobs.put(job, timeout=timeout)
+        except queue.Full:
+            job.cancel()
+            raise RenderQueueFull("The server is busy, please try again in a moment") from None
+        return job
+
+    def jobs(self, owner):
+        """Jobs of `owner` that are still queued or running"""
+        with self._lock:
+            return list(self._active.get(owner, ()))
+
+    def cancel_owner(self, owner):
+        """Cancel every job of `owner`, e.g. because its session closed"""
+        for job in self.jobs(owner):
+            job.cancel()
+
+    def pending(self):
+        """Number of jobs waiting for a worker"""
+        return self._jobs.qsize()
+
+    def close(self):
+        """Stop accepting jobs, let queued ones finish and stop the workers"""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+        if self._reaper is not None:
+            self._reaper.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _finished(self, job):
+        with self._lock:
+            active = self._active.get(job.owner)
+            if active is not None:
+                active.discard(job)
+                if not active:
+                    del self._active[job.owner]
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            job.run()
+
+    def _reap(self, is_owner_alive, interval):
+        while not self._closed.wait(interval):
+            with self._lock:
+                owners = list(self._active)
+            for owner in owners:
+                try:
+                    alive = is_owner_alive(owner)
+                except Exception:
+                    alive = True  # Never cancel on a failed check
+                if not alive:
+                    self.cancel_owner(owner)
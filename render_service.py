@@ -0,0 +1,400 @@
+import argparse
+import errno
+import http.client
+import io
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from batch import row_to_placeholders
+from fragments import resolve_template
+from metrics import PROMETHEUS_MIME, current_trace, default_metrics, stage, traced_render
+from output_cache import OutputCache
+from pdf_export import PDF_MIME, PdfConversionError, PdfConverterPool, PdfQueueFull, PdfTimeout
+from profiling import PROFILE, profiled
+from proposals import PROPOSAL_CONFIG, template_paths
+from render_core import (
+    DOCX_MIME,
+    RENDER_ENGINE,
+    RENDER_MEMORY_BUDGET,
+    RenderBudgetExceeded,
+    render_proposal,
+    render_proposal_bytes,
+    warm_up
+)
+from render_pool import RenderPool, render_in_worker
+
+OUTPUT_FORMATS = {"docx": DOCX_MIME, "pdf": PDF_MIME}
+
+# The app renders through the service at this URL instead of in its own process
+RENDER_SERVICE_URL = os.environ.get("PDFGEN_RENDER_SERVICE_URL", "")
+
+DEFAULT_PORT = 8750
+MAX_REQUEST_BYTES = 1024 * 1024
+RESPONSE_CHUNK_SIZE = 256 * 1024
+
+# How long a PDF request waits for a free LibreOffice worker
+PDF_QUEUE_TIMEOUT = 30
+
+class RenderServiceError(RuntimeError):
+    """The render service turned a request down"""
+
+    def __init__(self, status, message):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+class RenderService:
+    """Renders proposals by type into .docx or PDF bytes, through the output cache.
+
+    With workers > 0 rendering happens in a RenderPool of that many worker
+    processes, forked once every template is loaded; with workers=0 it runs
+    in the calling thread using the given template caches, which is how the
+    app renders when no render service is configured; call warm_up() before
+    the first request then. The LibreOffice pool starts on the first PDF
+    request.
+    """
+
+    def __init__(self, templates_dir=None, workers=0, output_cache=None, template_cache=None,
+                 compiled_templates=None):
+        self.templates_dir = templates_dir or os.getcwd()
+        self.workers = workers
+        self.output_cache = output_cache
+        self.template_cache = template_cache
+        self.compiled_templates = compiled_templates
+        self._pdf_pool = None
+        self._pdf_lock = threading.Lock()
+        self._executor = None
+        self.warm_up_times = {}
+        if workers:
+            self._executor = RenderPool(workers, self.template_paths())
+
+    def template_paths(self):
+        """Every template there is to render, assembled where it uses fragments"""
+        return sorted({resolve_template(path) for path in template_paths(self.templates_dir)
+                       if os.path.exists(path)})
+
+    def template_path(self, proposal):
+        """The template to render `proposal` from, assembled if it uses fragments"""
+        if proposal not in PROPOSAL_CONFIG:
+            raise ValueError(f"Unknown proposal type: {proposal!r}")
+        return resolve_template(os.path.join(self.templates_dir, PROPOSAL_CONFIG[proposal]["template"]))
+
+    def warm_up(self):
+        """Load every template so no request pays for it; returns {template path: seconds}"""
+        if self._executor is not None:
+            self.warm_up_times = self._executor.warm_up_times  # The pool warmed up before forking
+        else:
+            self.warm_up_times = warm_up(self.template_paths(), template_cache=self.template_cache,
+                                         compiled_templates=self.compiled_templates)
+        return self.warm_up_times
+
+    def render(self, proposal, placeholders, output_format="docx", docx_bytes=None, profile=False):
+        """Bytes of one proposal; a PDF is converted from `docx_bytes` when given.
+
+        With profile (or PDFGEN_PROFILE set) the .docx render is captured by
+        profiling.profiled(), bypassing the output cache so it really runs.
+        """
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format: {output_format!r}")
+        profile = profile or PROFILE
+        template_path = self.template_path(proposal)
+        if output_format == "pdf":
+            def render():
+                docx = docx_bytes or self.render(proposal, placeholders, "docx", profile=profile)
+                with stage("convert"):
+                    return self.pdf_pool().convert(docx, timeout=PDF_QUEUE_TIMEOUT)
+        else:
+            def render():
+                return self._render_docx(template_path, placeholders, profile, proposal)
+
+        with traced_render(proposal, template_path, output_format):
+            if self.output_cache is None or profile:
+                return render()
+            return self.output_cache.get_or_render(template_path, placeholders, output_format, render,
+                                                   variant=RENDER_ENGINE)
+
+    def render_file(self, proposal, placeholders, output_format="docx", profile=False):
+        """render() into a binary file open for reading, for callers that can stream it.
+
+        The .docx is never in memory whole: it is rendered into a buffer that
+        spills to disk past the render memory budget, or by a worker into a
+        temporary file, and a cached one is opened rather than read. PDFs are
+        converted in memory as render() does.
+        """
+        if output_format != "docx":
+            return io.BytesIO(self.render(proposal, placeholders, output_format, profile=profile))
+        profile = profile or PROFILE
+        template_path = self.template_path(proposal)
+
+        def render():
+            return self._render_docx(template_path, placeholders, profile, proposal, to_file=True)
+
+        with traced_render(proposal, template_path, output_format):
+            if self.output_cache is None or profile:
+                return render()
+            return self.output_cache.get_or_render_file(template_path, placeholders, output_format, render,
+                                                        variant=RENDER_ENGINE)
+
+    def pdf_pool(self):
+        with self._pdf_lock:
+            if self._pdf_pool is None:
+                self._pdf_pool = PdfConverterPool()
+            return self._pdf_pool
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+        if self._pdf_pool is not None:
+            self._pdf_pool.close()
+
+    def _render_docx(self, template_path, placeholders, profile=False, proposal=None, to_file=False):
+        """The .docx as bytes, or with to_file as a binary file open for reading"""
+        if self._executor is None:
+            render = render_proposal if to_file else render_proposal_bytes
+            with profiled(template_path, placeholders, proposal) if profile else nullcontext():
+                return render(template_path, placeholders, template_cache=self.template_cache,
+                              compiled_templates=self.compiled_templates)
+        result, stages, counts = self._executor.submit(render_in_worker, template_path, placeholders,
+                                                       profile, proposal, to_file).result()
+        current_trace().merge(stages, counts)
+        if not to_file:
+            return result
+        f = open(result, "rb")
+        os.remove(result)  # Gone once closed
+        return f
+
+    def worker_memory(self):
+        """RSS and PSS in bytes per render worker, {pid: {"rss", "pss"}}"""
+        if self._executor is None:
+            return {}
+        return {pid: {"rss": fields["Rss"], "pss": fields["Pss"]}
+                for pid, fields in self._executor.memory().items()}
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    """POST /render with {"proposal", "placeholders" or "fields", "format"}; GET /health,
+    /proposals, and /metrics in Prometheus text format.
+
+    "placeholders" is the finished <<...>> dict; "fields" are the same
+    columns a batch.py row has and get turned into placeholders here.
+    POST /render?profile=1 saves a profile of the render (see profiling.py).
+    """
+
+    protocol_version = "HTTP/1.1"  # Keep-alive
+    server_version = "pdfgen-render/1"
+    timeout = 60  # Idle keep-alive connections are closed after this many seconds
+    # Headers and body go out in separate writes; with Nagle's algorithm the body
+    # waits for the client's delayed ACK of the headers, ~40 ms per response
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == "/health":
+            self._send_json(200, {
+                "status": "ok",
+                "workers": service.workers,
+                "worker_memory": service.worker_memory(),
+                "warm_up_ms": {os.path.basename(path): round(seconds * 1000)
+                               for path, seconds in service.warm_up_times.items()}
+            })
+        elif self.path == "/proposals":
+            self._send_json(200, {"proposals": list(PROPOSAL_CONFIG)})
+        elif self.path == "/metrics":
+            data = default_metrics.exposition().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", PROMETHEUS_MIME)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self._send_json(404, {"error": f"No such endpoint: {self.path}"})
+
+    def do_POST(self):
+        length = self.headers.get("Content-Length")
+        if length is None:
+            self._send_json(411, {"error": "Content-Length is required"})
+            return
+        try:
+            length = int(length)
+        except ValueError:
+            length = -1
+        if length < 0:
+            # There's no telling where the body ends, so neither can the connection go on
+            self.close_connection = True
+            self._send_json(400, {"error": "Content-Length must be a non-negative integer"})
+            return
+        if length > MAX_REQUEST_BYTES:
+            self.close_connection = True
+            self._send_json(413, {"error": "Request body too large"})
+            return
+        body = self.rfile.read(length)
+        url = urlsplit(self.path)
+        if url.path != "/render":
+            self._send_json(404, {"error": f"No such endpoint: {self.path}"})
+            return
+        profile = parse_qs(url.query).get("profile", ["0"])[0] not in ("", "0")
+
+        try:
+            proposal, output_format, placeholders = parse_render_request(body)
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {"error": f"Bad request: {e}"})
+            return
+        # Past here an error is the service's, not the request's
+        try:
+            service = self.server.service
+            if RENDER_MEMORY_BUDGET:
+                # Streamed from the file it was rendered into, so the output never has to fit the budget
+                output = service.render_file(proposal, placeholders, output_format, profile=profile)
+            else:
+                output = io.BytesIO(service.render(proposal, placeholders, output_format, profile=profile))
+        except FileNotFoundError as e:
+            self._send_json(404, {"error": f"Template file not found: {e.filename}",
+                                  "template": e.filename})
+        except PdfQueueFull as e:
+            self._send_json(503, {"error": str(e)})
+        except PdfTimeout as e:
+            self._send_json(504, {"error": str(e)})
+        except PdfConversionError as e:
+            self._send_json(502, {"error": str(e)})
+        except RenderBudgetExceeded as e:
+            self._send_json(507, {"error": str(e)})
+        except Exception as e:
+            self.log_error("Render failed: %r", e)
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+        else:
+            with output:
+                size = output.seek(0, os.SEEK_END)
+                output.seek(0)
+                self.send_response(200)
+                self.send_header("Content-Type", OUTPUT_FORMATS[output_format])
+                self.send_header("Content-Length", str(size))
+                self.end_headers()
+                shutil.copyfileobj(output, self.wfile, RESPONSE_CHUNK_SIZE)
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def parse_render_request(body):
+    """(proposal, output format, placeholders) of a POST /render body.
+
+    Raises ValueError, KeyError or TypeError when the body isn't a valid request.
+    """
+    request = json.loads(body)
+    if not isinstance(request, dict):
+        raise TypeError("the body must be a JSON object")
+    proposal = request["proposal"]
+    if proposal not in PROPOSAL_CONFIG:
+        raise ValueError(f"Unknown proposal type: {proposal!r}")
+    output_format = request.get("format", "docx")
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {output_format!r}")
+    placeholders = request.get("placeholders")
+    if placeholders is None:
+        placeholders = row_to_placeholders(dict(request.get("fields", {}), proposal=proposal))
+    elif not isinstance(placeholders, dict):
+        raise TypeError("placeholders must be a JSON object")
+    return proposal, output_format, placeholders
+
+def report_warm_up(times, seconds, out=sys.stderr):
+    """Print how long warming up took, in total and per template"""
+    print(f"Warmed up {len(times)} templates in {seconds * 1000:.0f} ms", file=out)
+    for path, template_seconds in times.items():
+        print(f"  {template_seconds * 1000:6.0f} ms  {os.path.basename(path)}", file=out)
+
+def make_server(service, host="127.0.0.1", port=DEFAULT_PORT):
+    """A threading HTTP server answering render requests with `service`"""
+    server = ThreadingHTTPServer((host, port), RenderRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+class RenderClient:
+    """Client of a render service, with one kept-alive connection per thread.
+
+    render() has RenderService.render()'s signature, so the app can use
+    either; a missing template raises FileNotFoundError and a failed PDF
+    conversion PdfConversionError, as rendering in process would.
+    """
+
+    def __init__(self, url, timeout=120):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or DEFAULT_PORT
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def render(self, proposal, placeholders, output_format="docx", docx_bytes=None, profile=False):
+        # The service renders PDFs from its own cached .docx, so docx_bytes isn't sent
+        body = json.dumps({"proposal": proposal, "placeholders": placeholders,
+                           "format": output_format}).encode("utf-8")
+        status, data = self._post("/render?profile=1" if profile else "/render", body)
+        if status == 200:
+            return data
+        try:
+            error = json.loads(data)
+        except ValueError:
+            error = {"error": data.decode("utf-8", "replace")}
+        if status == 404 and "template" in error:
+            raise FileNotFoundError(errno.ENOENT, error["error"], error["template"])
+        if status in (502, 503, 504):
+            raise PdfConversionError(error["error"])
+        if status == 507:
+            raise RenderBudgetExceeded(error["error"])
+        raise RenderServiceError(status, error["error"])
+
+    def _post(self, path, body):
+        # A kept-alive connection may have been closed by the server meanwhile;
+        # rendering is idempotent, so retry once on a fresh connection
+        for attempt in range(2):
+            connection = getattr(self._local, "connection", None)
+            if connection is None:
+                connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                self._local.connection = connection
+            try:
+                connection.request("POST", path, body, {"Content-Type": "application/json"})
+                response = connection.getresponse()
+                return response.status, response.read()
+            except (http.client.RemoteDisconnected, ConnectionError):
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve proposal rendering over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--templates-dir", default=os.getcwd())
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Render worker processes (default: CPU count)")
+    parser.add_argument("--no-cache", action="store_true", help="Don't use the output cache")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    service = RenderService(args.templates_dir, workers=args.workers,
+                            output_cache=None if args.no_cache else OutputCache())
+    report_warm_up(service.warm_up(), time.perf_counter() - start)
+    server = make_server(service, args.host, args.port)
+    print(f"Rendering on http://{args.host}:{server.server_port} with {args.workers} workers",
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
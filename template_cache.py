@@ -0,0 +1,150 @@
+import copy
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+class StampedCache:
+    """Values loaded from files, keyed by path and reloaded when a file changes.
+
+    A file counts as changed when its mtime or size does. `load(path)` runs
+    outside the global lock, so different paths load in parallel, but only
+    once per path when several threads ask at the same time. With a maxsize,
+    the least recently used values are dropped past it.
+    """
+
+    def __init__(self, load, maxsize=None):
+        self.load = load
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # path -> (stamp, value)
+        self._lock = threading.Lock()
+        self._path_locks = {}
+
+    def get(self, path):
+        """The value loaded from `path`; raises FileNotFoundError for a missing file"""
+        stamp = file_stamp(path)
+        with self._lock:
+            entry = self._lookup(path, stamp)
+            if entry is not None:
+                return entry[1]
+            path_lock = self._path_locks.setdefault(path, threading.Lock())
+
+        with path_lock:
+            with self._lock:
+                entry = self._lookup(path, stamp)
+                if entry is not None:
+                    return entry[1]
+            value = self.load(path)
+            with self._lock:
+                self.misses += 1
+                self._store(path, stamp, value)
+            return value
+
+    def put(self, path, stamp, value):
+        """Cache a value loaded elsewhere from `path` as it was at `stamp`"""
+        with self._lock:
+            self._store(path, stamp, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _lookup(self, path, stamp):
+        entry = self._entries.get(path)
+        if entry is None or entry[0] != stamp:
+            return None
+        self.hits += 1
+        self._entries.move_to_end(path)
+        return entry
+
+    def _store(self, path, stamp, value):
+        self._entries[path] = (stamp, value)
+        self._entries.move_to_end(path)
+        while self.maxsize is not None and len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+class _CacheEntry:
+    """Parsed template with its placeholder index"""
+
+    def __init__(self, document):
+        self.document = document
+        # Never touch the cached document through proxies: python-docx caches the
+        # body proxy lazily, and a deep copy taken after that would carry a body
+        # element detached from the copied part. Index a scratch copy instead.
+        from placeholder_index import build_index
+        self.index = build_index(copy.deepcopy(document))
+
+
+class TemplateCache:
+    """Process-wide LRU cache of parsed .docx templates.
+
+    Entries are keyed by absolute path and invalidated when the file's mtime or
+    size changes. Callers always get their own deep copy, so the cached trees are
+    never mutated and the cache can be shared across sessions and threads.
+    """
+
+    def __init__(self, maxsize=18):
+        self._entries = StampedCache(_load_entry, maxsize)
+
+    @property
+    def maxsize(self):
+        return self._entries.maxsize
+
+    @property
+    def hits(self):
+        return self._entries.hits
+
+    @property
+    def misses(self):
+        return self._entries.misses
+
+    def get(self, path):
+        """Return a private copy of the parsed template at `path`"""
+        return copy.deepcopy(self._get_entry(path).document)
+
+    def get_indexed(self, path):
+        """Return a private copy of the template plus its shared placeholder index"""
+        entry = self._get_entry(path)
+        return copy.deepcopy(entry.document), entry.index
+
+    def clear(self):
+        """Drop every cached template"""
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get_entry(self, path):
+        # Raises FileNotFoundError like Document() would
+        return self._entries.get(os.path.abspath(path))
+
+
+def _load_entry(path):
+    return _CacheEntry(_parse(path))
+
+
+def _parse(path):
+    # python-docx is only imported once a template is actually parsed
+    from docx import Document
+    return Document(path)
+
+
+def file_stamp(path):
+    """Return the (mtime, size) pair used to detect edited files"""
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
@@ -0,0 +1,82 @@
+import io
+import os
+import sys
+import zipfile
+
+import pytest
+from docx import Document
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from zip_render import FIXED_DATE_TIME  # noqa: E402
+
+W_NS = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+FOOTNOTES_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.footnotes+xml"
+FOOTNOTES_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/footnotes"
+
+PLACEHOLDERS = {
+    "<<client_name>>": "Acme & Sons",
+    "<<date>>": "01-02-2026",
+    "<<Country>>": "Portugal",
+    "<<MC-Price>>": "$1,200",
+    "<<optional_price>>": "",
+    "<<T1>>": "Tier one",
+}
+
+def build_story_template(path):
+    """A template with placeholders in every place a proposal can show text:
+    body, header, footer, footnote, a VML text box, a content control, a
+    three-level nested table and a price row that gets pruned. Members get a
+    fixed timestamp, so the file's bytes don't depend on when it was built."""
+    doc = Document()
+    doc.add_paragraph("Body <<client_name>>")
+    doc.sections[0].header.paragraphs[0].text = "Header <<client_name>> <<date>>"
+    doc.sections[0].footer.paragraphs[0].text = "Footer <<Country>>"
+    table = doc.add_table(rows=3, cols=3)
+    for cell, text in zip(table.rows[0].cells, ("Description", "Qty", "Price")):
+        cell.text = text
+    table.cell(1, 0).text = "Automation for <<client_name>>"
+    table.cell(1, 2).text = "<<MC-Price>>"
+    table.cell(2, 0).text = "Optional extra"
+    table.cell(2, 2).text = "<<optional_price>>"
+    host = table.cell(1, 1)
+    host.paragraphs[0].text = "Host <<T1>>"
+    nested = host.add_table(rows=1, cols=1).cell(0, 0).add_table(rows=1, cols=1)
+    nested.cell(0, 0).add_table(rows=1, cols=1).cell(0, 0).text = "Depth three <<client_name>>"
+    doc.add_paragraph("TEXTBOX_HOST")
+    doc.add_paragraph("FOOTNOTE_HOST")
+    saved = io.BytesIO()
+    doc.save(saved)
+
+    textbox = ('<w:r><w:pict><v:shape xmlns:v="urn:schemas-microsoft-com:vml" style="width:100pt;height:40pt">'
+               '<v:textbox><w:txbxContent><w:p><w:r><w:t>Box &lt;&lt;client_name&gt;&gt;</w:t></w:r></w:p>'
+               '</w:txbxContent></v:textbox></v:shape></w:pict></w:r>')
+    control = ('<w:sdt><w:sdtContent><w:p><w:r><w:t>Control &lt;&lt;date&gt;&gt;</w:t></w:r></w:p>'
+               '</w:sdtContent></w:sdt>')
+    with zipfile.ZipFile(saved) as zin, zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zout:
+        for info in zin.infolist():
+            data = zin.read(info)
+            if info.filename == "word/document.xml":
+                data = (data.decode("utf-8")
+                        .replace("<w:r><w:t>TEXTBOX_HOST</w:t></w:r>",
+                                 "<w:r><w:t>Host &lt;&lt;T1&gt;&gt;</w:t></w:r>" + textbox)
+                        .replace("<w:r><w:t>FOOTNOTE_HOST</w:t></w:r>",
+                                 '<w:r><w:t>See note</w:t></w:r><w:r><w:footnoteReference w:id="1"/></w:r>')
+                        .replace("<w:sectPr", control + "<w:sectPr", 1)
+                        .encode("utf-8"))
+            elif info.filename == "[Content_Types].xml":
+                data = data.replace(b"</Types>", f'<Override PartName="/word/footnotes.xml" '
+                                                 f'ContentType="{FOOTNOTES_TYPE}"/></Types>'.encode())
+            elif info.filename == "word/_rels/document.xml.rels":
+                data = data.replace(b"</Relationships>", f'<Relationship Id="rIdFn" Type="{FOOTNOTES_REL}" '
+                                                         f'Target="footnotes.xml"/></Relationships>'.encode())
+            zout.writestr(zipfile.ZipInfo(info.filename, FIXED_DATE_TIME), data, zipfile.ZIP_DEFLATED)
+        zout.writestr(zipfile.ZipInfo("word/footnotes.xml", FIXED_DATE_TIME),
+                      f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><w:footnotes {W_NS}>'
+                      f'<w:footnote w:id="1"><w:p><w:r><w:t>Note for &lt;&lt;client_name&gt;&gt;</w:t>'
+                      f'</w:r></w:p></w:footnote></w:footnotes>', zipfile.ZIP_DEFLATED)
+    return path
+
+@pytest.fixture(scope="session")
+def story_template(tmp_path_factory):
+    return build_story_template(str(tmp_path_factory.mktemp("templates") / "story.docx"))
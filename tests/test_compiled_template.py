@@ -0,0 +1,73 @@
+import io
+import os
+import pickle
+import shutil
+
+import pytest
+
+from compiled_template import (
+    artifact_path,
+    compile_template,
+    read_artifact,
+    render_compiled,
+    write_artifact
+)
+from conftest import PLACEHOLDERS
+from normalize_template import normalize_template
+from render_core import render_proposal_bytes
+from template_cache import file_sha256
+
+VARIANTS = (
+    PLACEHOLDERS,
+    dict(PLACEHOLDERS, **{"<<client_name>>": "<b>Tab\there</b> & \"quotes\"", "<<MC-Price>>": ""}),
+    {},
+)
+
+@pytest.fixture(scope="module")
+def normalized_template(story_template, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("normalized") / "story.docx")
+    normalize_template(story_template, path)
+    return path
+
+@pytest.mark.parametrize("placeholders", VARIANTS)
+@pytest.mark.parametrize("template", ["story_template", "normalized_template"])
+def test_compiled_engine_matches_zip_engine(request, template, placeholders):
+    path = request.getfixturevalue(template)
+    compiled = render_proposal_bytes(path, placeholders, engine="compiled")
+    assert compiled == render_proposal_bytes(path, placeholders, engine="zip")
+
+def test_artifact_round_trip(story_template, tmp_path):
+    path = str(tmp_path / "story.docx")
+    shutil.copy(story_template, path)
+    compiled = compile_template(path)
+    write_artifact(compiled, artifact_path(path))
+    loaded = read_artifact(artifact_path(path), file_sha256(path))
+    assert loaded.parts == compiled.parts
+    assert loaded.normalized == compiled.normalized
+    assert render_compiled(loaded, path, PLACEHOLDERS, io.BytesIO()).getvalue() == \
+        render_proposal_bytes(path, PLACEHOLDERS, engine="zip")
+
+def test_stale_or_foreign_artifacts_are_ignored(story_template, tmp_path):
+    path = str(tmp_path / "story.docx")
+    shutil.copy(story_template, path)
+    write_artifact(compile_template(path), artifact_path(path))
+    with open(artifact_path(path), "rb") as f:
+        data = f.read()
+    assert read_artifact(artifact_path(path), "0" * 64) is None
+    for planted in (data[:-1], data[:40] + b"\xff" * 16, b""):
+        with open(artifact_path(path), "wb") as f:
+            f.write(planted)
+        assert read_artifact(artifact_path(path), file_sha256(path)) is None
+
+class _Payload:
+    def __reduce__(self):
+        return (os.mkdir, (_Payload.marker,))
+
+def test_artifact_is_never_unpickled(story_template, tmp_path):
+    path = str(tmp_path / "story.docx")
+    shutil.copy(story_template, path)
+    _Payload.marker = str(tmp_path / "pwned")
+    with open(artifact_path(path), "wb") as f:
+        pickle.dump((3, file_sha256(path), _Payload(), False), f)
+    assert read_artifact(artifact_path(path), file_sha256(path)) is None
+    assert not os.path.exists(_Payload.marker)
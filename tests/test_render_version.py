@@ -0,0 +1,66 @@
+import hashlib
+import io
+import json
+import os
+import sys
+import tempfile
+import zipfile
+
+from conftest import PLACEHOLDERS, build_story_template
+from output_cache import RENDER_VERSION
+from render_core import render_proposal_bytes
+
+# Digests of every engine's output on the story template, per RENDER_VERSION.
+# Entries are never edited: output that changes gets a new version and entry.
+FINGERPRINTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "render_fingerprints.json")
+
+ENGINES = ("compiled", "zip", "xml", "docx")
+
+def package_digest(data):
+    """sha256 of a package's member names, timestamps and uncompressed bytes,
+    so zlib builds that compress differently still agree"""
+    h = hashlib.sha256()
+    with zipfile.ZipFile(io.BytesIO(data)) as z:
+        for info in z.infolist():
+            h.update(f"{info.filename}\0{info.date_time}\0".encode("utf-8"))
+            h.update(hashlib.sha256(z.read(info)).digest())
+    return h.hexdigest()
+
+def engine_digests(template_path, placeholders):
+    return {engine: package_digest(render_proposal_bytes(template_path, placeholders, engine=engine))
+            for engine in ENGINES}
+
+def load_fingerprints():
+    with open(FINGERPRINTS, encoding="utf-8") as f:
+        return json.load(f)
+
+def test_render_version_changes_with_output(story_template):
+    recorded = load_fingerprints().get(str(RENDER_VERSION))
+    assert recorded is not None, (
+        f"No fingerprints for RENDER_VERSION {RENDER_VERSION}; "
+        f"record them with: python tests/test_render_version.py")
+    assert engine_digests(story_template, PLACEHOLDERS) == recorded, (
+        "Rendered output changed but RENDER_VERSION didn't, so the output cache would keep "
+        "serving the old bytes: bump RENDER_VERSION in output_cache.py and record the new "
+        "fingerprints with: python tests/test_render_version.py")
+
+def main():
+    """Record the current output's fingerprints under the current RENDER_VERSION"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        digests = engine_digests(build_story_template(os.path.join(work_dir, "story.docx")),
+                                 PLACEHOLDERS)
+    fingerprints = load_fingerprints() if os.path.exists(FINGERPRINTS) else {}
+    known = fingerprints.get(str(RENDER_VERSION))
+    if known is not None and known != digests:
+        print(f"RENDER_VERSION {RENDER_VERSION} already has different fingerprints; "
+              f"bump it in output_cache.py first", file=sys.stderr)
+        return 1
+    fingerprints[str(RENDER_VERSION)] = digests
+    with open(FINGERPRINTS, "w", encoding="utf-8") as f:
+        json.dump(fingerprints, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"Recorded fingerprints for RENDER_VERSION {RENDER_VERSION}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
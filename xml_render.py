@@ -0,0 +1,234 @@
+from docx.enum.table import WD_CELL_VERTICAL_ALIGNMENT
+from docx.oxml import OxmlElement
+from docx.oxml.ns import nsmap, qn
+from docx.oxml.simpletypes import ST_HexColorAuto
+from docx.oxml.text.run import _RunContentAppender
+from lxml import etree
+
+import metrics
+from render import (
+    PLACEHOLDER_MARK,
+    PLACEHOLDER_SYNTAX,
+    is_empty_price_row,
+    rendered_cell_text,
+    substitute_placeholders
+)
+
+# Every paragraph of a story that can hold "<<", at any depth: nested tables,
+# text boxes (DrawingML and their VML fallback), content controls and so on.
+# A paragraph can only hold "<<" if one of its own runs (or hyperlink runs,
+# which python-docx counts as paragraph text) contains "<"
+_STORY_PARAGRAPHS = etree.XPath(
+    ".//w:p[w:r/w:t[contains(., '<')] or w:hyperlink/w:r/w:t[contains(., '<')]]",
+    namespaces=nsmap)
+_BODY_TABLES = etree.XPath("./w:tbl", namespaces=nsmap)
+
+_TC_PR = qn("w:tcPr")
+_V_ALIGN = qn("w:vAlign")
+_V_ALIGN_SUCCESSORS = tuple(qn(tag) for tag in (
+    "w:hideMark", "w:headers", "w:cellIns", "w:cellDel", "w:cellMerge", "w:tcPrChange"))
+_VAL = qn("w:val")
+_CENTER = WD_CELL_VERTICAL_ALIGNMENT.to_xml(WD_CELL_VERTICAL_ALIGNMENT.CENTER)
+
+# The elements CT_P.text / CT_R.text turn into text, as one precompiled query;
+# python-docx's own properties compile an XPath per paragraph and per run
+_RUN_CONTENT = ("w:br", "w:cr", "w:noBreakHyphen", "w:ptab", "w:t", "w:tab")
+_RUN_TEXT = etree.XPath(" | ".join(_RUN_CONTENT), namespaces=nsmap)
+_PARAGRAPH_CONTENT = etree.XPath("./*[not(self::w:pPr)]", namespaces=nsmap)
+_PARAGRAPH_TEXT = etree.XPath(
+    " | ".join(f"{run}/{child}" for run in ("w:r", "w:hyperlink/w:r") for child in _RUN_CONTENT),
+    namespaces=nsmap)
+# The text nodes of the same runs, which normalized templates are rendered into
+_TEXT_NODES = etree.XPath("w:r/w:t | w:hyperlink/w:r/w:t", namespaces=nsmap)
+
+# settings.xml variable normalize_template.py leaves on the templates it rewrote
+NORMALIZED_DOC_VAR = "pdfgen-normalized"
+_NORMALIZED_MARKER = etree.XPath("./w:docVars/w:docVar[@w:name = $name]", namespaces=nsmap)
+
+def apply_formatting_xml(new_r, original_r):
+    """apply_formatting() on raw w:r elements, writing the same rPr markup"""
+    rPr = original_r.rPr
+    new_rPr = new_r.get_or_add_rPr()
+    if rPr is not None:
+        name = rPr.rFonts_ascii
+        if name:
+            new_rPr.rFonts_ascii = name
+            new_rPr.rFonts_hAnsi = name
+            new_rPr.rFonts.set(qn('w:eastAsia'), name)
+        if rPr.sz_val:
+            new_rPr.sz_val = rPr.sz_val
+        color = rPr.color
+        if color is not None and color.val != ST_HexColorAuto.AUTO:
+            new_rPr._remove_color()
+            new_rPr.get_or_add_color().val = color.val
+    new_rPr._set_bool_val("b", None if rPr is None else rPr._get_bool_val("b"))
+    new_rPr._set_bool_val("i", None if rPr is None else rPr._get_bool_val("i"))
+
+def paragraph_text_xml(p):
+    """p.text of a w:p element, without python-docx's per-call XPath compilation"""
+    return "".join(str(e) for e in _PARAGRAPH_TEXT(p))
+
+def run_text_xml(r):
+    """r.text of a w:r element"""
+    return "".join(str(e) for e in _RUN_TEXT(r))
+
+def paragraph_text_elements_xml(p):
+    """The elements paragraph_text_xml() reads, in document order"""
+    return _PARAGRAPH_TEXT(p)
+
+def text_nodes_xml(p):
+    """The w:t elements of a paragraph's runs and hyperlink runs"""
+    return _TEXT_NODES(p)
+
+def is_normalized_xml(settings):
+    """Whether a w:settings element carries normalize_template.py's marker"""
+    return bool(_NORMALIZED_MARKER(settings, name=NORMALIZED_DOC_VAR))
+
+def placeholders_in_text_nodes_xml(p):
+    """Whether every placeholder of a paragraph lies inside a single w:t"""
+    in_nodes = sum(len(PLACEHOLDER_SYNTAX.findall(t.text or "")) for t in _TEXT_NODES(p))
+    return in_nodes == len(PLACEHOLDER_SYNTAX.findall(paragraph_text_xml(p)))
+
+def replace_in_text_nodes_xml(p, placeholders, pattern):
+    """Replace placeholders inside a paragraph's w:t elements, keeping its runs and formatting.
+
+    Only valid when placeholders_in_text_nodes_xml() holds; gives the same
+    text as replace_in_paragraph_xml() without rebuilding the paragraph.
+    """
+    for t in text_nodes_xml(p):
+        text = t.text or ""
+        if PLACEHOLDER_MARK in text:
+            new_text = substitute_placeholders(text, placeholders, pattern)
+            if new_text != text:
+                set_text_node_xml(t, new_text)
+
+def set_text_node_xml(t, text):
+    """Put `text` where a w:t is, as the w:t/w:tab/w:br run content the r.text setter writes"""
+    if not text:
+        # An empty w:t rather than none, so the run keeps its shape
+        t.attrib.clear()
+        t.text = None
+        return
+    scratch = OxmlElement("w:r")
+    _RunContentAppender.append_to_run_from_text(scratch, text)
+    for child in list(scratch):
+        t.addprevious(child)
+    t.getparent().remove(t)
+
+def replace_in_paragraph_xml(p, placeholders, pattern):
+    """replace_in_paragraph() working directly on a w:p element; returns its new text"""
+    original_text = paragraph_text_xml(p)
+    if PLACEHOLDER_MARK not in original_text:
+        return original_text
+    full_text = substitute_placeholders(original_text, placeholders, pattern)
+
+    if full_text != original_text:
+        rebuild_paragraph_xml(p, full_text)
+    return full_text
+
+def rebuild_paragraph_xml(p, text):
+    """Replace a paragraph's content with one run holding `text`, formatted like
+    its first run with text; returns the new w:r"""
+    original_runs = p.r_lst
+    for child in _PARAGRAPH_CONTENT(p):  # p.clear_content()
+        p.remove(child)
+    new_r = p.add_r()
+    if text:
+        # A fresh run has nothing for the r.text setter to clear first
+        _RunContentAppender.append_to_run_from_text(new_r, text)
+    original_r = next((r for r in original_runs if run_text_xml(r)), None)
+    if original_r is not None:
+        apply_formatting_xml(new_r, original_r)
+    return new_r
+
+def center_cell_xml(tc):
+    """Set vertical alignment on a w:tc the way cell.vertical_alignment does"""
+    tcPr = tc.find(_TC_PR)
+    if tcPr is None:
+        tc.get_or_add_tcPr().vAlign_val = WD_CELL_VERTICAL_ALIGNMENT.CENTER
+        return
+    # Same element in the same place as the vAlign_val setter writes, minus its
+    # generic child lookups, which dominate the cost on table-heavy templates
+    vAlign = tcPr.find(_V_ALIGN)
+    if vAlign is None:
+        vAlign = OxmlElement("w:vAlign")
+        successor = next(
+            (child for child in map(tcPr.find, _V_ALIGN_SUCCESSORS) if child is not None), None)
+        if successor is None:
+            tcPr.append(vAlign)
+        else:
+            successor.addprevious(vAlign)
+    vAlign.set(_VAL, _CENTER)
+
+def row_cells_xml(tr):
+    """w:tc elements in the order and multiplicity python-docx's row.cells yields"""
+    cells = []
+    for tc in tr.tc_lst:
+        # A vertically merged continuation cell stands for the cell that starts the span
+        while tc.vMerge == "continue":
+            tc = tc._tc_above
+        cells.extend([tc] * tc.grid_span)
+    return cells
+
+def story_paragraphs_xml(root):
+    """Paragraphs under `root` that may hold placeholders, innermost first.
+
+    Reverse document order visits a text-box paragraph before the paragraph
+    anchoring it, so rebuilding a paragraph never detaches one still to come.
+    """
+    paragraphs = _STORY_PARAGRAPHS(root)
+    paragraphs.reverse()
+    return paragraphs
+
+def replace_in_story_xml(root, placeholders, pattern, in_place=False):
+    """Replace placeholders throughout one story (body, header, footer, notes).
+
+    With in_place (normalized templates), paragraphs whose placeholders each
+    sit in one w:t are edited in their text nodes instead of being rebuilt.
+    """
+    paragraphs = story_paragraphs_xml(root)
+    metrics.count("paragraphs_visited", len(paragraphs))
+    if metrics.current_trace() is not None:
+        metrics.count("placeholders_replaced",
+                      sum(len(pattern.findall(paragraph_text_xml(p))) for p in paragraphs))
+    for p in paragraphs:
+        if in_place and placeholders_in_text_nodes_xml(p):
+            replace_in_text_nodes_xml(p, placeholders, pattern)
+        else:
+            replace_in_paragraph_xml(p, placeholders, pattern)
+
+def replace_in_body_xml(body, placeholders, pattern, prune_rows=False, normalized=False):
+    """Replace placeholders anywhere in a w:body and centre its table cells.
+
+    With prune_rows, remove_empty_rows() is folded into the same table pass:
+    each row's cell grid is worked out once and its fate decided from the
+    placeholder values, so dropped rows are gone before any text is rebuilt.
+    A normalized template already has its cells centred and is rendered in place.
+    """
+    if normalized and not prune_rows:
+        replace_in_story_xml(body, placeholders, pattern, in_place=True)
+        return
+
+    for tbl in _BODY_TABLES(body):
+        rows_to_remove = []
+        for tr in tbl.tr_lst:
+            cells = row_cells_xml(tr)
+            if prune_rows and len(cells) > 2 and is_empty_price_row(
+                    rendered_cell_text(cell_texts_xml(cells[0]), placeholders, pattern),
+                    rendered_cell_text(cell_texts_xml(cells[2]), placeholders, pattern)):
+                rows_to_remove.append(tr)
+                continue
+            if not normalized:
+                for tc in cells:
+                    center_cell_xml(tc)
+
+        # Removing as we go would shift the rows vMerge continuations look up
+        for tr in rows_to_remove:
+            tbl.remove(tr)
+        metrics.count("rows_removed", len(rows_to_remove))
+
+    replace_in_story_xml(body, placeholders, pattern, in_place=normalized)
+
+def cell_texts_xml(tc):
+    """Texts of a w:tc element's own paragraphs, which cell.text joins with newlines"""
+    return [paragraph_text_xml(p) for p in tc.p_lst]
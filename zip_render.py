@@ -0,0 +1,200 @@
+import copy
+import struct
+import time
+import zipfile
+
+from docx.opc.constants import CONTENT_TYPE as CT
+from docx.oxml import parse_xml
+from lxml import etree
+
+import metrics
+from render import placeholder_pattern
+from xml_render import NORMALIZED_DOC_VAR, is_normalized_xml, replace_in_body_xml, replace_in_story_xml
+
+MAIN_DOCUMENT_TYPES = (
+    CT.WML_DOCUMENT_MAIN,
+    "application/vnd.ms-word.document.macroEnabled.main+xml",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.template.main+xml",
+    "application/vnd.ms-word.template.macroEnabledTemplate.main+xml",
+)
+# Parts other than the main document whose text the proposal can show
+STORY_TYPES = (CT.WML_HEADER, CT.WML_FOOTER, CT.WML_FOOTNOTES, CT.WML_ENDNOTES)
+SETTINGS_TYPES = (CT.WML_SETTINGS,)
+
+# Placeholders are "<<...>>" in text, which the part XML stores as "&lt;&lt;...";
+# a run boundary may fall between the two, so look for the single entity
+ESCAPED_MARK = b"&lt;"
+
+_CONTENT_TYPE_OVERRIDES = etree.XPath(
+    "/ct:Types/ct:Override",
+    namespaces={"ct": "http://schemas.openxmlformats.org/package/2006/content-types"})
+
+_LOCAL_HEADER = struct.Struct(zipfile.structFileHeader)
+_DATA_DESCRIPTOR_FLAG = 0x08
+COPY_CHUNK_SIZE = 1024 * 1024
+# Streamed parts are compressed in pieces of about this size
+STREAM_CHUNK_SIZE = 256 * 1024
+
+# Member timestamp for re-packed packages, so equal content gives equal bytes
+FIXED_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+def render_docx(template, placeholders, out, include_main=True, date_time=None):
+    """Render a proposal by rewriting only the template parts that change.
+
+    `template` and `out` are paths or binary file objects. The main document
+    part is rendered like replace_and_format() + remove_empty_rows(), headers,
+    footers and notes are rewritten only when they hold placeholders, and
+    every other entry (media, styles, themes, ...) is copied across as its
+    original compressed bytes without being inflated again.
+
+    include_main=False leaves the main part alone, for packages whose body was
+    already rendered through python-docx. A `date_time` stamps every member
+    with that time instead of keeping the template's. Templates rewritten by
+    normalize_template.py have their placeholders filled in place.
+    """
+    pattern = placeholder_pattern(placeholders)
+    with zipfile.ZipFile(template) as zin, zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zout:
+        main_parts, story_parts, settings_parts = find_parts(zin)
+        normalized = is_normalized_package(zin, settings_parts)
+        replace_seconds = save_seconds = 0.0
+        for info in zin.infolist():
+            start = time.perf_counter()
+            if info.filename in main_parts and include_main:
+                xml = render_main_part(zin.read(info), placeholders, pattern, normalized)
+            elif info.filename in story_parts:
+                xml = render_story_part(zin.read(info), placeholders, pattern, normalized)
+            else:
+                xml = None
+
+            rendered = time.perf_counter()
+            if xml is None:
+                copy_raw_entry(zin, info, zout, date_time=date_time)
+            else:
+                write_part(zout, info, xml, date_time=date_time)
+            replace_seconds += rendered - start
+            save_seconds += time.perf_counter() - rendered
+    metrics.add_stage("replace", replace_seconds)
+    metrics.add_stage("save", save_seconds)
+    return out
+
+def find_parts(zin):
+    """Return zip member names of the main document part, the other story parts
+    and the settings part"""
+    content_types = etree.fromstring(zin.read("[Content_Types].xml"))
+    main_parts, story_parts, settings_parts = set(), set(), set()
+    for override in _CONTENT_TYPE_OVERRIDES(content_types):
+        member = override.get("PartName").lstrip("/")
+        if override.get("ContentType") in MAIN_DOCUMENT_TYPES:
+            main_parts.add(member)
+        elif override.get("ContentType") in STORY_TYPES:
+            story_parts.add(member)
+        elif override.get("ContentType") in SETTINGS_TYPES:
+            settings_parts.add(member)
+    return main_parts, story_parts, settings_parts
+
+def is_normalized_package(zin, settings_parts):
+    """Whether normalize_template.py has rewritten this template"""
+    for name in settings_parts:
+        xml = zin.read(name)
+        # Settings are small, but most templates can skip parsing them altogether
+        if NORMALIZED_DOC_VAR.encode() in xml and is_normalized_xml(parse_xml(xml)):
+            return True
+    return False
+
+def render_main_part(xml, placeholders, pattern, normalized=False):
+    """Rendered bytes of word/document.xml"""
+    document = parse_xml(xml)
+    replace_in_body_xml(document.body, placeholders, pattern, prune_rows=True, normalized=normalized)
+    return serialize_part(document)
+
+def render_story_part(xml, placeholders, pattern, normalized=False):
+    """Rendered bytes of a header, footer or notes part, or None when it has no placeholders"""
+    if ESCAPED_MARK not in xml:
+        return None
+    root = parse_xml(xml)
+    replace_in_story_xml(root, placeholders, pattern, in_place=normalized)
+    return serialize_part(root)
+
+def serialize_part(element):
+    """Part XML exactly as python-docx's doc.save() writes it"""
+    return etree.tostring(element, encoding="UTF-8", standalone=True)
+
+def write_part(zout, info, data, date_time=None):
+    """Write rewritten part bytes under the original member's name and timestamp"""
+    zinfo = zipfile.ZipInfo(info.filename, date_time=date_time or info.date_time)
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.external_attr = info.external_attr
+    zout.writestr(zinfo, data)
+
+def write_part_chunks(zout, info, chunks, date_time=None):
+    """write_part() for part bytes given as an iterable of chunks, compressed as they come.
+
+    Small chunks are gathered into pieces of STREAM_CHUNK_SIZE and big ones are
+    fed through in slices of it, so neither the part nor its compressed form is
+    ever held whole; deflate gives the same bytes however its input is split.
+    Returns the seconds spent compressing and writing.
+    """
+    zinfo = zipfile.ZipInfo(info.filename, date_time=date_time or info.date_time)
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.external_attr = info.external_attr
+    seconds = 0.0
+    pending = []
+    pending_bytes = 0
+    with zout.open(zinfo, "w") as dest:
+        def flush():
+            nonlocal seconds, pending_bytes
+            start = time.perf_counter()
+            dest.write(b"".join(pending))
+            seconds += time.perf_counter() - start
+            pending.clear()
+            pending_bytes = 0
+
+        for chunk in chunks:
+            if len(chunk) < STREAM_CHUNK_SIZE:
+                pending.append(chunk)
+                pending_bytes += len(chunk)
+                if pending_bytes >= STREAM_CHUNK_SIZE:
+                    flush()
+                continue
+            if pending:
+                flush()
+            start = time.perf_counter()
+            view = memoryview(chunk)
+            for i in range(0, len(view), STREAM_CHUNK_SIZE):
+                dest.write(view[i:i + STREAM_CHUNK_SIZE])
+            seconds += time.perf_counter() - start
+        if pending:
+            flush()
+    return seconds
+
+def copy_raw_entry(zin, info, zout, date_time=None):
+    """Copy one member's compressed bytes from `zin` into `zout` untouched.
+
+    zipfile has no public API for this, so the local header is written from
+    the member's central-directory record and zout's bookkeeping is updated
+    the same way ZipFile.write() does.
+    """
+    src = zin.fp
+    src.seek(info.header_offset)
+    header = _LOCAL_HEADER.unpack(src.read(_LOCAL_HEADER.size))
+    src.seek(header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH], 1)
+
+    zinfo = copy.copy(info)
+    # Sizes and CRC go in the local header, so no trailing data descriptor
+    zinfo.flag_bits &= ~_DATA_DESCRIPTOR_FLAG
+    if date_time is not None:
+        zinfo.date_time = date_time
+    with zout._lock:
+        zinfo.header_offset = zout.fp.tell()
+        zout.fp.write(zinfo.FileHeader())
+        remaining = info.compress_size
+        while remaining:
+            chunk = src.read(min(COPY_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise zipfile.BadZipFile(f"Truncated member in template: {info.filename}")
+            zout.fp.write(chunk)
+            remaining -= len(chunk)
+        zout.filelist.append(zinfo)
+        zout.NameToInfo[zinfo.filename] = zinfo
+        zout.start_dir = zout.fp.tell()
+        zout._didModify = True